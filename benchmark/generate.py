@@ -0,0 +1,144 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# 每块生成的行数，块内用 [seed, 块号] 作为随机种子，同一种子得到的数据与机器和块的调度无关
+CHUNK_ROWS = 1_000_000
+MARKETS = [("US", "USD", 0.7), ("HK", "HKD", 0.2), ("SH", "CNH", 0.1)]
+
+
+def ticker(k):
+    # 编号 -> 不重复的纯字母代码 A, B, ..., Z, AA, AB, ...
+    name = ""
+    k += 1
+    while k:
+        k, r = divmod(k-1, 26)
+        name = chr(65+r)+name
+    return name
+
+
+def make_symbols(seed, stocks=2000, options=3000):
+    # 股票和期权代码表，期权为长桥格式 AAPL250117C150000.US
+    rng = np.random.default_rng([seed, 0])
+    markets = rng.choice(len(MARKETS), stocks, p=[m[2] for m in MARKETS])
+    names, currencies = [], []
+    for k, market in enumerate(markets):
+        code, currency, _ = MARKETS[market]
+        if code == "US":
+            name = ticker(k)
+        else:
+            name = f"{k:05d}" if code == "HK" else f"{600000+k}"
+        names.append((code, name))
+        currencies.append(currency)
+    underlyings = [name for (code, name) in names if code == "US"]
+    for k in range(options):
+        underlying = underlyings[k % len(underlyings)]
+        expiry = f"{22+k % 4}{1+k % 12:02d}{1+k % 28:02d}"
+        strike = int(rng.integers(1, 500))*1000
+        names.append(("US", f"{underlying}{expiry}{'CP'[k % 2]}{strike}"))
+        currencies.append("USD")
+    return names, np.array(currencies), np.array([False]*stocks+[True]*options)
+
+
+def symbol_text(names, platform):
+    # 富途为 US.AAPL，长桥为 AAPL.US
+    if platform == "futu":
+        return np.array([f"{code}.{name}" for code, name in names])
+    return np.array([f"{name}.{code}" for code, name in names])
+
+
+def generate_chunk(seed, k, rows, start, span, symbols, currencies, is_option, buy_bias):
+    rng = np.random.default_rng([seed, k+2])
+    # 少数活跃股票占大部分成交
+    weights = 1/np.arange(1, len(symbols)+1)
+    code = rng.choice(len(symbols), rows, p=weights/weights.sum())
+    qty = rng.integers(1, 200, rows)
+    price = np.round(rng.lognormal(3.5, 1.2, rows), 3)
+    option = is_option[code]
+    qty[option] = rng.integers(1, 10, option.sum())
+    price[option] = np.round(rng.uniform(0.01, 30, option.sum()), 2)
+    # 期权到期作废等记录没有成交价
+    price[option & (rng.random(rows) < 0.05)] = np.nan
+    # 每只股票买入概率不同，仓位会穿过零点，同时出现做多和做空
+    buy = rng.random(rows) < buy_bias[code]
+    fee = np.round(rng.uniform(0, 10, rows), 2)
+    seconds = start+np.sort(rng.integers(0, span, rows))
+    return pd.DataFrame({
+        "code":code,
+        "qty":qty,
+        "price":price,
+        "buy":buy,
+        "fee":fee,
+        "currency":currencies[code],
+        "time":pd.Timestamp("2020-01-01")+pd.to_timedelta(seconds, unit="s"),
+    })
+
+
+def generate(rows, seed=0, years=3, platform="longbridge"):
+    # 按块产生 (块号, 标准格式 DataFrame)，时间在块内和块间递增，块内打乱顺序模拟导出文件的顺序
+    names, currencies, is_option = make_symbols(seed)
+    symbols = symbol_text(names, platform)
+    buy_bias = np.random.default_rng([seed, 1]).uniform(0.35, 0.65, len(symbols))
+    total = years*365*86400
+    chunks = max(1, -(-rows//CHUNK_ROWS))
+    for k in range(chunks):
+        n = min(CHUNK_ROWS, rows-k*CHUNK_ROWS)
+        start, end = total*k//chunks, total*(k+1)//chunks
+        df = generate_chunk(seed, k, n, start, end-start, symbols, currencies, is_option, buy_bias)
+        df = df.sample(frac=1, random_state=seed+k).reset_index(drop=True)
+        yield k, df, symbols
+
+
+def history_frame(df, symbols, platform):
+    # data/{platform}_history.csv 的格式，富途的数量可以是小数（碎股）
+    qty = df["qty"]*0.5 if platform == "futu" else df["qty"]
+    return pd.DataFrame({
+        "股票代码":symbols[df["code"].to_numpy()],
+        "数量":qty,
+        "成交价格":df["price"],
+        "买卖方向":np.where(df["buy"], "OrderSide.Buy", "OrderSide.Sell"),
+        "结算币种":df["currency"],
+        "合计手续费":df["fee"],
+        "交易时间":df["time"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def futu_raw_frame(df, symbols, k):
+    # futu/download.py 写出的 data/futu_history_raw.csv 格式，create_time 带毫秒
+    millis = (np.arange(len(df)) % 1000).astype(str)
+    return pd.DataFrame({
+        "order_id":[f"{k}-{i}" for i in range(len(df))],
+        "code":symbols[df["code"].to_numpy()],
+        "dealt_qty":df["qty"]*0.5,
+        "dealt_avg_price":df["price"],
+        "trd_side":np.where(df["buy"], "BUY", "SELL"),
+        "currency":df["currency"],
+        "create_time":df["time"].dt.strftime("%Y-%m-%d %H:%M:%S.")+np.char.zfill(millis, 3),
+        "acc_id":1000+k % 3,
+        "合计手续费":df["fee"],
+    })
+
+
+def write(directory, rows, seed=0, years=3, platform="longbridge"):
+    # 在 directory/data 下写出历史文件，富途同时写出原始文件供导出步骤使用
+    os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+    history_path = os.path.join(directory, "data", f"{platform}_history.csv")
+    raw_path = os.path.join(directory, "data", "futu_history_raw.csv")
+    for k, df, symbols in generate(rows, seed, years, platform):
+        mode, header = ("w", True) if k == 0 else ("a", False)
+        history_frame(df, symbols, platform).to_csv(history_path, mode=mode, header=header, index=False)
+        if platform == "futu":
+            futu_raw_frame(df, symbols, k).to_csv(raw_path, mode=mode, header=header, index=False)
+    return history_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成可复现的模拟交易历史')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--platform', choices=['longbridge', 'futu'], default='longbridge')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--out', default='.', help='输出目录，文件写入其中的 data/ 下')
+    args = parser.parse_args()
+    print(f"已写入 {write(args.out, args.rows, args.seed, args.years, args.platform)}")
@@ -0,0 +1,182 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform as host
+import runpy
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import engine
+import loader
+import storage
+from generate import write
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+WORK_DIR = os.path.join(HERE, 'work')
+# 低于该时间的阶段只看绝对差值，避免计时噪声误报
+NOISE_FLOOR = 0.05
+
+
+class CountSink:
+    # 只计数不输出，用于单独计算配对耗时
+    def __init__(self):
+        self.count = 0
+
+    def add(self, row, record):
+        self.count += 1
+
+
+def timed(results, stage, func, *args):
+    started = time.perf_counter()
+    value = func(*args)
+    results[stage] = round(time.perf_counter()-started, 4)
+    return value
+
+
+def match_all(trades, method, sinks_for_year):
+    # 按年份逐段配对，sinks_for_year(year) 返回该年的 sink
+    book = engine.new_book(method, len(trades.symbols))
+    steps = [engine.METHODS[method]]
+    for year, start, end in trades.year_slices():
+        sink = sinks_for_year(year)
+        engine.match_rows(trades, steps, [book], start, end, [sink])
+        if hasattr(sink, 'close'):
+            sink.close()
+
+
+def bench(platform, rows, methods, seed, years, work, workers=1):
+    # 在 work 目录下生成数据并依次计时各阶段，返回 {阶段: 秒}
+    directory = os.path.abspath(os.path.join(work, f"{platform}_{rows}_{seed}_{years}"))
+    history_path = os.path.join(directory, 'data', f'{platform}_history.csv')
+    results = {}
+    if not os.path.exists(history_path):
+        print(f"生成 {platform} {rows} 行模拟数据 -> {directory}")
+        write(directory, rows, seed, years, platform)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        if platform == 'futu':
+            export = runpy.run_path(os.path.join(ROOT, 'futu', 'export.py'))['main']
+            with contextlib.redirect_stdout(io.StringIO()):
+                timed(results, 'export', export)
+        df = timed(results, 'read_csv', loader.read_table, f'data/{platform}_history.csv', loader.HISTORY_SCHEMA,
+                   None, False, True, False)
+        df['交易时间'] = timed(results, 'parse_time', loader.parse_time, df['交易时间'])
+        df = timed(results, 'sort', lambda: df.sort_values('交易时间', kind='stable'))
+        timed(results, 'hash', storage.year_manifest, df)
+        trades = timed(results, 'columns', engine.TradeColumns, df)
+        results['matches'] = {}
+        for method in methods:
+            sink = CountSink()
+            timed(results, f'match_method{method}', match_all, trades, method, lambda year: sink)
+            results['matches'][f'method{method}'] = sink.count
+            timed(results, f'match_write_method{method}', match_all, trades, method,
+                  lambda year: engine.ProfitWriter(trades, f"data/{platform}_method{method}_profit_{year}.csv"))
+            # 写文件耗时 = 配对并写文件 - 只配对
+            results[f'write_method{method}'] = round(max(0.0, results.pop(f'match_write_method{method}')-results[f'match_method{method}']), 4)
+        # report.py 会解析命令行参数，运行时换成不带参数的命令行
+        argv, sys.argv = sys.argv, [os.path.join(ROOT, 'report.py')]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                timed(results, 'report', runpy.run_path, os.path.join(ROOT, 'report.py'), None, '__main__')
+        finally:
+            sys.argv = argv
+        # 入口脚本的完整耗时，包括读取、哈希、快照等
+        with contextlib.redirect_stdout(io.StringIO()):
+            timed(results, 'run', engine.run, platform, methods, None, False, None, workers)
+    finally:
+        os.chdir(cwd)
+    results['rows'] = rows
+    return results
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(key, results, baseline, tolerance):
+    # 与基线对比，返回变慢超过容忍度的阶段
+    base = baseline.get(key, {}).get('results')
+    if not base:
+        print(f"{key}: 没有基线")
+        return []
+    regressions = []
+    for stage, seconds in results.items():
+        if stage in ('rows', 'rows_per_sec', 'matches') or stage not in base:
+            continue
+        ratio = seconds/base[stage] if base[stage] else float('inf')
+        slower = seconds > base[stage]*(1+tolerance) and seconds-base[stage] > NOISE_FLOOR
+        print(f"  {stage:<16} {base[stage]:>9.3f}s -> {seconds:>9.3f}s  x{ratio:.2f}{'  变慢' if slower else ''}")
+        if slower:
+            regressions.append(stage)
+    if base.get('matches') and results['matches'] != base['matches']:
+        print(f"  配对条数变化: {base['matches']} -> {results['matches']}")
+        regressions.append('matches')
+    return regressions
+
+
+def environment():
+    return {
+        "python":host.python_version(),
+        "numpy":np.__version__,
+        "pandas":pd.__version__,
+        "machine":host.machine(),
+        "processor":host.processor(),
+    }
+
+
+def main(platforms, sizes, methods, seed=0, years=3, work=WORK_DIR, repeat=1, save=False, tolerance=0.2, workers=1):
+    baseline = load_baseline()
+    regressions = {}
+    for platform in platforms:
+        for rows in sizes:
+            key = f"{platform}/{rows}"
+            runs = [bench(platform, rows, methods, seed, years, work, workers) for _ in range(repeat)]
+            # 多次运行时每个阶段取最快的一次
+            results = dict(runs[0])
+            for stage, value in results.items():
+                if isinstance(value, float):
+                    results[stage] = min(run[stage] for run in runs)
+            results['rows_per_sec'] = round(rows/max(results['run'], 1e-9))
+            print(f"{key}: {json.dumps(results, ensure_ascii=False)}")
+            found = compare(key, results, baseline, tolerance)
+            if found:
+                regressions[key] = found
+            if save:
+                baseline[key] = {"seed":seed, "years":years, "environment":environment(), "results":results}
+    if save:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {BASELINE_PATH}")
+    elif regressions:
+        print(f"以下阶段比基线慢超过 {tolerance:.0%}: {regressions}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='各配对方式的读取、排序、配对、写出耗时基准测试')
+    parser.add_argument('--platforms', nargs='+', choices=['longbridge', 'futu'], default=['longbridge', 'futu'])
+    parser.add_argument('--rows', nargs='+', type=int, default=[10_000, 100_000, 1_000_000],
+                        help='每个平台的交易行数，可到 10000000')
+    parser.add_argument('--methods', nargs='+', type=int, default=sorted(engine.METHODS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--work', default=WORK_DIR, help='模拟数据目录，已生成的数据会重复使用')
+    parser.add_argument('--repeat', type=int, default=1, help='每个规模运行的次数，取各阶段最快的一次')
+    parser.add_argument('--save', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许比基线慢的比例')
+    parser.add_argument('--workers', type=int, default=1, help='完整运行时按股票分片并行配对的进程数')
+    args = parser.parse_args()
+    sys.exit(main(args.platforms, args.rows, args.methods, args.seed, args.years,
+                  args.work, args.repeat, args.save, args.tolerance, args.workers))
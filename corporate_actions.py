@@ -0,0 +1,133 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import loader
+from profiler import PROFILER
+
+ACTIONS_PATH = os.path.join('data', 'corporate_actions.csv')
+# 与 fx.py 相同：日期加上偏移后与股票编号拼成一个64位有序键：股票编号 << 32 | 日期
+DAY_OFFSET = 1 << 31
+
+
+class CorporateActions:
+    # 按 (股票身份, 生效日期) 排序的公司行为索引，一次 searchsorted 找到每笔成交之后的第一个公司行为（as-of）
+    # 同一个代码在改入或改出的日期前后属于不同的股票身份：改名后旧代码可能被另一只股票重新使用，
+    # 新代码在改入之前也可能属于另一只股票。成交和公司行为都先按代码和日期确定身份，再按身份查找
+    # 每个公司行为预先合并到下一次改代码为止：这段时间内各比例之积、改成的新身份和改代码的日期
+    def __init__(self, path=ACTIONS_PATH):
+        with open(path, 'rb') as f:
+            self.digest = hashlib.sha256(f.read()).hexdigest()
+        df = loader.read_table(path, loader.ACTION_SCHEMA)
+        df = df[df['股票代码'].notna() & df['生效日期'].notna()]
+        ratio = df['比例'].fillna(1.0).to_numpy(np.float64)
+        if (ratio <= 0).any():
+            raise loader.SchemaError(f"{path} 的比例必须为正数")
+        # 新代码为空或与原代码相同时只是拆股/合股
+        target = [t if pd.notna(t) and t != s else None for s, t in zip(df['股票代码'], df['新代码'])]
+        symbols = sorted(set(df['股票代码']) | {t for t in target if t is not None})
+        self.symbols = {s:k for k, s in enumerate(symbols)}
+        ids = df['股票代码'].map(self.symbols).to_numpy(np.int64)
+        days = df['生效日期'].to_numpy('datetime64[D]').astype(np.int64)+DAY_OFFSET
+        renames = [(k, self.symbols[t]) for k, t in enumerate(target) if t is not None]
+
+        # 每个代码的身份分界日：改入和改出该代码的日期，分界日当天及之后的成交属于下一个身份
+        boundaries = [set() for _ in symbols]
+        arrivals = set()
+        for k, target_id in renames:
+            boundaries[ids[k]].add(days[k])
+            boundaries[target_id].add(days[k])
+            arrivals.add((target_id, days[k]))
+        counts = np.array([len(b) for b in boundaries], dtype=np.int64)
+        # 身份编号 = 代码的第一个身份编号 + 该代码在此之前经过的分界日数
+        self.base = np.concatenate([[0], np.cumsum(counts+1)[:-1]])
+        self.bounds = np.sort(np.array([i << 32 | d for i, b in enumerate(boundaries) for d in b], dtype=np.int64))
+        self.names = np.array([s for s, c in zip(symbols, counts) for _ in range(c+1)], dtype=object)
+
+        # 改代码属于改出前的身份；其他公司行为属于生效日当天的身份，当天改入时属于改入后的身份
+        idents = self.identity(ids, days, side='left')
+        idents += np.array([(i, d) in arrivals for i, d in zip(ids, days)], dtype=np.int64)
+        targets = np.full(len(ids), -1, dtype=np.int64)
+        for k, target_id in renames:
+            idents[k] = self.identity(np.array([ids[k]]), np.array([days[k]]), side='left')[0]
+            targets[k] = self.identity(np.array([target_id]), np.array([days[k]]), side='right')[0]
+
+        keys = idents << 32 | days
+        order = np.argsort(keys, kind='stable')
+        self.keys, ratio, days, targets = keys[order], ratio[order], days[order], targets[order]
+
+        # 公司行为表很小，从后往前逐条合并
+        n = len(self.keys)
+        self.factor = ratio.copy()
+        self.renamed = np.full(n, -1, dtype=np.int64)
+        self.rename_day = np.zeros(n, dtype=np.int64)
+        for k in range(n-1, -1, -1):
+            if targets[k] >= 0:
+                self.renamed[k] = targets[k]
+                self.rename_day[k] = days[k]
+            elif k+1 < n and self.keys[k+1] >> 32 == self.keys[k] >> 32:
+                self.factor[k] *= self.factor[k+1]
+                self.renamed[k] = self.renamed[k+1]
+                self.rename_day[k] = self.rename_day[k+1]
+
+    def identity(self, ids, days, side='right'):
+        # 代码编号和日期 -> 身份编号：side 为 'right' 时分界日当天计入之后的身份，'left' 时计入之前的身份
+        passed = (np.searchsorted(self.bounds, ids << 32 | days, side=side)
+                  -np.searchsorted(self.bounds, ids << 32, side='left'))
+        return self.base[ids]+passed
+
+    def lookup(self, idents, days):
+        # 每笔成交日期之后（不含当天）到下一次改代码为止的比例之积、新身份（没有为 -1）和改代码的日期
+        keys = idents << 32 | days
+        pos = np.searchsorted(self.keys, keys, side='right')
+        found = pos < len(self.keys)
+        pos = np.where(found, pos, 0)
+        found &= (self.keys[pos] >> 32) == idents
+        return np.where(found, self.factor[pos], 1.0), np.where(found, self.renamed[pos], -1), self.rename_day[pos]
+
+    def adjust(self, df):
+        # 生效日期之前的成交换算为公司行为之后的数量、价格和代码，只处理表中出现过的代码的成交
+        # 改代码后按新身份继续查找，新代码在改代码当天及之后的公司行为同样适用
+        rows = np.flatnonzero((df['股票代码'].isin(list(self.symbols)) & df['交易时间'].notna()).to_numpy())
+        if not len(rows):
+            return df
+        with PROFILER.stage("actions", len(rows)):
+            codes, uniques = pd.factorize(df['股票代码'].iloc[rows].astype(object))
+            ids = np.array([self.symbols[s] for s in uniques], dtype=np.int64)[codes]
+            days = df['交易时间'].iloc[rows].to_numpy('datetime64[D]').astype(np.int64)+DAY_OFFSET
+            idents = self.identity(ids, days)
+            factor = np.ones(len(rows))
+            moved_rows = np.zeros(len(rows), dtype=bool)
+            pending = np.arange(len(rows))
+            # 每一轮处理一次改代码，轮数不超过公司行为的条数，否则改代码形成了循环
+            for _ in range(len(self.keys)+1):
+                part, renamed, rename_day = self.lookup(idents[pending], days[pending])
+                factor[pending] *= part
+                moved = renamed >= 0
+                if not moved.any():
+                    break
+                pending = pending[moved]
+                idents[pending] = renamed[moved]
+                days[pending] = rename_day[moved]-1
+                moved_rows[pending] = True
+            else:
+                raise ValueError("公司行为表中的改代码形成了循环")
+            changed = (factor != 1.0) | moved_rows
+            qty = df['数量'].to_numpy(np.float64, copy=True)
+            price = df['成交价格'].to_numpy(np.float64, copy=True)
+            qty[rows] *= factor
+            price[rows] /= factor
+            symbols = df['股票代码'].astype(object).to_numpy(copy=True)
+            symbols[rows[moved_rows]] = self.names[idents[moved_rows]]
+            df = df.assign(股票代码=pd.Categorical(symbols), 数量=qty, 成交价格=price)
+        print(f"按公司行为调整了 {int(changed.sum())} 笔成交")
+        return df
+
+    def salt(self):
+        # 参与快照哈希，公司行为表变化后从头重新计算
+        return f"actions:{self.digest}".encode()
+
+
+def load(path=ACTIONS_PATH):
+    # 公司行为表存在时返回其索引，否则返回 None
+    return CorporateActions(path) if os.path.exists(path) else None
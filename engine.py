@@ -0,0 +1,761 @@
+import csv
+import hashlib
+import heapq
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from math import copysign
+import numpy as np
+import pandas as pd
+import corporate_actions
+import loader
+from profiler import PROFILER
+import storage
+import symbol_registry
+
+# 配对原因编码
+SHORT_CLOSE = "做空了结"
+LONG_CLOSE = "做多了结"
+
+
+class PositionBook:
+    # 以股票编号为下标的持仓数组：带方向的数量、均价和尚未分摊的手续费，即原逐笔实现中 holdings[symbol] 的三个字段
+    # 定点模式的子类把 dtype 换成整数
+    dtype = np.float64
+
+    def __init__(self, size):
+        self.quantity = np.zeros(size, dtype=self.dtype)
+        self.avg_cost = np.zeros(size, dtype=self.dtype)
+        self.total_fee = np.zeros(size, dtype=self.dtype)
+
+    def views(self):
+        # memoryview 直接读写数组内存，单个元素的存取比 numpy 下标快且返回 Python float
+        return memoryview(self.quantity), memoryview(self.avg_cost), memoryview(self.total_fee)
+
+    def state(self):
+        return {
+            "quantity":self.quantity,
+            "avg_cost":self.avg_cost,
+            "total_fee":self.total_fee
+        }
+
+    def load_state(self, state, index):
+        # index 把快照中的股票编号映射为当前编号，快照里没有的股票保持空仓
+        self.quantity[index] = state["quantity"]
+        self.avg_cost[index] = state["avg_cost"]
+        self.total_fee[index] = state["total_fee"]
+
+
+def step_method1(quantity, avg_cost, total_fee, row, i, qty, price, fee):
+    # 加权平均法，与原 process_item 逐笔计算的结果一致：平仓按平仓数量比例分摊持仓手续费和本笔手续费，
+    # 卖出多于多头持仓时不翻为空头、只减少数量（见下方恒成立的条件）
+    cur_qty = quantity[i]
+    if qty > 0:
+        if cur_qty < 0:
+            # 回补
+            qty1 = min(qty, abs(cur_qty))
+            total_buy_cost = qty1/abs(cur_qty)*total_fee[i]+fee*qty1/qty+qty1*price
+            earn = qty1*avg_cost[i]-total_buy_cost
+            record = (SHORT_CLOSE, avg_cost[i], total_buy_cost/qty1, qty1, earn)
+            if qty < abs(cur_qty):
+                quantity[i] += qty
+                total_fee[i] *= (1-qty/abs(cur_qty))
+            else:
+                delta_qty = qty-abs(cur_qty)
+                quantity[i] = delta_qty
+                avg_cost[i] = price
+                total_fee[i] = fee/qty*delta_qty
+            return record
+        total_buy_cost = avg_cost[i]*quantity[i]+qty*price
+        avg_cost[i] = total_buy_cost/(qty+quantity[i])
+        quantity[i] += qty
+        total_fee[i] += fee
+    elif qty < 0:
+        if cur_qty > 0:
+            qty1 = min(abs(qty), abs(cur_qty))
+            total_buy_cost = qty1/abs(cur_qty)*total_fee[i]+fee*qty1/abs(qty)+qty1*avg_cost[i]
+            earn = abs(qty1)*price-total_buy_cost
+            record = (LONG_CLOSE, price, total_buy_cost/qty1, abs(qty1), earn)
+            # qty 为负数，原实现中该条件恒成立
+            if qty < abs(cur_qty):
+                quantity[i] += qty
+                total_fee[i] *= (1-abs(qty)/cur_qty)
+            else:
+                delta_qty = abs(cur_qty)-qty
+                quantity[i] = delta_qty
+                avg_cost[i] = price
+                total_fee[i] = fee/abs(qty)*delta_qty
+            return record
+        total_sell_cost = avg_cost[i]*abs(quantity[i])+abs(qty)*price
+        avg_cost[i] = total_sell_cost/(abs(qty)+abs(quantity[i]))
+        quantity[i] += qty
+        total_fee[i] += fee
+    return None
+
+
+def step_method2(quantity, avg_cost, total_fee, row, i, qty, price, fee):
+    # 移动加权平均法，与原 process_item 逐笔计算的结果一致：只有一次平掉全部持仓时才记一条明细，
+    # 部分平仓的盈亏摊入剩余持仓的均价，持仓手续费清零；回补空头后反手做多时均价不更新
+    cur_qty = quantity[i]
+    record = None
+    if qty > 0:
+        if cur_qty < 0:
+            qty1 = min(qty, abs(cur_qty))
+            total_buy_cost = total_fee[i]+abs(qty1/qty)*fee+qty1*price
+            earn = qty1*avg_cost[i]-total_buy_cost
+            if qty1 == abs(cur_qty):
+                record = (SHORT_CLOSE, avg_cost[i], total_buy_cost/qty1, qty1, earn)
+            delta_qty = qty-abs(cur_qty)
+            quantity[i] = delta_qty
+            if delta_qty > 0:
+                # 原实现写入的是未被读取的 price 字段，avg_cost 保持不变
+                total_fee[i] = delta_qty/qty*fee
+            else:
+                cur_qty -= abs(qty)
+                avg_cost[i] = 0 if cur_qty == 0 else (abs(qty)*avg_cost[i]-total_buy_cost)/abs(cur_qty)
+                total_fee[i] = 0
+            return record
+        total_buy_cost = avg_cost[i]*quantity[i]+qty*price
+        avg_cost[i] = total_buy_cost/(qty+quantity[i])
+        quantity[i] += qty
+        total_fee[i] += fee
+    elif qty < 0:
+        if cur_qty > 0:
+            qty1 = min(abs(qty), cur_qty)
+            total_buy_cost = total_fee[i]+abs(qty1/qty)*fee+cur_qty*avg_cost[i]
+            earn = abs(qty1)*price-total_buy_cost
+            if qty1 == cur_qty:
+                record = (LONG_CLOSE, price, total_buy_cost/qty1, abs(qty1), earn)
+            delta_qty = cur_qty-abs(qty)
+            quantity[i] = delta_qty
+            if delta_qty < 0:
+                total_fee[i] = (abs(delta_qty)/abs(qty))*fee
+                avg_cost[i] = price
+            else:
+                cur_qty -= abs(qty)
+                avg_cost[i] = 0 if cur_qty == 0 else (total_buy_cost-abs(qty)*price)/cur_qty
+                total_fee[i] = 0
+            return record
+        total_sell_cost = avg_cost[i]*abs(quantity[i])+abs(qty)*price
+        avg_cost[i] = total_sell_cost/(abs(qty)+abs(quantity[i]))
+        quantity[i] += qty
+        total_fee[i] += fee
+    return record
+
+
+class LotBook(PositionBook):
+    # 先进先出法的持仓：每个股票一个开仓批次队列，批次为 [数量(带方向), 价格, 剩余手续费, 开仓行号]
+    # 同一队列内批次方向一致，数组中的数量、均价、手续费为队列的汇总值
+    def __init__(self, size, selection=None):
+        super().__init__(size)
+        self.lots = [deque() for _ in range(size)]
+        # 指定批次模式：平仓行号 -> [(开仓行号, 数量), ...]
+        self.selection = selection or {}
+
+    def views(self):
+        return (self.lots, self.selection) + super().views()
+
+    def state(self):
+        state = super().state()
+        lots = [(i, *lot) for i, queue in enumerate(self.lots) for lot in queue]
+        lots = np.array(lots, dtype=self.dtype).reshape(-1, 5)
+        state["lot_symbol"] = lots[:, 0].astype(np.int64)
+        state["lot_qty"] = lots[:, 1]
+        state["lot_price"] = lots[:, 2]
+        state["lot_fee"] = lots[:, 3]
+        state["lot_row"] = lots[:, 4].astype(np.int64)
+        return state
+
+    def load_state(self, state, index):
+        super().load_state(state, index)
+        for i, qty, price, fee, row in zip(index[state["lot_symbol"]].tolist(), state["lot_qty"].tolist(),
+                                            state["lot_price"].tolist(), state["lot_fee"].tolist(),
+                                            state["lot_row"].tolist()):
+            self.lots[i].append([qty, price, fee, row])
+
+
+def take_lot(queue, k, want):
+    # 从队列第k个批次中取出至多want数量，返回 (数量, 开仓价格, 分摊手续费)
+    lot = queue[k]
+    lot_qty = abs(lot[0])
+    if want >= lot_qty:
+        if k == 0:
+            queue.popleft()
+        else:
+            del queue[k]
+        return lot_qty, lot[1], lot[2]
+    fee_part = lot[2]*want/lot_qty
+    lot[0] -= copysign(want, lot[0])
+    lot[2] -= fee_part
+    return want, lot[1], fee_part
+
+
+def step_fifo(lots, selection, quantity, avg_cost, total_fee, row, i, qty, price, fee):
+    # 先进先出法，手续费分摊方式与 step_method1 一致
+    if not qty:
+        return None
+    queue = lots[i]
+    record = None
+    remaining = abs(qty)
+    if queue and (queue[0][0] > 0) != (qty > 0):
+        closed = 0
+        lot_value = 0
+        lot_fee = 0
+        for open_row, want in selection.get(row, ()):
+            # 指定批次优先，未指定或不足的部分仍按先进先出
+            for k, lot in enumerate(queue):
+                if lot[3] == open_row:
+                    m, lot_price, fee_part = take_lot(queue, k, min(remaining, want))
+                    closed += m
+                    lot_value += m*lot_price
+                    lot_fee += fee_part
+                    remaining -= m
+                    break
+        while remaining > 0 and queue:
+            m, lot_price, fee_part = take_lot(queue, 0, remaining)
+            closed += m
+            lot_value += m*lot_price
+            lot_fee += fee_part
+            remaining -= m
+        trade_fee = fee*closed/abs(qty)
+        if qty > 0:
+            # 回补
+            total_buy_cost = lot_fee+trade_fee+closed*price
+            record = (SHORT_CLOSE, lot_value/closed, total_buy_cost/closed, closed, lot_value-total_buy_cost)
+        else:
+            total_buy_cost = lot_fee+trade_fee+lot_value
+            record = (LONG_CLOSE, price, total_buy_cost/closed, closed, closed*price-total_buy_cost)
+        if queue:
+            open_value = avg_cost[i]*abs(quantity[i])-lot_value
+            total_fee[i] -= lot_fee
+            quantity[i] -= copysign(closed, quantity[i])
+        else:
+            open_value = quantity[i] = total_fee[i] = 0
+    else:
+        open_value = avg_cost[i]*abs(quantity[i])
+    if remaining > 0:
+        # 未平掉的部分作为新批次入队
+        open_fee = fee if remaining == abs(qty) else fee*remaining/abs(qty)
+        queue.append([copysign(remaining, qty), price, open_fee, row])
+        open_value += remaining*price
+        total_fee[i] += open_fee
+        quantity[i] += copysign(remaining, qty)
+    avg_cost[i] = open_value/abs(quantity[i]) if queue else 0
+    return record
+
+
+METHODS = {
+    1: step_method1,
+    2: step_method2,
+    3: step_fifo,
+}
+
+BOOKS = {
+    3: LotBook,
+}
+
+
+class TradeColumns:
+    # 按时间排好序的交易记录，拆成列数组供引擎逐笔读取
+    # symbols 为已有的股票编号表（如从快照恢复时），新出现的股票依次追加
+    # offset 为这些交易之前已处理的行数，行号在整个历史中保持不变
+    def __init__(self, df, symbols=None, offset=0):
+        self.registry = symbol_registry.SymbolRegistry(symbols or ())
+        codes = self.registry.encode(df['股票代码'])
+        self.symbols = self.registry.symbols
+        self.offset = offset
+        price = df['成交价格'].to_numpy()
+        # 期权按合约乘数计价，缺失成交价按0处理
+        option_rows = self.registry.is_option[codes]
+        if option_rows.any():
+            price = price.astype(np.float64)
+            multiplier = self.registry.multiplier[codes]
+            price = np.where(option_rows, np.where(np.isnan(price), 0, price*multiplier), price)
+        qty = df['数量'].to_numpy()
+        buy = (df['买卖方向'] == "OrderSide.Buy").to_numpy()
+        self.codes = codes
+        self.qty = np.where(buy, qty, -qty)
+        self.price = price
+        self.fee = df['合计手续费'].to_numpy()
+        self.currency = df['结算币种'].to_numpy()
+        self.time = df['交易时间'].array
+        self.time_ns = df['交易时间'].to_numpy('datetime64[ns]').view(np.int64)
+        self.year = df['交易时间'].dt.year.to_numpy()
+        # 每笔交易当日折算为报税币种的汇率，启用汇率折算时由 run 一次性填入
+        self.fx_rate = None
+        # 定点模式下为 fixed.FixedPoint，数量、价格、手续费已换算为整数
+        self.fixed = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def year_slices(self):
+        # 按年份切分连续区间
+        if len(self.year) == 0:
+            return
+        bounds = np.flatnonzero(self.year[1:] != self.year[:-1])+1
+        starts = [0]+bounds.tolist()
+        ends = bounds.tolist()+[len(self.year)]
+        for start, end in zip(starts, ends):
+            yield int(self.year[start]), start, end
+
+    def symbol_index(self, symbols):
+        # 把另一张股票编号表映射为本表的编号
+        return self.registry.lookup(symbols)
+
+
+def match_rows(trades, steps, books, start, end, sinks, index=None):
+    # 逐笔处理 [start, end) 区间的交易，每笔交易依次交给所有配对方式
+    # 产生的配对立即交给对应方式的 sink.add(行号, 配对结果)
+    # index 为分片的行下标数组时，处理的是 index[start:end] 这些行
+    lanes = [(partial(step, *book.views()), sink.add) for step, book, sink in zip(steps, books, sinks)]
+    if index is None:
+        rows = range(trades.offset+start, trades.offset+end)
+        index = slice(start, end)
+    else:
+        index = index[start:end]
+        rows = (index+trades.offset).tolist()
+    codes = trades.codes[index].tolist()
+    qtys = trades.qty[index].tolist()
+    prices = trades.price[index].tolist()
+    fees = trades.fee[index].tolist()
+    for row, i, qty, price, fee in zip(rows, codes, qtys, prices, fees):
+        for step, add in lanes:
+            record = step(row, i, qty, price, fee)
+            if record is not None:
+                add(row, record)
+
+
+PROFIT_COLUMNS = ["配对原因", "股票代码", "卖出价格", "成本价", "数量", "利润", "时间", "结算币种"]
+# 启用汇率折算时追加的列
+FX_COLUMNS = ["汇率", "折算利润"]
+
+
+def add_partial(partials, x):
+    # 无误差累加（Shewchuk 算法），partials 保存互不重叠的部分和，fsum(partials) 即精确舍入的总和
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x+y
+        lo = y-(hi-x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
+
+
+def format_number(value):
+    # 数值列统一按浮点数输出，缺失值留空，与 DataFrame.to_csv 一致
+    value = float(value)
+    return '' if value != value else repr(value)
+
+
+EPOCH = datetime(1970, 1, 1)
+NAT = np.iinfo(np.int64).min
+
+
+def format_time(ns):
+    # 纳秒时间戳 -> "YYYY-MM-DD HH:MM:SS"，比逐个构造 pandas Timestamp 快得多
+    if ns == NAT:
+        return ''
+    return str(EPOCH+timedelta(microseconds=int(ns)//1000))
+
+
+class ProfitWriter:
+    # 逐条写出一年的配对明细，同时按币种累计利润总和、正利润之和及最后一条的行号
+    # 启用汇率折算时每条明细追加当日汇率和折算利润，汇总行追加折算后的总和；该币种当年有利润缺少汇率时折算总和留空
+    # 年度结束时调用 close() 追加年度汇总行，内存占用与配对条数无关
+    # fragment 为 True 时写的是分片的中间文件：每行前加行号、不写表头和汇总，close() 返回累计值供合并
+    def __init__(self, trades, save_path, fragment=False):
+        self.trades = trades
+        self.symbols = trades.symbols
+        self.codes = trades.codes
+        self.currency = trades.currency
+        self.time_ns = trades.time_ns
+        self.fx_rate = trades.fx_rate
+        self.fixed = trades.fixed
+        self.offset = trades.offset
+        self.save_path = save_path
+        self.fragment = fragment
+        # 先写临时文件，完成后再替换，避免中断时留下不完整的利润文件
+        self.file = open(save_path+'.tmp', 'w', encoding='utf-8' if fragment else 'utf-8-sig', newline='')
+        self.writer = csv.writer(self.file, lineterminator=os.linesep)
+        if not fragment:
+            self.writer.writerow(PROFIT_COLUMNS+(FX_COLUMNS if self.fx_rate is not None else []))
+        # 币种 -> [利润部分和, 正利润部分和, 最后行号, 折算利润部分和, 折算正利润部分和, 缺少汇率的条数]
+        self.totals = {}
+
+    def add(self, row, record):
+        reason, sell_price, cost, qty1, earn = record
+        # 定点模式的配对结果为整数，输出时换算为数值，汇总按整数精确累加
+        exact = earn
+        if self.fixed is not None:
+            sell_price, cost, qty1, earn = self.fixed.unscale(sell_price, cost, qty1, earn)
+        local = row-self.offset
+        currency = self.currency[local]
+        # 缺失的币种为 NaN，不参与汇总
+        missing = currency != currency
+        if self.fragment:
+            self.file.write(f"{row},")
+        values = (reason, self.symbols[self.codes[local]], format_number(sell_price),
+                  format_number(cost), format_number(qty1), format_number(earn),
+                  format_time(self.time_ns[local]), '' if missing else currency)
+        if self.fx_rate is not None:
+            rate = float(self.fx_rate[local])
+            converted = earn*rate
+            values += (format_number(rate), format_number(converted))
+        self.writer.writerow(values)
+        if missing:
+            return
+        total = self.totals.get(currency)
+        if total is None:
+            total = self.totals[currency] = [[], [], None, [], [], 0]
+        # 利润缺失时不计入汇总
+        if earn == earn:
+            add_partial(total[0], exact)
+            if earn > 0:
+                add_partial(total[1], exact)
+            # 缺少汇率的利润记下条数，折算总和不完整
+            if self.fx_rate is not None and converted == converted:
+                add_partial(total[3], converted)
+                if earn > 0:
+                    add_partial(total[4], converted)
+            elif self.fx_rate is not None:
+                total[5] += 1
+        total[2] = row
+
+    def close(self):
+        if not self.fragment:
+            write_summary(self.writer, self.totals, self.trades)
+        self.file.close()
+        os.replace(self.save_path+'.tmp', self.save_path)
+        return self.totals
+
+
+def write_summary(writer, totals, trades):
+    profit_total = trades.fixed.total if trades.fixed is not None else math.fsum
+    for currency in sorted(totals):
+        all_profits, positive_profits, last_row, all_converted, positive_converted, unconverted = totals[currency]
+        last_time = format_time(trades.time_ns[last_row-trades.offset])
+        for tax_method, partials, converted in (("按年度计算", all_profits, all_converted),
+                                                ("按单次计算", positive_profits, positive_converted)):
+            values = ("年度汇总", tax_method, "0.0", "0.0", "0.0", format_number(profit_total(partials)), last_time, currency)
+            if trades.fx_rate is not None:
+                values += ('', '' if unconverted else format_number(math.fsum(converted)))
+            writer.writerow(values)
+
+
+def merge_totals(parts):
+    # 合并各分片的累计值，部分和逐个精确累加，结果与单进程完全相同
+    totals = {}
+    for part in parts:
+        for currency, part_total in part.items():
+            total = totals.setdefault(currency, [[], [], part_total[2], [], [], 0])
+            for k in (0, 1, 3, 4):
+                for x in part_total[k]:
+                    add_partial(total[k], x)
+            total[2] = max(total[2], part_total[2])
+            total[5] += part_total[5]
+    return totals
+
+
+def merge_fragments(trades, save_path, fragments, totals):
+    # 各分片的中间文件已按行号排好序，归并后去掉行号即为按时间排列的明细
+    files = [open(path, encoding='utf-8', newline='') for path in fragments]
+    try:
+        with open(save_path+'.tmp', 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, lineterminator=os.linesep)
+            writer.writerow(PROFIT_COLUMNS+(FX_COLUMNS if trades.fx_rate is not None else []))
+            for line in heapq.merge(*files, key=lambda line: int(line[:line.index(',')])):
+                f.write(line[line.index(',')+1:])
+            write_summary(writer, merge_totals(totals), trades)
+    finally:
+        for file in files:
+            file.close()
+    os.replace(save_path+'.tmp', save_path)
+    for path in fragments:
+        os.remove(path)
+
+
+def load_lot_selection(path, trades):
+    # 指定批次表：股票代码,交易时间(平仓),开仓时间,数量
+    # 同一股票同一时间有多笔成交时取第一笔
+    df = loader.read_table(path, loader.LOT_SCHEMA)
+    keys = pd.DataFrame({
+        "股票代码":np.asarray(trades.symbols, dtype=object)[trades.codes],
+        "时间":trades.time,
+        "行号":trades.offset+np.arange(len(trades))
+    }).drop_duplicates(["股票代码", "时间"])
+    df = df.merge(keys.rename(columns={"时间":"交易时间", "行号":"平仓行号"}), on=["股票代码", "交易时间"], how="left")
+    df = df.merge(keys.rename(columns={"时间":"开仓时间", "行号":"开仓行号"}), on=["股票代码", "开仓时间"], how="left")
+    missing = df[df['平仓行号'].isna() | df['开仓行号'].isna()]
+    if not missing.empty:
+        raise ValueError(f"指定批次表中有 {len(missing)} 行找不到对应成交:\n{missing}")
+    selection = {}
+    for close_row, open_row, qty in zip(df['平仓行号'].astype(np.int64), df['开仓行号'].astype(np.int64), df['数量']):
+        selection.setdefault(int(close_row), []).append((int(open_row), qty))
+    return selection
+
+
+def new_book(method, size, selection=None, fixed=None):
+    # fixed 为 FixedPoint 时为定点整数的持仓
+    if fixed is not None:
+        return fixed.new_book(method, size, selection)
+    if method in BOOKS:
+        return BOOKS[method](size, selection)
+    return PositionBook(size)
+
+
+def grow_book(method, book, size):
+    # 持仓数组扩大到 size 个股票，已有的持仓原样保留，新增的股票为空仓
+    grown = new_book(method, size, getattr(book, 'selection', None))
+    grown.load_state(book.state(), np.arange(len(book.quantity)))
+    return grown
+
+
+CHECKPOINT_DIR = os.path.join('data', 'checkpoints')
+
+
+def chain_digests(manifest, salt=b''):
+    # 第Y年末快照的标签：截至Y年各年份摘要的链式哈希，任何更早年份被改动都会使其失效
+    chain = []
+    digest = hashlib.sha256(salt).hexdigest()
+    rows = 0
+    for year, year_rows, year_digest in manifest:
+        digest = hashlib.sha256((digest+year_digest).encode()).hexdigest()
+        rows += year_rows
+        chain.append((year, rows, digest))
+    return chain
+
+
+def checkpoint_path(platform, method, year):
+    return os.path.join(CHECKPOINT_DIR, f"{platform}_method{method}_{year}.npz")
+
+
+def save_checkpoint(path, digest, rows, symbols, book):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再替换，避免中断时留下损坏的快照
+    tmp_path = path+".tmp.npz"
+    np.savez(tmp_path, digest=np.array(digest), rows=np.array(rows),
+             symbols=np.array(symbols, dtype=str), **book.state())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path, digest, rows):
+    # 快照覆盖的行数和输入哈希都一致时返回其中的持仓，否则返回 None
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            state = {key:data[key] for key in data.files}
+    except (OSError, ValueError) as e:
+        print(f"无法读取快照 {path}: {e}")
+        return None
+    if str(state.pop("digest")) != digest or int(state.pop("rows")) != rows:
+        return None
+    state["symbols"] = state["symbols"].tolist()
+    return state
+
+
+def selection_salt(lot_selection):
+    # 指定批次表参与先进先出法快照的哈希，换表后快照失效
+    if not lot_selection:
+        return b''
+    with open(lot_selection, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def base_salt(fx=None, fixed=None, actions=None):
+    # 代码解析规则、汇率表、定点模式和公司行为表也参与快照哈希，变化后旧快照失效
+    return (symbol_registry.RULES_VERSION+(fx.salt() if fx else b'')+(fixed.salt() if fixed else b'')
+            +(actions.salt() if actions else b''))
+
+
+def resume_states(platform, methods, chains):
+    # 从最新的有效年末快照恢复，返回 (各方式的持仓快照, 需要继续计算的第一个年份下标)
+    # 快照失效（更早的历史被修改）时依次回退，全部失效则从头计算
+    for k in range(len(chains[0])-1, -1, -1):
+        states = []
+        for method, chain in zip(methods, chains):
+            year, rows, digest = chain[k]
+            done = all(os.path.exists(profit_path(platform, method, y)) for y, _, _ in chain[:k+1])
+            state = read_checkpoint(checkpoint_path(platform, method, year), digest, rows) if done else None
+            if state is None:
+                break
+            states.append(state)
+        else:
+            print(f"从 {chains[0][k][0]} 年末快照继续计算")
+            return states, k+1
+    return None, 0
+
+
+def profit_path(platform, method, year):
+    return f"data/{platform}_method{method}_profit_{year}.csv"
+
+
+def method_steps(methods, trades):
+    # 各方式的逐笔配对函数，定点模式下为整数版本
+    table = trades.fixed.methods if trades.fixed is not None else METHODS
+    return [table[method] for method in methods]
+
+
+def match_serial(platform, methods, trades, books):
+    # 逐年配对并写出利润文件，每年结束时产生 (年份, 年末持仓)
+    steps = method_steps(methods, trades)
+    for year, start, end in trades.year_slices():
+        sinks = [ProfitWriter(trades, profit_path(platform, method, year)) for method in methods]
+        # 配对阶段包含逐条写出明细，汇总阶段为写出年度汇总并替换利润文件
+        with PROFILER.stage("match", end-start), PROFILER.profile():
+            match_rows(trades, steps, books, start, end, sinks)
+        with PROFILER.stage("summary"):
+            for sink in sinks:
+                sink.close()
+        yield year, books
+
+
+def shard_symbols(trades, workers):
+    # 按成交条数把股票分到各分片：条数多的先分，每次分给当前最轻的分片
+    # 没有成交的股票放在第0个分片，其持仓原样带回
+    counts = np.bincount(trades.codes, minlength=len(trades.symbols))
+    shard_of = np.zeros(len(counts), dtype=np.intp)
+    loads = [(0, part) for part in range(workers)]
+    for i in np.argsort(-counts, kind='stable').tolist():
+        if counts[i] == 0:
+            break
+        load, part = heapq.heappop(loads)
+        shard_of[i] = part
+        heapq.heappush(loads, (load+counts[i], part))
+    return shard_of
+
+
+LOT_KEYS = ("lot_symbol", "lot_qty", "lot_price", "lot_fee", "lot_row")
+_shard_context = None
+
+
+def _init_shard(trades, books):
+    # 子进程共享的交易列和起始持仓，fork 时直接继承，不必逐个任务传输
+    global _shard_context
+    _shard_context = (trades, books)
+
+
+def match_shard(platform, methods, index, years, part):
+    # 在子进程中配对一个分片的全部年份，各年明细写入带行号的中间文件
+    # 返回每年的 ([各方式的累计值], [各方式的年末持仓])
+    trades, books = _shard_context
+    steps = method_steps(methods, trades)
+    results = []
+    for year, start, end in years:
+        sinks = [ProfitWriter(trades, f"{profit_path(platform, method, year)}.part{part}", fragment=True)
+                 for method in methods]
+        with PROFILER.profile():
+            match_rows(trades, steps, books, start, end, sinks, index)
+        # 持仓数组之后还会被修改，返回前复制
+        results.append(([sink.close() for sink in sinks],
+                        [{key:value.copy() for key, value in book.state().items()} for book in books]))
+    # fork 启动的子进程继承了主进程的 cProfile 设置，各自写出结果由主进程合并
+    PROFILER.dump_part(part)
+    return results
+
+
+def merge_states(states, shards):
+    # 各分片只改动自己股票的持仓，按分片的股票编号取回，合并为完整的持仓
+    merged = {key:states[0][key].copy() for key in ("quantity", "avg_cost", "total_fee")}
+    for state, ids in zip(states, shards):
+        for key in merged:
+            merged[key][ids] = state[key][ids]
+    if "lot_symbol" in states[0]:
+        keep = [np.isin(state["lot_symbol"], ids) for state, ids in zip(states, shards)]
+        for key in LOT_KEYS:
+            merged[key] = np.concatenate([state[key][mask] for state, mask in zip(states, keep)])
+    return merged
+
+
+def match_sharded(platform, methods, trades, books, selection, workers):
+    # 不同股票的持仓互不影响：按股票分片后在进程池中并行配对，
+    # 再按行号归并各分片的明细、合并持仓，输出与逐笔单进程配对逐字节相同
+    shard_of = shard_symbols(trades, workers)
+    slices = list(trades.year_slices())
+    tasks = []
+    for part in range(workers):
+        index = np.flatnonzero(shard_of[trades.codes] == part)
+        if len(index):
+            years = [(year, *np.searchsorted(index, [start, end]).tolist()) for year, start, end in slices]
+            tasks.append((part, index, years))
+    with PROFILER.stage("match", len(trades)), \
+            ProcessPoolExecutor(max_workers=len(tasks), initializer=_init_shard, initargs=(trades, books)) as pool:
+        futures = [pool.submit(match_shard, platform, methods, index, years, part) for part, index, years in tasks]
+        results = [future.result() for future in futures]
+    shards = [np.flatnonzero(shard_of == part) for part, _, _ in tasks]
+    for k, (year, _, _) in enumerate(slices):
+        merged_books = []
+        with PROFILER.stage("merge"):
+            for m, method in enumerate(methods):
+                path = profit_path(platform, method, year)
+                merge_fragments(trades, path, [f"{path}.part{part}" for part, _, _ in tasks],
+                                [result[k][0][m] for result in results])
+                book = new_book(method, len(trades.symbols), selection, trades.fixed)
+                state = merge_states([result[k][1][m] for result in results], shards)
+                book.load_state(state, np.arange(len(trades.symbols)))
+                merged_books.append(book)
+        yield year, merged_books
+
+
+def run(platform, methods, lot_selection=None, resume=True, year=None, workers=1, fx=None, fixed=None, actions=None):
+    # 一次读取、排序和遍历，同时计算所有选定的配对方式
+    # lot_selection 为指定批次表路径，仅对先进先出法生效
+    # resume 为 True 时从最新的有效年末快照继续，只读取和计算之后的交易
+    # year 指定时只计算到该年为止，列式存储下不会读取之后的年份
+    # workers 大于1时按股票分片在多个进程中并行配对
+    # fx 为 FxIndex 时利润文件追加按交易日汇率折算的利润
+    # fixed 为 FixedPoint 时以定点整数精确计算，利润精确到最小货币单位
+    # actions 为公司行为索引，为 None 时使用 data/corporate_actions.csv（存在时），配对前调整拆股、合股和改代码
+    # 返回 (股票编号表, {方式: 最新持仓})
+    if actions is None:
+        actions = corporate_actions.load()
+    history = storage.open_history(platform)
+    manifest = [item for item in history.years() if year is None or item[0] <= year]
+    salt = selection_salt(lot_selection)
+    chains = [chain_digests(manifest, base_salt(fx, fixed, actions)+(salt if method in BOOKS else b''))
+              for method in methods]
+    with PROFILER.stage("resume"):
+        states, first = resume_states(platform, methods, chains) if resume and manifest else (None, 0)
+
+    # 各方式快照的股票编号表合并为基础编号表
+    symbols = []
+    for state in states or []:
+        seen = set(symbols)
+        symbols += [s for s in state["symbols"] if s not in seen]
+    offset = chains[0][first-1][1] if first else 0
+    df = history.load([item[0] for item in manifest[first:]])
+    if actions:
+        df = actions.adjust(df)
+    with PROFILER.stage("columns", len(df)):
+        trades = TradeColumns(df, symbols, offset)
+    if fx:
+        with PROFILER.stage("fx", len(trades)):
+            trades.fx_rate = fx.lookup(trades.currency, trades.time_ns)
+        missing = np.isnan(trades.fx_rate) & ~pd.isna(trades.currency)
+        if missing.any():
+            print(f"{int(missing.sum())} 笔交易找不到汇率，折算利润及该币种当年的折算总和留空")
+    if fixed:
+        fixed.convert(trades)
+    selection = load_lot_selection(lot_selection, trades) if lot_selection else None
+    books = [new_book(method, len(trades.symbols), selection, trades.fixed) for method in methods]
+    for book, state in zip(books, states or []):
+        book.load_state(state, trades.symbol_index(state["symbols"]))
+
+    if workers > 1 and len(trades):
+        years = match_sharded(platform, methods, trades, books, selection, workers)
+    else:
+        years = match_serial(platform, methods, trades, books)
+    for (year, books), k in zip(years, range(first, len(manifest))):
+        with PROFILER.stage("checkpoint"):
+            for method, book, chain in zip(methods, books, chains):
+                _, covered, digest = chain[k]
+                save_checkpoint(checkpoint_path(platform, method, year), digest, covered, trades.symbols, book)
+    return trades.symbols, dict(zip(methods, books))
@@ -0,0 +1,271 @@
+import numpy as np
+import pandas as pd
+import engine
+
+# 定点模式：数量、价格、手续费都是按固定倍数放大的 64 位整数，中间结果为精确的 Python 整数
+# 数量的最小单位为 1e-6 股，价格和均价为 1e-8 个货币单位，金额（手续费、成本、利润）为该币种的最小货币单位
+# 舍入规则：每次把比例分摊或数量×价格折成金额时四舍五入到最小货币单位（负数的 .5 向上舍入），
+# 均价、成本价四舍五入到 1e-8；分摊手续费时剩余部分由总额减去已分摊部分得到，手续费总额始终不变
+QTY_SCALE = 10**6
+PRICE_SCALE = 10**8
+# 各币种最小货币单位的小数位数，未列出的币种为2位
+CURRENCY_DECIMALS = {"JPY":0}
+DEFAULT_DECIMALS = 2
+# 舍入规则或倍数变化时修改，使定点模式的年末快照失效
+VERSION = b"fixed-1"
+
+
+def step_method1(unit, quantity, avg_cost, total_fee, row, i, qty, price, fee):
+    # 加权平均法，与 engine.step_method1 相同的计算步骤
+    # u 为最小货币单位对应的整数值，m 把 数量×价格 折成最小货币单位
+    u = unit[i]
+    m = QTY_SCALE*u
+    cur_qty = quantity[i]
+    if qty > 0:
+        if cur_qty < 0:
+            # 回补
+            held = -cur_qty
+            qty1 = min(qty, held)
+            fee_hold = (2*qty1*total_fee[i]+held*u)//(2*held*u)*u
+            fee_trade = (2*qty1*fee+qty*u)//(2*qty*u)*u
+            total_buy_cost = fee_hold+fee_trade+(2*qty1*price+m)//(2*m)*u
+            earn = (2*qty1*avg_cost[i]+m)//(2*m)*u-total_buy_cost
+            record = (engine.SHORT_CLOSE, avg_cost[i], (2*total_buy_cost*QTY_SCALE+qty1)//(2*qty1), qty1, earn)
+            if qty < held:
+                quantity[i] += qty
+                total_fee[i] -= fee_hold
+            else:
+                quantity[i] = qty-held
+                avg_cost[i] = price
+                total_fee[i] = fee-fee_trade
+            return record
+        total = qty+cur_qty
+        avg_cost[i] = (2*(avg_cost[i]*cur_qty+qty*price)+total)//(2*total)
+        quantity[i] = total
+        total_fee[i] += fee
+    elif qty < 0:
+        sold = -qty
+        if cur_qty > 0:
+            qty1 = min(sold, cur_qty)
+            fee_hold = (2*qty1*total_fee[i]+cur_qty*u)//(2*cur_qty*u)*u
+            fee_trade = (2*qty1*fee+sold*u)//(2*sold*u)*u
+            total_buy_cost = fee_hold+fee_trade+(2*qty1*avg_cost[i]+m)//(2*m)*u
+            earn = (2*qty1*price+m)//(2*m)*u-total_buy_cost
+            record = (engine.LONG_CLOSE, price, (2*total_buy_cost*QTY_SCALE+qty1)//(2*qty1), qty1, earn)
+            # 与原实现相同，卖出超过持仓时也按比例扣减手续费，均价不变
+            quantity[i] += qty
+            total_fee[i] -= fee_hold if sold <= cur_qty else (2*sold*total_fee[i]+cur_qty*u)//(2*cur_qty*u)*u
+            return record
+        total = sold-cur_qty
+        avg_cost[i] = (2*(avg_cost[i]*-cur_qty+sold*price)+total)//(2*total)
+        quantity[i] += qty
+        total_fee[i] += fee
+    return None
+
+
+def step_method2(unit, quantity, avg_cost, total_fee, row, i, qty, price, fee):
+    # 移动加权平均法，与 engine.step_method2 相同的计算步骤
+    u = unit[i]
+    m = QTY_SCALE*u
+    cur_qty = quantity[i]
+    record = None
+    if qty > 0:
+        if cur_qty < 0:
+            held = -cur_qty
+            qty1 = min(qty, held)
+            fee_trade = (2*qty1*fee+qty*u)//(2*qty*u)*u
+            total_buy_cost = total_fee[i]+fee_trade+(2*qty1*price+m)//(2*m)*u
+            earn = (2*qty1*avg_cost[i]+m)//(2*m)*u-total_buy_cost
+            if qty1 == held:
+                record = (engine.SHORT_CLOSE, avg_cost[i], (2*total_buy_cost*QTY_SCALE+qty1)//(2*qty1), qty1, earn)
+            delta_qty = qty-held
+            quantity[i] = delta_qty
+            if delta_qty > 0:
+                total_fee[i] = fee-fee_trade
+            else:
+                rest = held+qty
+                avg_cost[i] = (2*(qty*avg_cost[i]-total_buy_cost*QTY_SCALE)+rest)//(2*rest)
+                total_fee[i] = 0
+            return record
+        total = qty+cur_qty
+        avg_cost[i] = (2*(avg_cost[i]*cur_qty+qty*price)+total)//(2*total)
+        quantity[i] = total
+        total_fee[i] += fee
+    elif qty < 0:
+        sold = -qty
+        if cur_qty > 0:
+            qty1 = min(sold, cur_qty)
+            fee_trade = (2*qty1*fee+sold*u)//(2*sold*u)*u
+            total_buy_cost = total_fee[i]+fee_trade+(2*cur_qty*avg_cost[i]+m)//(2*m)*u
+            earn = (2*qty1*price+m)//(2*m)*u-total_buy_cost
+            if qty1 == cur_qty:
+                record = (engine.LONG_CLOSE, price, (2*total_buy_cost*QTY_SCALE+qty1)//(2*qty1), qty1, earn)
+            delta_qty = cur_qty-sold
+            quantity[i] = delta_qty
+            if delta_qty < 0:
+                total_fee[i] = fee-fee_trade
+                avg_cost[i] = price
+            else:
+                avg_cost[i] = 0 if delta_qty == 0 else \
+                    (2*(total_buy_cost*QTY_SCALE-sold*price)+delta_qty)//(2*delta_qty)
+                total_fee[i] = 0
+            return record
+        total = sold-cur_qty
+        avg_cost[i] = (2*(avg_cost[i]*-cur_qty+sold*price)+total)//(2*total)
+        quantity[i] += qty
+        total_fee[i] += fee
+    return record
+
+
+def take_lot(queue, k, want, u):
+    # 与 engine.take_lot 相同，部分平仓时分摊的手续费四舍五入到最小货币单位
+    lot = queue[k]
+    lot_qty = abs(lot[0])
+    if want >= lot_qty:
+        if k == 0:
+            queue.popleft()
+        else:
+            del queue[k]
+        return lot_qty, lot[1], lot[2]
+    fee_part = (2*lot[2]*want+lot_qty*u)//(2*lot_qty*u)*u
+    lot[0] -= want if lot[0] > 0 else -want
+    lot[2] -= fee_part
+    return want, lot[1], fee_part
+
+
+def step_fifo(lots, selection, unit, quantity, avg_cost, total_fee, row, i, qty, price, fee):
+    # 先进先出法，与 engine.step_fifo 相同的计算步骤；利润只由批次计算，均价仅用于展示
+    if not qty:
+        return None
+    u = unit[i]
+    m = QTY_SCALE*u
+    queue = lots[i]
+    record = None
+    size = abs(qty)
+    remaining = size
+    trade_fee = 0
+    if queue and (queue[0][0] > 0) != (qty > 0):
+        closed = 0
+        lot_value = 0
+        lot_fee = 0
+        for open_row, want in selection.get(row, ()):
+            for k, lot in enumerate(queue):
+                if lot[3] == open_row:
+                    n, lot_price, fee_part = take_lot(queue, k, min(remaining, want), u)
+                    closed += n
+                    lot_value += n*lot_price
+                    lot_fee += fee_part
+                    remaining -= n
+                    break
+        while remaining > 0 and queue:
+            n, lot_price, fee_part = take_lot(queue, 0, remaining, u)
+            closed += n
+            lot_value += n*lot_price
+            lot_fee += fee_part
+            remaining -= n
+        trade_fee = (2*fee*closed+size*u)//(2*size*u)*u
+        if qty > 0:
+            # 回补
+            total_buy_cost = lot_fee+trade_fee+(2*closed*price+m)//(2*m)*u
+            earn = (2*lot_value+m)//(2*m)*u-total_buy_cost
+            record = (engine.SHORT_CLOSE, (2*lot_value+closed)//(2*closed),
+                      (2*total_buy_cost*QTY_SCALE+closed)//(2*closed), closed, earn)
+        else:
+            total_buy_cost = lot_fee+trade_fee+(2*lot_value+m)//(2*m)*u
+            earn = (2*closed*price+m)//(2*m)*u-total_buy_cost
+            record = (engine.LONG_CLOSE, price, (2*total_buy_cost*QTY_SCALE+closed)//(2*closed), closed, earn)
+        if queue:
+            open_value = avg_cost[i]*abs(quantity[i])-lot_value
+            total_fee[i] -= lot_fee
+            quantity[i] -= closed if quantity[i] > 0 else -closed
+        else:
+            open_value = quantity[i] = total_fee[i] = 0
+    else:
+        open_value = avg_cost[i]*abs(quantity[i])
+    if remaining > 0:
+        # 未平掉的部分作为新批次入队，手续费为本笔手续费减去已分摊到平仓的部分
+        open_fee = fee-trade_fee
+        queue.append([remaining if qty > 0 else -remaining, price, open_fee, row])
+        open_value += remaining*price
+        total_fee[i] += open_fee
+        quantity[i] += remaining if qty > 0 else -remaining
+    held = abs(quantity[i])
+    avg_cost[i] = (2*open_value+held)//(2*held) if queue else 0
+    return record
+
+
+METHODS = {
+    1: step_method1,
+    2: step_method2,
+    3: step_fifo,
+}
+
+
+class FixedBook(engine.PositionBook):
+    # 与 PositionBook 相同，持仓为定点整数；unit 为各股票结算币种的最小货币单位
+    dtype = np.int64
+
+    def __init__(self, size, unit):
+        super().__init__(size)
+        self.unit = unit
+
+    def views(self):
+        return (memoryview(self.unit),)+super().views()
+
+
+class FixedLotBook(engine.LotBook):
+    dtype = np.int64
+
+    def __init__(self, size, unit, selection=None):
+        super().__init__(size, selection)
+        self.unit = unit
+
+    def views(self):
+        return (self.lots, self.selection, memoryview(self.unit))+engine.PositionBook.views(self)
+
+
+class FixedPoint:
+    # 传给 engine.run 的定点运算规则：把交易列换算为整数，提供对应的配对函数和持仓
+    methods = METHODS
+
+    def __init__(self, decimals=None):
+        self.decimals = dict(CURRENCY_DECIMALS, **(decimals or {}))
+        self.unit = None
+
+    def salt(self):
+        return VERSION
+
+    def convert(self, trades):
+        # 就地把 TradeColumns 的数量、价格、手续费换算为整数，并记下各股票的最小货币单位
+        # 定点数不能表示缺失值，缺失的成交价和手续费按0处理
+        missing = int(np.isnan(trades.price).sum()+np.isnan(trades.fee).sum())
+        if missing:
+            print(f"定点模式下 {missing} 个缺失的成交价或手续费按0处理")
+        currency = pd.Series(trades.currency, dtype=object)
+        decimals = currency.map(self.decimals).fillna(DEFAULT_DECIMALS).to_numpy(np.int64)
+        row_unit = PRICE_SCALE//10**decimals
+        trades.qty = np.rint(trades.qty*QTY_SCALE).astype(np.int64)
+        trades.price = np.rint(np.nan_to_num(trades.price)*PRICE_SCALE).astype(np.int64)
+        trades.fee = np.rint(np.nan_to_num(trades.fee)*10.0**decimals).astype(np.int64)*row_unit
+        # 同一股票以最后一笔交易的币种为准，没有交易的股票不会被配对
+        self.unit = np.full(len(trades.symbols), PRICE_SCALE//10**DEFAULT_DECIMALS, dtype=np.int64)
+        self.unit[trades.codes] = row_unit
+        trades.fixed = self
+
+    def new_book(self, method, size, selection=None):
+        if method in engine.BOOKS:
+            # 指定批次表的数量同样换算为整数
+            selection = {row:[(open_row, round(qty*QTY_SCALE)) for open_row, qty in picks]
+                         for row, picks in (selection or {}).items()}
+            return FixedLotBook(size, self.unit, selection)
+        return FixedBook(size, self.unit)
+
+    @staticmethod
+    def unscale(sell_price, cost, qty, earn):
+        # 整数的配对结果 -> 输出利润文件的数值，整数除法按正确舍入得到最接近的浮点数
+        return sell_price/PRICE_SCALE, cost/PRICE_SCALE, qty/QTY_SCALE, earn/PRICE_SCALE
+
+    @staticmethod
+    def total(partials):
+        # 利润为整数时累计值是精确的整数和
+        return sum(partials)/PRICE_SCALE
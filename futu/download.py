@@ -1,181 +1,311 @@
 from futu import *
 import pandas as pd
 from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import sys
 import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loader
+import profiler
+from profiler import PROFILER
+
 class RateLimiter:
     def __init__(self, max_requests, time_window):
         self.max_requests = max_requests
         self.time_window = time_window
         self.requests = deque()
         self.lock = Lock()
-    
+
     def wait_if_needed(self):
+        # 在锁内只预约一个发送时刻，睡眠放到锁外，多个线程可以同时排队等待
+        # 返回等待的秒数
         with self.lock:
             now = time.time()
             # 移除过期的请求记录
             while self.requests and now - self.requests[0] > self.time_window:
                 self.requests.popleft()
-            
-            # 如果达到最大请求数，等待
+
+            # 如果达到最大请求数，排到窗口内第max_requests个请求过期之后
+            slot = now
             if len(self.requests) >= self.max_requests:
-                wait_time = self.requests[0] + self.time_window - now
-                if wait_time > 0:
-                    time.sleep(wait_time)
-            
+                slot = max(now, self.requests[-self.max_requests] + self.time_window)
+
             # 添加新的请求记录
-            self.requests.append(time.time())
-
-def get_history_orders():
-    # 创建OpenD连接
-    quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)
-    # 不指定市场，获取所有市场的交易权限
-    trade_ctx = OpenSecTradeContext(host='127.0.0.1', port=11111,filter_trdmarket=TrdMarket.NONE)
-    
-    # 创建请求限制器（30秒内最多10次请求）
-    rate_limiter = RateLimiter(max_requests=10, time_window=50)
-    
-    # 存储所有账户的所有订单
-    all_accounts_orders = []
-    
+            self.requests.append(slot)
+        if slot > now:
+            time.sleep(slot - now)
+        return max(slot - now, 0)
+
+def query_window(trade_ctx, rate_limiter, acc_id, market, current_start, current_end):
+    # 返回 (是否查询成功, 订单DataFrame或None)
+    print(f"    [{acc_id}] 正在获取 {current_start.strftime('%Y-%m-%d')} 到 {current_end.strftime('%Y-%m-%d')} 的订单数据...")
+
+    # 等待请求限制
+    waited = rate_limiter.wait_if_needed()
+
+    # 查询历史订单, 明确指定市场
+    with PROFILER.api('history_order_list_query', waited):
+        ret, data = trade_ctx.history_order_list_query(
+            acc_id=acc_id,
+            order_market=market,
+            start=current_start.strftime('%Y-%m-%d %H:%M:%S'),
+            end=current_end.strftime('%Y-%m-%d %H:%M:%S'),
+            status_filter_list=[OrderStatus.FILLED_ALL],
+        )
+
+    if ret != RET_OK:
+        print(f'    [{acc_id}] 获取历史订单失败: {data}')
+        return False, None
+
+    if isinstance(data, pd.DataFrame) and not data.empty:
+        data['acc_id'] = acc_id  # 新增：为每个订单加上acc_id
+        print(f"    [{acc_id}] 成功获取 {len(data)} 条订单记录")
+        return True, data
+    elif data is not None:
+        # 如果不是DataFrame但有内容，尝试转为DataFrame并追加acc_id
+        try:
+            data_df = pd.DataFrame(data)
+            if not data_df.empty:
+                data_df['acc_id'] = acc_id
+                print(f"    [{acc_id}] 成功获取 {len(data_df)} 条订单记录 (非DataFrame原始类型)")
+                return True, data_df
+        except Exception as e:
+            print(f"    [{acc_id}] 数据无法转为DataFrame: {e}")
+            return False, None
+    return True, None
+
+def query_fees(trade_ctx, rate_limiter, acc_id, batch_ids):
+    waited = rate_limiter.wait_if_needed()
+    with PROFILER.api('order_fee_query', waited):
+        ret, fee_df = trade_ctx.order_fee_query(order_id_list=batch_ids, acc_id=acc_id, trd_env=TrdEnv.REAL)
+    if ret == RET_OK and isinstance(fee_df, pd.DataFrame):
+        return fee_df[['order_id', 'fee_amount']]
+    print(f'acc_id={acc_id} 获取订单费用失败:', fee_df)
+    return None
+
+def date_windows(start_date, end_date, days=90):
+    # 每3个月为一个批次
+    current_start = start_date
+    while current_start < end_date:
+        current_end = min(current_start + timedelta(days=days), end_date)
+        yield current_start, current_end
+        current_start = current_end
+
+def download_orders(trade_ctx, acc_ids, markets_to_query, start_date, end_date, workers=4,
+                    history_limiter=None, fee_limiter=None, batch_size=400, fee_workers=2,
+                    skip_fee_ids=(), extra_fee_ids=None):
+    # 所有账户、市场、时间窗口的历史订单查询同时提交到线程池，共用一个限速器
+    # 某个账户积累满一批订单号就立即提交到单独的费用查询线程池，与尚未完成的历史订单查询并行
+    # start_date 可以是 {acc_id: 开始时间}，用于增量同步时每个账户从各自的高水位开始
+    # skip_fee_ids 中的订单已有费用不再查询，extra_fee_ids 为 {acc_id: [订单号]} 需要补查费用的旧订单
+    # 返回 (订单DataFrame列表, 费用DataFrame列表, 有查询失败的账户集合)，订单按查询的提交顺序排列，与线程调度无关
+    history_limiter = history_limiter or RateLimiter(max_requests=10, time_window=50)
+    fee_limiter = fee_limiter or RateLimiter(max_requests=10, time_window=50)
+    with ThreadPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=fee_workers) as fee_pool:
+        history_futures = {}
+        for acc_id in acc_ids:
+            acc_start = start_date[acc_id] if isinstance(start_date, dict) else start_date
+            for market in markets_to_query:
+                for current_start, current_end in date_windows(acc_start, end_date):
+                    future = pool.submit(query_window, trade_ctx, history_limiter, acc_id, market, current_start, current_end)
+                    history_futures[future] = (len(history_futures), acc_id)
+
+        orders = [None] * len(history_futures)
+        failed_accounts = set()
+        fee_futures = []
+        # 已提交费用查询或无需查询的订单号，时间窗口边界上重复返回的订单只查一次
+        seen_ids = set(skip_fee_ids)
+        pending_ids = {acc_id: list(ids) for acc_id, ids in (extra_fee_ids or {}).items()}
+
+        def submit_fees(acc_id, batch_ids):
+            fee_futures.append(fee_pool.submit(query_fees, trade_ctx, fee_limiter, acc_id, batch_ids))
+
+        for future in as_completed(history_futures):
+            index, acc_id = history_futures[future]
+            ok, data = future.result()
+            if not ok:
+                failed_accounts.add(acc_id)
+            orders[index] = data
+            if data is None or 'order_id' not in data.columns:
+                continue
+            ids = pending_ids.setdefault(acc_id, [])
+            for order_id in data['order_id'].tolist():
+                if order_id not in seen_ids:
+                    seen_ids.add(order_id)
+                    ids.append(order_id)
+            while len(ids) >= batch_size:
+                submit_fees(acc_id, ids[:batch_size])
+                del ids[:batch_size]
+        # 各账户剩余不足一批的订单号
+        for acc_id, ids in pending_ids.items():
+            if ids:
+                submit_fees(acc_id, ids)
+        fees = [future.result() for future in fee_futures]
+    orders = [data for data in orders if data is not None]
+    return orders, [fee_df for fee_df in fees if fee_df is not None], failed_accounts
+
+RAW_PATH = 'data/futu_history_raw.csv'
+STATE_PATH = 'data/futu_sync_state.json'
+
+def load_store(path=RAW_PATH):
+    # 本地订单库即 futu_history_raw.csv，订单号按字符串读取以便与接口返回的订单号比较
+    if not os.path.exists(path):
+        return None
+    return loader.read_table(path, loader.FUTU_RAW_SCHEMA, keep_other=True, categorical=False)
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {int(acc_id): create_time for acc_id, create_time in json.load(f).items()}
+
+def save_state(state, path=STATE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({str(acc_id): create_time for acc_id, create_time in state.items()}, f, indent=2)
+    os.replace(tmp_path, path)
+
+def real_acc_ids(acc_list_df):
+    acc_ids = []
+    # 遍历所有账户
+    for _, acc_row in acc_list_df.iterrows():
+        acc_id = acc_row.get('acc_id')
+        if acc_row.get("trd_env")==TrdEnv.SIMULATE:
+            continue
+        if acc_id is None:
+            continue
+
+        print(acc_row.get("uni_card_num"))
+
+        try:
+            acc_id = int(acc_id)
+        except (ValueError, TypeError):
+            print(f"无效的账户ID: {acc_id}")
+            continue
+        acc_ids.append(acc_id)
+    return acc_ids
+
+def get_history_orders(trade_ctx=None, workers=4, incremental=False):
+    # 未传入交易上下文时创建OpenD连接，传入时（如测试用的替身）直接使用
+    # incremental 为 True 时每个账户只查询上次同步的最后下单时间之后的订单，并合并到本地订单库
+    own_ctx = trade_ctx is None
+    if own_ctx:
+        quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)
+        # 不指定市场，获取所有市场的交易权限
+        trade_ctx = OpenSecTradeContext(host='127.0.0.1', port=11111,filter_trdmarket=TrdMarket.NONE)
+
     # 定义要查询的市场列表
     # markets_to_query = [TrdMarket.US, TrdMarket.HK]
     markets_to_query = [TrdMarket.NONE]
-    
+
+    # 设置查询时间范围
+    start_date = datetime(2022, 1, 1)
+    end_date = datetime(2024, 12, 30)
+
     try:
         # 获取账户列表
-        ret, acc_list_df = trade_ctx.get_acc_list()
+        with PROFILER.api('get_acc_list'):
+            ret, acc_list_df = trade_ctx.get_acc_list()
         if ret != RET_OK or not isinstance(acc_list_df, pd.DataFrame):
             print(f'获取账户列表失败: {acc_list_df}')
             return
-        
-        # 遍历所有账户
-        for _, acc_row in acc_list_df.iterrows():
-            acc_id = acc_row.get('acc_id')
-            if acc_row.get("trd_env")==TrdEnv.SIMULATE:
-                continue
-            if acc_id is None:
-                continue
 
-            print(acc_row.get("uni_card_num"))
-            
-            try:
-                acc_id = int(acc_id)
-            except (ValueError, TypeError):
-                print(f"无效的账户ID: {acc_id}")
-                continue
+        acc_ids = real_acc_ids(acc_list_df)
+        store = None
+        state = {}
+        skip_fee_ids = ()
+        extra_fee_ids = None
+        if incremental:
+            store = load_store()
+            state = load_state()
+            end_date = datetime.now()
+            # 从高水位往前多查一天，避免时区差异漏单，重复的订单按订单号去重
+            start_date = {acc_id: max(start_date, pd.Timestamp(state[acc_id]).to_pydatetime() - timedelta(days=1))
+                          if acc_id in state else start_date for acc_id in acc_ids}
+            if store is not None:
+                has_fee = store['合计手续费'].notna()
+                skip_fee_ids = set(store.loc[has_fee, 'order_id'])
+                extra_fee_ids = store[~has_fee].groupby('acc_id')['order_id'].apply(list).to_dict()
+                print(f"本地已有 {len(store)} 条订单，其中 {int((~has_fee).sum())} 条需要补查费用")
+        print(f"\n开始处理账户: {acc_ids}，市场: {markets_to_query}，并发数: {workers}")
+        with PROFILER.stage('download') as info:
+            all_accounts_orders, fee_list, failed_accounts = download_orders(
+                trade_ctx, acc_ids, markets_to_query, start_date, end_date, workers,
+                skip_fee_ids=skip_fee_ids, extra_fee_ids=extra_fee_ids)
+            info["rows"] = sum(len(data) for data in all_accounts_orders)
 
-            print(f"\n开始处理账户: {acc_id}")
-            
-            # 遍历所有市场
-            for market in markets_to_query:
-                print(f"  ...正在查询市场: {market}")
-                
-                # 设置查询时间范围
-                start_date = datetime(2022, 1, 1)
-                end_date = datetime(2024, 12, 30)
-                
-                # 每3个月为一个批次
-                current_start = start_date
-                
-                while current_start < end_date:
-                    # 计算当前批次的结束时间
-                    current_end = min(current_start + timedelta(days=90), end_date)
-                    
-                    print(f"    正在获取 {current_start.strftime('%Y-%m-%d')} 到 {current_end.strftime('%Y-%m-%d')} 的订单数据...")
-                    
-                    # 等待请求限制
-                    rate_limiter.wait_if_needed()
-                    
-                    # 查询历史订单, 明确指定市场
-                    ret, data = trade_ctx.history_order_list_query(
-                        acc_id=acc_id,
-                        order_market=market,
-                        start=current_start.strftime('%Y-%m-%d %H:%M:%S'),
-                        end=current_end.strftime('%Y-%m-%d %H:%M:%S'),
-                        status_filter_list=[OrderStatus.FILLED_ALL],
-                    )
-                    
-                    if ret != RET_OK:
-                        print(f'    获取历史订单失败: {data}')
-                    
-                    if isinstance(data, pd.DataFrame) and not data.empty:
-                        data['acc_id'] = acc_id  # 新增：为每个订单加上acc_id
-                        all_accounts_orders.append(data)
-                        print(f"    成功获取 {len(data)} 条订单记录")
-                    elif data is not None:
-                        # 如果不是DataFrame但有内容，尝试转为DataFrame并追加acc_id
-                        try:
-                            data_df = pd.DataFrame(data)
-                            if not data_df.empty:
-                                data_df['acc_id'] = acc_id
-                                all_accounts_orders.append(data_df)
-                                print(f"    成功获取 {len(data_df)} 条订单记录 (非DataFrame原始类型)")
-                        except Exception as e:
-                            print(f"    数据无法转为DataFrame: {e}")
-                    
-                    # 更新下一批次的开始时间
-                    current_start = current_end
-
-        if not all_accounts_orders:
+        if not all_accounts_orders and store is None:
             print("所有账户和市场都未找到任何订单记录")
             return
 
-        # 合并所有账户和市场的数据到一个DataFrame
-        final_df = pd.concat(all_accounts_orders, ignore_index=True)
-
-        # 按时间排序
-        if 'create_time' in final_df.columns:
-            final_df = final_df.sort_values(by='create_time', ascending=False, kind='stable')
+        # 合并所有账户和市场的数据到一个DataFrame，本地订单库中已有的订单保持不变
+        if all_accounts_orders:
+            final_df = pd.concat(all_accounts_orders, ignore_index=True)
+        else:
+            final_df = store.iloc[:0].drop(columns=['合计手续费'])
+        if store is not None:
+            final_df = final_df[~final_df['order_id'].isin(store['order_id'])]
+        if 'order_id' in final_df.columns:
+            final_df = final_df.drop_duplicates(subset='order_id', keep='first')
+        print(f"新增 {len(final_df)} 条订单")
 
-        # ====== 新增：批量获取订单费用 ======
+        # ====== 合并随历史订单查询并行获取的订单费用 ======
         if 'order_id' in final_df.columns and 'acc_id' in final_df.columns:
-            fee_list = []
-            batch_size = 400
-            # 按账户分组批量查费用
-            for acc_id_val, group in final_df.groupby('acc_id'):
-                # 只处理int或str类型的acc_id
-                if not isinstance(acc_id_val, (int, str)):
-                    print(f'不支持的acc_id类型: {type(acc_id_val)}, 跳过该分组')
-                    continue
-                try:
-                    acc_id_int = int(str(acc_id_val))
-                except Exception:
-                    print(f'无法转换acc_id: {acc_id_val}，跳过该分组')
-                    continue
-                order_ids = group['order_id'].tolist()
-                for i in range(0, len(order_ids), batch_size):
-                    batch_ids = order_ids[i:i+batch_size]
-                    ret, fee_df = trade_ctx.order_fee_query(order_id_list=batch_ids, acc_id=acc_id_int, trd_env=TrdEnv.REAL)
-                    if ret == RET_OK and isinstance(fee_df, pd.DataFrame):
-                        fee_list.append(fee_df[['order_id', 'fee_amount']])
-                    else:
-                        print(f'acc_id={acc_id_int} 获取订单费用失败:', fee_df)
             if fee_list:
-                all_fee_df = pd.concat(fee_list, ignore_index=True)
+                all_fee_df = pd.concat(fee_list, ignore_index=True).drop_duplicates(subset='order_id', keep='last')
             else:
                 all_fee_df = pd.DataFrame(columns=['order_id', 'fee_amount'])
             # 合并费用到订单表
             final_df = final_df.merge(all_fee_df, on='order_id', how='left')
             final_df.rename(columns={'fee_amount': '合计手续费'}, inplace=True)
+            if store is not None:
+                # 补上之前缺失费用的旧订单
+                fee_map = all_fee_df.set_index('order_id')['fee_amount']
+                store['合计手续费'] = store['合计手续费'].fillna(store['order_id'].map(fee_map))
+                final_df = pd.concat([store, final_df], ignore_index=True)
         else:
             final_df['合计手续费'] = 0
-        # ====== 新增结束 ======
-        
+        # ====== 合并结束 ======
+
+        # 按时间排序
+        if 'create_time' in final_df.columns:
+            final_df = final_df.sort_values(by='create_time', ascending=False, kind='stable', ignore_index=True)
+
         # 打印最终结果的汇总信息
         print(final_df)
-        
+
         # 保存结果到统一的CSV文件
-        filename = 'data/futu_history_raw.csv'
-        final_df.to_csv(filename, index=False, encoding='utf-8-sig')
+        filename = RAW_PATH
+        with PROFILER.stage('write_csv', len(final_df)):
+            final_df.to_csv(filename, index=False, encoding='utf-8-sig')
         print(f"\n所有账户数据已合并保存到 {filename}")
-                
+
+        if incremental and 'create_time' in final_df.columns:
+            # 有查询失败的账户不推进高水位，下次重新查询
+            latest = final_df.groupby('acc_id')['create_time'].max()
+            for acc_id in acc_ids:
+                if acc_id in latest.index and acc_id not in failed_accounts:
+                    state[acc_id] = str(latest[acc_id])
+            save_state(state)
+        return final_df
+
     finally:
         # 关闭连接
-        quote_ctx.close()
-        trade_ctx.close()
+        if own_ctx:
+            quote_ctx.close()
+            trade_ctx.close()
 
 if __name__ == '__main__':
-    get_history_orders() 
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4, help='并发查询的线程数，所有线程共用限速器')
+    parser.add_argument('--incremental', action='store_true', help='增量同步：只查询各账户上次同步之后的订单并合并到本地')
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+    get_history_orders(workers=args.workers, incremental=args.incremental)
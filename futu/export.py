@@ -1,7 +1,16 @@
 import pandas as pd
+import argparse
 import os
+import sys
 
-def main():
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loader
+import profiler
+from profiler import PROFILER
+import storage
+import symbol_registry
+
+def main(parquet=False):
     # 路径
     raw_path = os.path.join('data', 'futu_history_raw.csv')
     out_path = os.path.join('data', 'futu_history.csv')
@@ -12,21 +21,35 @@ def main():
     ]
 
     # 读取原始数据
-    df = pd.read_csv(raw_path)
+    df = loader.read_table(raw_path, loader.FUTU_RAW_SCHEMA)
 
     # 生成目标DataFrame
     out_df = pd.DataFrame()
     out_df['股票代码'] = df['code']
     out_df['数量'] = df['dealt_qty']
     out_df['成交价格'] = df['dealt_avg_price']
-    out_df['买卖方向'] = df['trd_side'].replace({'BUY': 'OrderSide.Buy', 'SELL': 'OrderSide.Sell'})
+    sides = {'BUY': 'OrderSide.Buy', 'SELL': 'OrderSide.Sell'}
+    out_df['买卖方向'] = df['trd_side'].cat.rename_categories(lambda x: sides.get(x, x))
     out_df['结算币种'] = df['currency']
     out_df['合计手续费'] = df["合计手续费"]  # futu原始数据无手续费字段
     out_df['交易时间'] = df['create_time'].str[:19]  # 去除毫秒
 
     # 保存为目标格式
-    out_df.to_csv(out_path, index=False, encoding='utf-8-sig')
+    with PROFILER.stage('write_csv', len(out_df)):
+        out_df.to_csv(out_path, index=False, encoding='utf-8-sig')
     print(f'已导出到 {out_path}')
+    print(symbol_registry.describe(out_df['股票代码']))
+
+    if parquet:
+        # 同时写入按年份分区的列式存储，计税脚本会优先读取
+        with PROFILER.stage('write_parquet', len(out_df)):
+            storage.write_history(out_df, 'futu')
+        print(f'已写入列式存储 {storage.dataset_dir("futu")}')
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parquet', action='store_true', help='同时写入按年份分区的 Parquet 存储（需要 pyarrow）')
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+    main(args.parquet) 
\ No newline at end of file
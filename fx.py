@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import loader
+from profiler import PROFILER
+
+RATES_PATH = os.path.join('data', 'fx_rates.csv')
+INDEX_DIR = os.path.join('data', 'fx_index')
+# 找不到当天汇率时向前取最近一天，超过该天数视为缺失（覆盖周末和长假）
+MAX_GAP_DAYS = 10
+# 日期加上偏移后为非负数，与币种编号拼成一个64位有序键：币种编号 << 32 | 日期
+DAY_OFFSET = 1 << 31
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_index(path, index_dir):
+    # 每日汇率表 日期,币种,汇率（1单位该币种折合多少报税币种）-> 按 (币种, 日期) 排序的键数组和汇率数组
+    # 同一币种同一天有多条时取最后一条
+    df = loader.read_table(path, loader.FX_SCHEMA)
+    df = df[df['日期'].notna() & df['汇率'].notna()]
+    currencies = sorted(str(c) for c in df['币种'].dropna().unique())
+    df = df[df['币种'].notna()]
+    ids = df['币种'].astype(str).map({c:k for k, c in enumerate(currencies)}).to_numpy(np.int64)
+    days = df['日期'].to_numpy('datetime64[D]').astype(np.int64)+DAY_OFFSET
+    keys = ids << 32 | days
+    order = np.argsort(keys, kind='stable')
+    keys, rates = keys[order], df['汇率'].to_numpy(np.float64)[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, 'keys.npy'), keys[last])
+    np.save(os.path.join(index_dir, 'rates.npy'), rates[last])
+    with open(os.path.join(index_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({"digest":file_digest(path), "currencies":currencies}, f)
+
+
+class FxIndex:
+    # 内存映射的有序汇率索引，一次 searchsorted 完成全部记录的按日期向前匹配（as-of join）
+    def __init__(self, path=RATES_PATH, target='CNY', index_dir=INDEX_DIR):
+        self.target = target
+        self.digest = file_digest(path)
+        meta_path = os.path.join(index_dir, 'meta.json')
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        # 汇率表内容变化时重建索引
+        if meta is None or meta["digest"] != self.digest:
+            with PROFILER.stage("fx_index"):
+                build_index(path, index_dir)
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        self.currencies = {c:k for k, c in enumerate(meta["currencies"])}
+        self.keys = np.load(os.path.join(index_dir, 'keys.npy'), mmap_mode='r')
+        self.rates = np.load(os.path.join(index_dir, 'rates.npy'), mmap_mode='r')
+
+    def lookup(self, currencies, times_ns):
+        # 每条记录当天或之前最近一天的汇率；报税币种本身为1，找不到或相隔太久为 NaN
+        currencies = np.asarray(currencies, dtype=object)
+        days = np.asarray(times_ns, dtype=np.int64).view('datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+        # 只对不同的币种查表
+        codes, uniques = pd.factorize(currencies)
+        ids = np.array([self.currencies.get(str(c), -1) for c in uniques]+[-1], dtype=np.int64)[codes]
+        keys = ids << 32 | (days+DAY_OFFSET)
+        pos = np.searchsorted(self.keys, keys, side='right')-1
+        found = (ids >= 0) & (pos >= 0)
+        pos = np.where(found, pos, 0)
+        hit = self.keys[pos] if len(self.keys) else np.zeros_like(keys)
+        found &= (hit >> 32) == ids
+        found &= (days+DAY_OFFSET)-(hit & 0xFFFFFFFF) <= MAX_GAP_DAYS
+        rates = np.where(found, self.rates[pos] if len(self.rates) else np.nan, np.nan)
+        rates[currencies == self.target] = 1.0
+        # NaT 的时间没有汇率
+        rates[np.asarray(times_ns, dtype=np.int64) == np.iinfo(np.int64).min] = np.nan
+        return rates
+
+    def salt(self):
+        # 参与快照哈希，汇率表或报税币种变化后重新生成利润文件
+        return f"fx:{self.target}:{self.digest}".encode()
@@ -0,0 +1,40 @@
+import argparse
+import corporate_actions
+import engine
+import fixed
+import fx
+import profiler
+
+
+def main(platform='longbridge', methods=None, lot_selection=None, resume=True, year=None, workers=1,
+         fx_path=None, fx_currency='CNY', exact=False, actions_path=None):
+    # 只读取、排序一次历史记录，在同一遍遍历中计算所有配对方式
+    # fx_path 为每日汇率表时，利润按交易日汇率折算为 fx_currency
+    # exact 为 True 时以定点整数计算，利润精确到最小货币单位
+    # actions_path 为公司行为表，未指定时使用 data/corporate_actions.csv（存在时）
+    if not methods:
+        methods = sorted(engine.METHODS)
+    for method in methods:
+        if method not in engine.METHODS:
+            raise SystemExit(f"不支持的配对方式: {method}，可选: {sorted(engine.METHODS)}")
+    rates = fx.FxIndex(fx_path, fx_currency) if fx_path else None
+    actions = corporate_actions.CorporateActions(actions_path) if actions_path else None
+    engine.run(platform, methods, lot_selection, resume, year, workers, rates, fixed.FixedPoint() if exact else None,
+               actions)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('platform', nargs='?', default='longbridge')
+    parser.add_argument('methods', nargs='*', type=int)
+    parser.add_argument('--lots', help='先进先出法的指定批次表')
+    parser.add_argument('--full', action='store_true', help='忽略年末快照，从头计算全部历史')
+    parser.add_argument('--year', type=int, help='只计算到该年为止')
+    parser.add_argument('--workers', type=int, default=1, help='按股票分片并行配对的进程数')
+    parser.add_argument('--fx', help=f'每日汇率表（日期,币种,汇率），如 {fx.RATES_PATH}')
+    parser.add_argument('--fx-currency', default='CNY', help='折算的报税币种')
+    parser.add_argument('--exact', action='store_true', help='定点模式：数量、价格、手续费为整数，按固定规则舍入，利润精确到分')
+    parser.add_argument('--actions', help=f'公司行为表（股票代码,生效日期,比例,新代码），默认为 {corporate_actions.ACTIONS_PATH}（存在时）')
+    profiler.add_arguments(parser)
+    args = parser.parse_intermixed_args()
+    profiler.start(args)
+    main(args.platform, args.methods, args.lots, not args.full, args.year, args.workers, args.fx, args.fx_currency, args.exact, args.actions)
@@ -0,0 +1,17 @@
+import argparse
+import engine
+import profiler
+
+
+def main(platform='longbridge', lot_selection=None):
+    # 先进先出法；提供指定批次表时，平仓优先使用表中指定的开仓批次
+    engine.run(platform, [3], lot_selection)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('platform', nargs='?', default='longbridge')
+    parser.add_argument('lot_selection', nargs='?', help='指定批次表')
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+    main(args.platform, args.lot_selection)
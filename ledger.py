@@ -0,0 +1,107 @@
+import csv
+import os
+import re
+import sqlite3
+from glob import glob
+from profiler import PROFILER
+
+LEDGER_PATH = os.path.join('data', 'ledger.sqlite')
+PROFIT_PATTERN = re.compile(r'(\w+)_method(\d+)_profit_(\d{4})\.csv$')
+SUMMARY_REASON = "年度汇总"
+
+# 配对明细，列名与利润文件相同，另加平台、方式、年份、月份和在文件中的序号
+# 索引覆盖按 平台/方式/年份/币种/股票 的筛选和按股票的下钻
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS 明细 (
+    平台 TEXT NOT NULL, 方式 INTEGER NOT NULL, 年份 INTEGER NOT NULL, 月份 INTEGER, 序号 INTEGER NOT NULL,
+    配对原因 TEXT, 股票代码 TEXT, 卖出价格 REAL, 成本价 REAL, 数量 REAL, 利润 REAL, 时间 TEXT, 结算币种 TEXT,
+    汇率 REAL, 折算利润 REAL
+);
+CREATE INDEX IF NOT EXISTS 明细_键 ON 明细 (平台, 方式, 年份, 结算币种, 股票代码);
+CREATE INDEX IF NOT EXISTS 明细_股票 ON 明细 (股票代码, 方式, 年份);
+CREATE TABLE IF NOT EXISTS 汇总 (
+    平台 TEXT NOT NULL, 方式 INTEGER NOT NULL, 年份 INTEGER NOT NULL, 结算币种 TEXT, 计税方式 TEXT,
+    利润 REAL, 时间 TEXT, 折算利润 REAL
+);
+CREATE INDEX IF NOT EXISTS 汇总_键 ON 汇总 (平台, 方式, 年份, 结算币种);
+CREATE TABLE IF NOT EXISTS 文件 (
+    平台 TEXT NOT NULL, 方式 INTEGER NOT NULL, 年份 INTEGER NOT NULL, 签名 TEXT NOT NULL,
+    PRIMARY KEY (平台, 方式, 年份)
+);
+"""
+
+
+def connect(path=LEDGER_PATH):
+    # 计税步骤可能并行写入，等待对方的事务结束而不是立即报错
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def signature(path):
+    # 利润文件总是整体替换，大小和修改时间不变即内容未变，查询前检查不必读取文件
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def number(value):
+    return float(value) if value else None
+
+
+def read_profit_file(path, platform, method, year):
+    # 利润文件 -> (明细行, 汇总行)，空值存为 NULL
+    records, summaries = [], []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        converted = len(header) > 8
+        for k, row in enumerate(reader):
+            reason, symbol, sell_price, cost, qty, earn, time, currency = row[:8]
+            rate, converted_earn = (row[8], row[9]) if converted else ('', '')
+            if reason == SUMMARY_REASON:
+                # 汇总行的股票代码列为计税方式
+                summaries.append((platform, method, year, currency or None, symbol, number(earn), time or None,
+                                  number(converted_earn)))
+                continue
+            records.append((platform, method, year, int(time[5:7]) if time else None, k, reason, symbol,
+                            number(sell_price), number(cost), number(qty), number(earn), time or None,
+                            currency or None, number(rate), number(converted_earn)))
+    return records, summaries
+
+
+def sync(conn, platform=None, methods=None):
+    # 把有变化的利润文件载入账本：按文件签名判断，未变化的年份不重新载入
+    # platform、methods 指定时只同步这些平台、方式的文件；已不存在的利润文件对应的记录一并删除
+    # 返回重新载入的文件数
+    in_scope = lambda key: (platform is None or key[0] == platform) and (methods is None or key[1] in methods)
+    found = {}
+    for path in glob(os.path.join('data', '*_method*_profit_*.csv')):
+        match = PROFIT_PATTERN.search(os.path.basename(path))
+        if match and in_scope((match[1], int(match[2]))):
+            found[(match[1], int(match[2]), int(match[3]))] = path
+    loaded = {(platform, method, year):sign for platform, method, year, sign in conn.execute("SELECT * FROM 文件")}
+    loaded = {key:sign for key, sign in loaded.items() if in_scope(key)}
+    changed = 0
+    with PROFILER.stage("ledger") as info, conn:
+        info["rows"] = 0
+        for key in loaded.keys()-found.keys():
+            delete(conn, key)
+            conn.execute("DELETE FROM 文件 WHERE 平台=? AND 方式=? AND 年份=?", key)
+        for key, path in sorted(found.items()):
+            sign = signature(path)
+            if loaded.get(key) == sign:
+                continue
+            records, summaries = read_profit_file(path, *key)
+            delete(conn, key)
+            conn.executemany(f"INSERT INTO 明细 VALUES ({','.join('?'*15)})", records)
+            conn.executemany(f"INSERT INTO 汇总 VALUES ({','.join('?'*8)})", summaries)
+            conn.execute("INSERT OR REPLACE INTO 文件 VALUES (?, ?, ?, ?)", (*key, sign))
+            info["rows"] += len(records)
+            changed += 1
+    return changed
+
+
+def delete(conn, key):
+    conn.execute("DELETE FROM 明细 WHERE 平台=? AND 方式=? AND 年份=?", key)
+    conn.execute("DELETE FROM 汇总 WHERE 平台=? AND 方式=? AND 年份=?", key)
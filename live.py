@@ -0,0 +1,391 @@
+import argparse
+import json
+import math
+import os
+import signal
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import corporate_actions
+import engine
+import ledger
+import loader
+import profiler
+import storage
+import symbol_registry
+from profiler import PROFILER
+
+STATE_DIR = os.path.join('data', 'live')
+POSITION_KEYS = ("quantity", "avg_cost", "total_fee")
+# 富途订单的买卖方向，与 futu/export.py 相同
+FUTU_SIDES = {'BUY':'OrderSide.Buy', 'SELL':'OrderSide.Sell'}
+
+
+def state_path(platform):
+    return os.path.join(STATE_DIR, f"{platform}.npz")
+
+
+def history_base(platform, methods, lot_selection=None, actions=None):
+    # 持仓所基于的历史：截至最新年份的链式哈希和总行数，历史重新下载或公司行为表变化后旧的状态失效
+    manifest = storage.open_history(platform).years()
+    salt = engine.base_salt(actions=actions)+engine.selection_salt(lot_selection)
+    chain = engine.chain_digests(manifest, salt)
+    rows, digest = (chain[-1][1], chain[-1][2]) if chain else (0, '')
+    return f"{digest}:{','.join(map(str, methods))}", rows
+
+
+class Live:
+    # 常驻内存的持仓和已实现利润，逐笔应用券商推送的成交
+    # 配对直接调用引擎各方式的逐笔配对函数，结果与把这些成交追加到历史末尾后重新计算相同
+    # 成交、查询和保存来自不同线程，都在同一把锁内进行
+    def __init__(self, platform, methods, symbols, books, rows, base, path=None):
+        self.platform = platform
+        self.methods = list(methods)
+        self.registry = symbol_registry.SymbolRegistry(symbols)
+        self.symbols = self.registry.symbols
+        self.books = dict(books)
+        self.capacity = len(self.books[self.methods[0]].quantity)
+        # 下一笔成交的行号接在历史之后，不会与先进先出法已有批次的开仓行号冲突
+        self.rows = rows
+        self.base = base
+        self.path = path
+        # 年份 -> 方式 -> 币种 -> [利润部分和, 正利润部分和]
+        self.totals = {}
+        # 订单号 -> [累计成交数量, 累计成交金额, 累计手续费]
+        self.orders = {}
+        self.fills = 0
+        self.dirty = False
+        # 成交处理次数、总耗时和最大耗时（纳秒）
+        self.latency = [0, 0, 0]
+        self.lock = threading.Lock()
+        self._grow(len(self.symbols))
+
+    @classmethod
+    def load(cls, platform, methods, lot_selection=None, fresh=False, path=None):
+        # fresh 为 True 时从空仓开始（如回放完整的历史），否则从年末快照补算到最新的持仓，
+        # 并从账本取最新一年已实现的利润；path 处有基于同一历史的状态时直接恢复
+        actions = corporate_actions.load()
+        if fresh:
+            base, rows = f"fresh:{','.join(map(str, methods))}", 0
+        else:
+            base, rows = history_base(platform, methods, lot_selection, actions)
+        live = cls.restore(path, platform, base) if path else None
+        if live is not None:
+            print(f"从 {path} 恢复，已应用 {live.fills} 笔成交")
+            return live
+        if fresh:
+            return cls(platform, methods, [], {method:engine.new_book(method, 0) for method in methods}, 0, base, path)
+        symbols, books = engine.run(platform, methods, lot_selection, actions=actions)
+        live = cls(platform, methods, symbols, books, rows, base, path)
+        live.seed()
+        return live
+
+    def seed(self):
+        # 账本中最新一年的年度汇总作为该年已实现利润的起点
+        conn = ledger.connect()
+        try:
+            ledger.sync(conn, self.platform)
+            year = conn.execute("SELECT MAX(年份) FROM 汇总 WHERE 平台=?", (self.platform,)).fetchone()[0]
+            rows = conn.execute("SELECT 方式, 结算币种, 计税方式, 利润 FROM 汇总 WHERE 平台=? AND 年份=?",
+                                (self.platform, year)).fetchall()
+        finally:
+            conn.close()
+        for method, currency, tax_method, earn in rows:
+            if method in self.books and currency is not None and earn is not None:
+                self._total(year, method, currency)[0 if tax_method == "按年度计算" else 1].append(earn)
+
+    def _total(self, year, method, currency):
+        return self.totals.setdefault(year, {}).setdefault(method, {}).setdefault(currency, [[], []])
+
+    def _grow(self, size):
+        # 新出现的股票时成倍扩大持仓数组，不必每只新股票都复制一次
+        if size > self.capacity:
+            self.capacity = max(size, 2*self.capacity, 16)
+            self.books = {method:engine.grow_book(method, book, self.capacity) for method, book in self.books.items()}
+        self.lanes = [(method, partial(engine.METHODS[method], *book.views())) for method, book in self.books.items()]
+
+    def on_order(self, order_id, symbol, side, executed_qty, avg_price, fee, currency, when):
+        # 订单推送给出的是累计成交数量、成交均价和手续费，换算为本次新增的成交后应用
+        # 同一状态的重复推送没有新增成交，直接忽略；返回本次产生的配对 [(方式, 配对结果)]
+        started = time.perf_counter_ns()
+        with self.lock:
+            order_id = str(order_id)
+            done = self.orders.get(order_id)
+            qty = executed_qty-done[0] if done else executed_qty
+            if not qty > 0:
+                return []
+            amount = executed_qty*avg_price
+            price = (amount-done[1])/qty if done else avg_price
+            fee_part = fee-done[2] if done else fee
+            self.orders[order_id] = [executed_qty, amount, fee]
+            records = self.apply(symbol, qty if side == "OrderSide.Buy" else -qty, price, fee_part, currency, when)
+            elapsed = time.perf_counter_ns()-started
+            self.latency[0] += 1
+            self.latency[1] += elapsed
+            self.latency[2] = max(self.latency[2], elapsed)
+        return records
+
+    def apply(self, symbol, qty, price, fee, currency, when):
+        # 一笔成交交给所有配对方式，与 TradeColumns 相同：期权按合约乘数计价，缺失成交价按0处理
+        i = self.registry.add(symbol)
+        if i >= self.capacity:
+            self._grow(i+1)
+        if self.registry.columns["asset_class"][i] == symbol_registry.OPTION:
+            price = 0.0 if price != price else price*self.registry.columns["multiplier"][i]
+        row = self.rows
+        self.rows += 1
+        self.fills += 1
+        self.dirty = True
+        records = []
+        for method, step in self.lanes:
+            record = step(row, i, qty, price, fee)
+            if record is None:
+                continue
+            records.append((method, record))
+            earn = record[4]
+            # 缺失的币种不参与汇总，缺失的利润不计入
+            if isinstance(currency, str) and earn == earn:
+                total = self._total(when.year, method, currency)
+                engine.add_partial(total[0], earn)
+                if earn > 0:
+                    engine.add_partial(total[1], earn)
+        return records
+
+    def pnl(self, year=None):
+        # 某年（默认最新一年）各方式、各币种的已实现利润
+        with self.lock:
+            year = year or max(self.totals, default=None)
+            totals = self.totals.get(year, {})
+            return {
+                "platform":self.platform,
+                "year":year,
+                "fills":self.fills,
+                "pnl":{method:{currency:{"按年度计算":math.fsum(total[0]), "按单次计算":math.fsum(total[1])}
+                               for currency, total in sorted(totals.get(method, {}).items())}
+                       for method in self.methods},
+            }
+
+    def positions(self, symbol=None):
+        # 各方式下未平仓的持仓：数量（带方向）、均价和剩余手续费
+        with self.lock:
+            ids = range(len(self.symbols)) if symbol is None else \
+                [self.registry.index[symbol]] if symbol in self.registry.index else []
+            result = {}
+            for method, book in self.books.items():
+                result[method] = {self.symbols[i]:{"数量":float(book.quantity[i]), "均价":float(book.avg_cost[i]),
+                                                   "手续费":float(book.total_fee[i])}
+                                  for i in ids if book.quantity[i]}
+            return result
+
+    def stats(self):
+        with self.lock:
+            count, total, worst = self.latency
+            return {
+                "fills":self.fills,
+                "orders":len(self.orders),
+                "symbols":len(self.symbols),
+                "mean_latency_us":round(total/count/1000, 3) if count else None,
+                "max_latency_us":round(worst/1000, 3) if count else None,
+            }
+
+    def save(self):
+        # 有新成交时写出状态，先写临时文件再替换；数组在锁内复制，写文件在锁外进行
+        if self.path is None or not self.dirty:
+            return
+        with PROFILER.stage("save"):
+            with self.lock:
+                n = len(self.symbols)
+                arrays = {}
+                for method, book in self.books.items():
+                    for key, value in book.state().items():
+                        arrays[f"method{method}_{key}"] = value[:n].copy() if key in POSITION_KEYS else value
+                meta = {
+                    "base":self.base,
+                    "methods":self.methods,
+                    "rows":self.rows,
+                    "fills":self.fills,
+                    "totals":{str(year):{str(method):by_method for method, by_method in by_year.items()}
+                              for year, by_year in self.totals.items()},
+                    "orders":self.orders,
+                }
+                meta = json.dumps(meta)
+                symbols = list(self.symbols)
+                self.dirty = False
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path+".tmp.npz"
+            np.savez(tmp_path, meta=np.array(meta), symbols=np.array(symbols, dtype=str), **arrays)
+            os.replace(tmp_path, self.path)
+
+    @classmethod
+    def restore(cls, path, platform, base):
+        # 状态基于同一历史和同样的方式时恢复，否则返回 None
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                arrays = {key:data[key] for key in data.files}
+        except (OSError, ValueError) as e:
+            print(f"无法读取状态 {path}: {e}")
+            return None
+        meta = json.loads(str(arrays.pop("meta")))
+        if meta["base"] != base:
+            return None
+        symbols = arrays.pop("symbols").tolist()
+        books = {}
+        for method in meta["methods"]:
+            prefix = f"method{method}_"
+            state = {key[len(prefix):]:value for key, value in arrays.items() if key.startswith(prefix)}
+            books[method] = engine.new_book(method, len(symbols))
+            books[method].load_state(state, np.arange(len(symbols)))
+        live = cls(platform, meta["methods"], symbols, books, meta["rows"], base, path)
+        live.fills = meta["fills"]
+        live.orders = meta["orders"]
+        live.totals = {int(year):{int(method):by_method for method, by_method in by_year.items()}
+                       for year, by_year in meta["totals"].items()}
+        return live
+
+
+def replay(live, path, speed=0.0, done=None):
+    # 本地的假事件源：把历史文件中的交易按时间顺序作为已全部成交的订单推送
+    # speed 为0时尽快推送，否则按交易时间间隔的 1/speed 推送；订单号为文件名和行号，重复回放同一文件不会重复计入
+    df = loader.read_table(path, loader.HISTORY_SCHEMA).sort_values("交易时间", kind="stable")
+    name = os.path.basename(path)
+    columns = [df[column].tolist() for column in ("股票代码", "买卖方向", "数量", "成交价格", "合计手续费", "结算币种", "交易时间")]
+    started = time.monotonic()
+    first = None
+    with PROFILER.stage("replay", len(df)):
+        for k, (symbol, side, qty, price, fee, currency, when) in enumerate(zip(*columns)):
+            if speed:
+                if first is None:
+                    first = when
+                delay = (when-first).total_seconds()/speed-(time.monotonic()-started)
+                if delay > 0:
+                    time.sleep(delay)
+            live.on_order(f"{name}:{k}", symbol, side, qty, price, fee, currency, when)
+    print(f"已回放 {len(df)} 笔交易")
+    if done is not None:
+        done.set()
+
+
+def futu_source(live, host='127.0.0.1', port=11111):
+    # 富途 OpenD 的订单推送，每次推送为若干订单的最新状态
+    # 推送中没有手续费，手续费按0计入，以之后下载的订单费用为准
+    import futu
+
+    class OrderHandler(futu.TradeOrderHandlerBase):
+        def on_recv_rsp(self, rsp_pb):
+            ret, data = super().on_recv_rsp(rsp_pb)
+            if ret == futu.RET_OK:
+                for order in data.to_dict('records'):
+                    if order.get('trd_env', futu.TrdEnv.REAL) != futu.TrdEnv.REAL or not order['dealt_qty']:
+                        continue
+                    live.on_order(order['order_id'], order['code'], FUTU_SIDES.get(order['trd_side'], order['trd_side']),
+                                  float(order['dealt_qty']), float(order['dealt_avg_price']), 0.0,
+                                  order.get('currency'), pd.Timestamp(str(order['create_time'])[:19]))
+            return ret, data
+
+    trade_ctx = futu.OpenSecTradeContext(host=host, port=port, filter_trdmarket=futu.TrdMarket.NONE)
+    trade_ctx.set_handler(OrderHandler())
+    return trade_ctx.close
+
+
+def longbridge_source(live):
+    # 长桥的订单变动推送，配置从环境变量读取，与下载脚本相同
+    # 推送中没有手续费，手续费按0计入，以之后下载的订单详情为准
+    from longport.openapi import Config, TopicType, TradeContext
+
+    def on_order_changed(event):
+        if not event.executed_quantity or event.executed_price is None:
+            return
+        live.on_order(event.order_id, str(event.symbol), str(event.side), float(event.executed_quantity),
+                      float(event.executed_price), 0.0, str(event.currency), pd.Timestamp(event.submitted_at))
+
+    ctx = TradeContext(Config.from_env())
+    ctx.set_on_order_changed(on_order_changed)
+    ctx.subscribe([TopicType.Private])
+    return lambda: ctx.unsubscribe([TopicType.Private])
+
+
+def serve(live, port):
+    # 本地查询接口：/pnl?year=2024 已实现利润，/positions?symbol=US.AAPL 持仓，/stats 成交数和处理耗时
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key:values[-1] for key, values in parse_qs(url.query).items()}
+            routes = {
+                "/pnl":lambda: live.pnl(int(query["year"]) if "year" in query else None),
+                "/positions":lambda: live.positions(query.get("symbol")),
+                "/stats":live.stats,
+            }
+            if url.path not in routes:
+                self.send_error(404, f"available: {', '.join(routes)}")
+                return
+            body = json.dumps(routes[url.path](), ensure_ascii=False, indent=2).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 不逐条打印请求
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"查询接口: http://127.0.0.1:{port}/pnl")
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='常驻运行，按券商推送的成交实时更新持仓和已实现利润')
+    parser.add_argument('platform', choices=['futu', 'longbridge'])
+    parser.add_argument('methods', nargs='*', type=int)
+    parser.add_argument('--lots', help='先进先出法的指定批次表')
+    parser.add_argument('--replay', help='不连接券商，把该历史文件中的交易作为成交依次推送')
+    parser.add_argument('--speed', type=float, default=0.0, help='回放速度倍数，0为尽快回放')
+    parser.add_argument('--fresh', action='store_true', help='从空仓开始而不是从已有的历史开始，用于回放完整的历史')
+    parser.add_argument('--state', help=f'状态文件，默认 {STATE_DIR}/<平台>.npz，加 --fresh 时默认不保存')
+    parser.add_argument('--interval', type=float, default=60.0, help='保存状态的间隔秒数')
+    parser.add_argument('--port', type=int, default=8765, help='本地查询接口的端口，0为不开启')
+    parser.add_argument('--opend', default='127.0.0.1:11111', help='富途 OpenD 的地址')
+    profiler.add_arguments(parser)
+    args = parser.parse_intermixed_args()
+    profiler.start(args)
+    # 作为服务运行时收到 SIGTERM 与 Ctrl+C 相同，保存状态后退出
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    methods = args.methods or sorted(engine.METHODS)
+    path = args.state or (None if args.fresh else state_path(args.platform))
+    with PROFILER.stage("load"):
+        live = Live.load(args.platform, methods, args.lots, args.fresh, path)
+    server = serve(live, args.port) if args.port else None
+    done = threading.Event()
+    if args.replay:
+        threading.Thread(target=replay, args=(live, args.replay, args.speed, done), daemon=True).start()
+        stop = done.set
+    elif args.platform == 'futu':
+        host, _, port = args.opend.rpartition(':')
+        stop = futu_source(live, host, int(port))
+    else:
+        stop = longbridge_source(live)
+    try:
+        # 券商推送一直运行到 Ctrl+C；回放结束后保存并打印，开启查询接口时继续提供查询
+        while not done.wait(args.interval):
+            live.save()
+        live.save()
+        print(json.dumps(live.pnl(), ensure_ascii=False, indent=2))
+        print(json.dumps(live.stats(), ensure_ascii=False))
+        if server:
+            print("回放结束，查询接口继续运行，Ctrl+C 退出")
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+        live.save()
+        if server:
+            server.shutdown()
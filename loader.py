@@ -0,0 +1,152 @@
+import pandas as pd
+from profiler import PROFILER
+
+# 各数据文件的列和类型，读取时按此指定类型，不再由 pandas 逐列推断
+# "category" 为重复值很多的列，"datetime" 按固定格式解析为纳秒时间
+HISTORY_SCHEMA = {
+    "股票代码":"category",
+    "数量":"float64",
+    "成交价格":"float64",
+    "买卖方向":"category",
+    "结算币种":"category",
+    "合计手续费":"float64",
+    "交易时间":"datetime",
+}
+CASH_SCHEMA = {
+    "事项":"category",
+    "金额":"float64",
+    "币种":"category",
+    "时间":"datetime",
+}
+# futu/download.py 写出的原始订单，只列出导出和增量同步用到的列
+FUTU_RAW_SCHEMA = {
+    "order_id":"str",
+    "code":"category",
+    "dealt_qty":"float64",
+    "dealt_avg_price":"float64",
+    "trd_side":"category",
+    "currency":"category",
+    "create_time":"str",
+    "acc_id":"int64",
+    "合计手续费":"float64",
+}
+LOT_SCHEMA = {
+    "股票代码":"str",
+    "交易时间":"datetime",
+    "开仓时间":"datetime",
+    "数量":"float64",
+}
+# 每日汇率：1单位该币种折合多少报税币种
+FX_SCHEMA = {
+    "日期":"datetime",
+    "币种":"category",
+    "汇率":"float64",
+}
+# 公司行为：生效日期之前的成交数量乘以比例、价格除以比例（拆股为新股数/旧股数），新代码非空时改为新代码
+ACTION_SCHEMA = {
+    "股票代码":"str",
+    "生效日期":"datetime",
+    "比例":"float64",
+    "新代码":"str",
+}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def parse_time(values, path='', column=''):
+    # 先按固定格式解析，带毫秒或时区等其他 ISO 8601 写法时再按 ISO 8601 解析
+    try:
+        return pd.to_datetime(values, format=TIME_FORMAT).astype("datetime64[ns]")
+    except (ValueError, TypeError):
+        pass
+    try:
+        return pd.to_datetime(values, format="ISO8601").astype("datetime64[ns]")
+    except (ValueError, TypeError) as e:
+        raise SchemaError(f"{path} 的 {column} 列有无法解析的时间: {e}") from None
+
+
+def check_columns(columns, schema, path):
+    missing = [column for column in schema if column not in columns]
+    if missing:
+        raise SchemaError(f"{path} 缺少列 {missing}，实际的列为 {list(columns)}")
+
+
+def read_table(path, schema, columns=None, keep_other=False, categorical=True, parse_times=True):
+    # 按 schema 读取 csv 并校验列
+    # columns 只读取其中几列；keep_other 保留 schema 之外的列（按 pandas 推断类型）
+    # categorical 为 False 时类别列按字符串读取，便于与新数据合并
+    schema = {column:schema[column] for column in columns} if columns else schema
+    header = pd.read_csv(path, nrows=0).columns
+    check_columns(header, schema, path)
+    dtype = {column:("str" if kind == "datetime" or (kind == "category" and not categorical) else kind)
+             for column, kind in schema.items()}
+    with PROFILER.stage("read_csv") as info:
+        try:
+            df = pd.read_csv(path, dtype=dtype, usecols=None if keep_other else list(schema))
+        except ValueError as e:
+            raise SchemaError(f"{path} 中有与类型不符的值: {e}") from None
+        info["rows"] = len(df)
+    if parse_times:
+        with PROFILER.stage("parse_time", len(df)):
+            for column, kind in schema.items():
+                if kind == "datetime":
+                    df[column] = parse_time(df[column], path, column)
+    return df if keep_other else df[list(schema)]
+
+
+def read_chunks(path, schema, chunksize=100_000):
+    # 按块读取，每块的类型与 read_table 相同，用于内存有限的单遍汇总
+    header = pd.read_csv(path, nrows=0).columns
+    check_columns(header, schema, path)
+    dtype = {column:("str" if kind == "datetime" else kind) for column, kind in schema.items()}
+    try:
+        chunks = pd.read_csv(path, dtype=dtype, usecols=list(schema), chunksize=chunksize)
+        while True:
+            with PROFILER.stage("read_csv") as info:
+                df = next(chunks, None)
+                info["rows"] = 0 if df is None else len(df)
+            if df is None:
+                return
+            with PROFILER.stage("parse_time", len(df)):
+                for column, kind in schema.items():
+                    if kind == "datetime":
+                        df[column] = parse_time(df[column], path, column)
+            yield df[list(schema)]
+    except ValueError as e:
+        if isinstance(e, SchemaError):
+            raise
+        raise SchemaError(f"{path} 中有与类型不符的值: {e}") from None
+
+
+def conform(df, schema, path=''):
+    # 把已在内存中的表（导出结果、列式存储的分区）转换为 schema 的类型
+    check_columns(df.columns, schema, path)
+    df = df[list(schema)].copy()
+    for column, kind in schema.items():
+        if kind == "datetime":
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = parse_time(df[column], path, column)
+            else:
+                df[column] = df[column].astype("datetime64[ns]")
+        elif df[column].dtype != kind:
+            df[column] = df[column].astype(kind)
+    return df
+
+
+def check_times(df, column, path=''):
+    # 时间为空的行无法归入年份，报错并列出这些行在 csv 中的行号（表头为第1行）
+    rows = df.index[df[column].isna()]
+    if len(rows):
+        lines = "、".join(str(k+2) for k in rows[:10])+(" 等" if len(rows) > 10 else "")
+        raise SchemaError(f"{path} 的 {column} 列有 {len(rows)} 行为空：第 {lines} 行")
+
+
+def load_history(path):
+    # 标准格式的交易记录，按秒级时间稳定排序；交易时间不能为空
+    df = read_table(path, HISTORY_SCHEMA)
+    check_times(df, "交易时间", path)
+    with PROFILER.stage("sort", len(df)):
+        return df.sort_values("交易时间", kind="stable")
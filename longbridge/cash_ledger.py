@@ -0,0 +1,109 @@
+import csv
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loader
+from profiler import PROFILER
+
+CASH_COLUMNS = list(loader.CASH_SCHEMA)
+EVENT_NAMES = {
+    'Deposit Cash': '存入现金',
+    'Buy Contract-Stocks': '买入合约股票',
+    'Currency Conversion (Credit)': '货币兑换（贷记）',
+    'Currency Conversion (Debit)': '货币兑换（借记）',
+    'Stock Trade Fee': '股票交易费',
+    'Promotion Adjustment Credit': '促销调整贷记',
+    'Sell Contract-Stocks': '卖出合约股票',
+    'Stock Sell Commission': '股票卖出佣金',
+    'Option Purchase Transaction': '期权购买交易',
+    'Option Purchase Fee': '期权购买费用',
+    'Option Sell Transaction': '期权卖出交易',
+    'Option Sell Fee': '期权卖出费用',
+    'Debit Interest': '借方利息',
+    'ADR Fee': '美国存托凭证费用',
+    'Cash Dividend': '现金股息',
+    'CO Other FEE': '结算其他费用',
+    'Exercise Stock Option (Sell Stock)': '行使股票期权（卖出股票）',
+    'Others': '其他',
+    'Stock Short Sale': '股票卖空',
+    'Short Selling Interest': '卖空利息',
+    'Placement': '配售',
+    'Redemption': '赎回',
+    'Credit Corporate Action Funds': '公司行为资金贷记',
+    'Debit Corporate Action Funds': '公司行为资金借记'
+}
+
+
+def write_records(flows, path):
+    # 用 csv 模块写出，事项等字段中含逗号或引号时会正确转义；时间为固定格式，先写临时文件再替换
+    with open(path+'.tmp', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CASH_COLUMNS)
+        for x in flows:
+            writer.writerow([x.transaction_flow_name, str(x.balance), x.currency,
+                             x.business_time.strftime(loader.TIME_FORMAT)])
+    os.replace(path+'.tmp', path)
+
+
+class CashLedger:
+    # 按 (年份, 币种, 事项) 累加金额，三者都编码为整数，累加在稠密数组中进行
+    # 逐块按文件顺序累加，结果与块大小无关，内存只与年份、币种、事项的种类数有关
+    def __init__(self):
+        self.years = {}
+        self.currencies = {}
+        self.events = {}
+        self.amounts = np.zeros((0, 0, 0), dtype=np.float64)
+        self.counts = np.zeros((0, 0, 0), dtype=np.int64)
+
+    @staticmethod
+    def encode(mapping, values):
+        # 一块中的值 -> 全局编号，新出现的值依次追加
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        ids = np.array([mapping.setdefault(value, len(mapping)) for value in uniques], dtype=np.intp)
+        return ids[codes]
+
+    def _grow(self):
+        shape = (len(self.years), len(self.currencies), len(self.events))
+        if shape != self.amounts.shape:
+            pad = [(0, new-old) for new, old in zip(shape, self.amounts.shape)]
+            self.amounts = np.pad(self.amounts, pad)
+            self.counts = np.pad(self.counts, pad)
+
+    def add(self, df):
+        # 时间缺失的记录没有年份，不计入汇总；缺失的金额按0计
+        df = df[df['时间'].notna()]
+        years = self.encode(self.years, df['时间'].dt.year.to_numpy())
+        currencies = self.encode(self.currencies, df['币种'].astype(object).to_numpy())
+        events = self.encode(self.events, df['事项'].astype(object).to_numpy())
+        self._grow()
+        index = (years, currencies, events)
+        np.add.at(self.amounts, index, np.nan_to_num(df['金额'].to_numpy(np.float64)))
+        np.add.at(self.counts, index, 1)
+
+    def summary(self):
+        # 有记录的组合，事项翻译为中文，按年份、币种、事项排序
+        years, currencies, events = np.nonzero(self.counts)
+        names = lambda mapping: np.array(list(mapping), dtype=object)
+        df = pd.DataFrame({
+            '年份':names(self.years)[years].astype(np.int64),
+            '币种':names(self.currencies)[currencies],
+            '事项':[EVENT_NAMES.get(event, event) for event in names(self.events)[events]],
+            '金额':self.amounts[years, currencies, events],
+        })
+        # 翻译后重名的事项合并
+        df = df.groupby(['年份', '币种', '事项'], sort=True)['金额'].sum().reset_index()
+        return df
+
+
+def summarize(path, out_path, chunksize=100_000):
+    ledger = CashLedger()
+    for df in loader.read_chunks(path, loader.CASH_SCHEMA, chunksize):
+        with PROFILER.stage("accumulate", len(df)):
+            ledger.add(df)
+    with PROFILER.stage("summary"):
+        summary = ledger.summary()
+        summary.to_csv(out_path, index=False, encoding='utf-8-sig')
+    return summary
@@ -1,18 +1,23 @@
 from datetime import datetime
 from longport.openapi import TradeContext, Config
+import argparse
+import os
+import sys
+from cash_ledger import write_records
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import profiler
+from profiler import PROFILER
+
+parser = argparse.ArgumentParser()
+profiler.add_arguments(parser)
+profiler.start(parser.parse_args())
 config = Config.from_env()
 ctx = TradeContext(config)
-resp = ctx.cash_flow(
-    start_at = datetime(2022, 1, 1),
-    end_at = datetime.today()
-)
-with open("data/longbridge_cash.csv",'w') as f:
-    print("事项,金额,币种,时间", file=f)
-    for x in resp:
-        print(
-            x.transaction_flow_name,
-            x.balance,
-            x.currency,
-            x.business_time,
-            sep=",",
-            file=f)
\ No newline at end of file
+with PROFILER.api('cash_flow'):
+    resp = ctx.cash_flow(
+        start_at = datetime(2022, 1, 1),
+        end_at = datetime.today()
+    )
+with PROFILER.stage('write_csv', len(resp)):
+    write_records(resp, "data/longbridge_cash.csv")
@@ -1,27 +1,90 @@
 from datetime import datetime
-from longport.openapi import TradeContext, Config, OrderStatus, OrderSide, Market
-import time
-import logging
+from longport.openapi import TradeContext, Config, OrderStatus
+import argparse
+import csv
+import os
 import pathlib
+import sys
 
-config = Config.from_env()
-ctx = TradeContext(config)
-
-resp = ctx.history_orders(
-    status = [OrderStatus.Filled],
-    start_at = datetime(2022, 1, 1),
-    end_at = datetime.today()
-)
-
-pathlib.Path("data").mkdir(exist_ok=True)
-with open("data/longbridge_history.csv",'w') as f:
-    print("股票代码,数量,成交价格,买卖方向,结算币种,合计手续费,交易时间", file=f)
-    for x in resp:
-        try:
-            resp = ctx.order_detail(
-                order_id = x.order_id,
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loader
+import profiler
+import storage
+import symbol_registry
+from fetcher import AdaptiveTokenBucket, fetch_details
+from order_cache import OrderDetailCache
+from profiler import PROFILER
+
+HISTORY_COLUMNS = list(loader.HISTORY_SCHEMA)
+
+
+def detail_row(order, detail):
+    # 缓存中保存与原先写入csv时相同的字符串形式
+    return {
+        "股票代码":str(detail.symbol),
+        "数量":str(detail.executed_quantity),
+        "成交价格":str(detail.executed_price),
+        "买卖方向":str(detail.side),
+        "结算币种":str(detail.currency),
+        "合计手续费":str(detail.charge_detail.total_amount),
+        "交易时间":str(order.submitted_at),
+        "submitted_at":order.submitted_at.isoformat(),
+    }
+
+
+def write_history(cache, path):
+    # 由缓存中的全部订单重新生成历史文件，按下单时间排序
+    items = sorted(cache.details.values(), key=lambda item: (item["submitted_at"], item["order_id"]))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HISTORY_COLUMNS)
+        for item in items:
+            writer.writerow([item[column] for column in HISTORY_COLUMNS])
+
+
+def main(workers=8, rate=5.0, parquet=False):
+    config = Config.from_env()
+    ctx = TradeContext(config)
+    pathlib.Path("data").mkdir(exist_ok=True)
+
+    with OrderDetailCache() as cache:
+        # 只列出缓存高水位之后的订单，已缓存的订单不会重复获取详情
+        start_at = cache.watermark or datetime(2022, 1, 1)
+        with PROFILER.api('history_orders'):
+            orders = ctx.history_orders(
+                status = [OrderStatus.Filled],
+                start_at = start_at,
+                end_at = datetime.today()
             )
-            print(resp.symbol,resp.executed_quantity,resp.executed_price,resp.side,resp.currency,resp.charge_detail.total_amount,x.submitted_at,sep=",",file=f)
-        except:
-            logging.info(x)
-        time.sleep(1.5)
+        pending = [x for x in orders if x.order_id not in cache]
+        print(f"从 {start_at} 起共 {len(orders)} 个订单，已缓存 {len(cache)} 个，需获取 {len(pending)} 个")
+
+        limiter = AdaptiveTokenBucket(rate=rate)
+        with PROFILER.stage('fetch_details', len(pending)):
+            failed = fetch_details(ctx, pending, lambda x, resp: cache.put(x.order_id, detail_row(x, resp)),
+                                   limiter=limiter, workers=workers)
+
+        # 有失败的订单时高水位停在最早失败的订单，下次运行会重新列出并补齐
+        if failed:
+            cache.set_watermark(min(x.submitted_at for x in failed))
+            print(f"{len(failed)} 个订单获取失败，下次运行时重试")
+        elif orders:
+            cache.set_watermark(max(x.submitted_at for x in orders))
+
+    with PROFILER.stage('write_csv', len(cache)):
+        write_history(cache, "data/longbridge_history.csv")
+    print(symbol_registry.describe(cache.details[x]["股票代码"] for x in cache.details))
+    if parquet:
+        # 同时写入按年份分区的列式存储，计税脚本会优先读取
+        storage.write_history(loader.read_table("data/longbridge_history.csv", loader.HISTORY_SCHEMA), "longbridge")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8, help='并发获取订单详情的线程数')
+    parser.add_argument('--rate', type=float, default=5.0, help='初始每秒请求数，遇到限流会自动降低')
+    parser.add_argument('--parquet', action='store_true', help='同时写入按年份分区的 Parquet 存储（需要 pyarrow）')
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+    main(args.workers, args.rate, args.parquet)
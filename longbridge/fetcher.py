@@ -0,0 +1,105 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from profiler import PROFILER
+
+
+class AdaptiveTokenBucket:
+    # 令牌桶限速器，所有线程共享
+    # 成功请求缓慢提高速率，遇到限流时速率减半（加性增、乘性减）
+    def __init__(self, rate=5.0, capacity=5, min_rate=0.2, max_rate=20.0, step=0.1):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens+(now-self.updated)*self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # 只在锁内计算需要等待的时间，睡眠在锁外进行，不会阻塞其他线程
+        # 返回本次等待的秒数
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1-self.tokens)/self.rate
+                self.waited += wait
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate+self.step)
+
+    def on_throttled(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate/2)
+            # 清空令牌，让所有线程一起放慢
+            self.tokens = min(self.tokens, 0)
+
+
+def is_rate_limited(e):
+    # 长桥接口限流时返回 429 类错误码，或错误信息中包含 limit
+    code = getattr(e, 'code', None)
+    if code is not None and str(code).startswith('429'):
+        return True
+    message = str(e).lower()
+    return '429' in message or 'limit' in message
+
+
+def fetch_one(ctx, order, limiter, retries, backoff):
+    for attempt in range(retries+1):
+        waited = limiter.acquire()
+        try:
+            with PROFILER.api('order_detail', waited):
+                detail = ctx.order_detail(order_id=order.order_id)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            if is_rate_limited(e):
+                limiter.on_throttled()
+            # 指数退避加随机抖动，避免所有线程同时重试
+            time.sleep(random.uniform(0, backoff*2**attempt))
+            continue
+        limiter.on_success()
+        return detail
+
+
+def fetch_details(ctx, orders, on_detail, limiter=None, workers=8, retries=5, backoff=0.5, report_every=5.0):
+    # 并发获取订单详情，每获取一个调用 on_detail(order, detail)
+    # 返回获取失败的订单列表，输出顺序由调用方按下单时间重新排序保证确定
+    limiter = limiter or AdaptiveTokenBucket()
+    failed = []
+    done = 0
+    started = last_report = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_one, ctx, order, limiter, retries, backoff): order for order in orders}
+        for future in as_completed(futures):
+            order = futures[future]
+            try:
+                on_detail(order, future.result())
+            except Exception as e:
+                logging.warning(f"获取订单详情失败 {order.order_id}: {e}")
+                failed.append(order)
+            done += 1
+            now = time.monotonic()
+            if now-last_report >= report_every or done == len(futures):
+                last_report = now
+                elapsed = max(now-started, 1e-9)
+                print(f"  已完成 {done}/{len(futures)}，{done/elapsed:.1f} 个/秒，"
+                      f"当前限速 {limiter.rate:.1f} 次/秒，累计等待 {limiter.waited:.1f} 秒")
+    return failed
@@ -0,0 +1,64 @@
+import json
+import os
+from datetime import datetime
+
+
+class OrderDetailCache:
+    # order_detail 结果的本地缓存，追加写入的 JSONL 文件，每行一个订单，按 order_id 去重
+    # 另有 {"watermark": ...} 行记录已完整获取到的最新下单时间，以最后一行为准
+    def __init__(self, path='data/longbridge_order_detail.jsonl'):
+        self.path = path
+        self.details = {}
+        self.watermark = None
+        if os.path.exists(path):
+            self._load()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        # 上次中断可能留下不完整的最后一行，补一个换行避免和新记录连在一起
+        if self.file.tell() > 0 and not self._ends_with_newline():
+            self.file.write('\n')
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # 中断时写了一半的行，丢弃后会重新获取
+                    continue
+                if 'watermark' in item:
+                    self.watermark = datetime.fromisoformat(item['watermark'])
+                else:
+                    self.details[item['order_id']] = item
+
+    def __contains__(self, order_id):
+        return str(order_id) in self.details
+
+    def __len__(self):
+        return len(self.details)
+
+    def put(self, order_id, detail):
+        item = dict(detail, order_id=str(order_id))
+        self.details[item['order_id']] = item
+        self.file.write(json.dumps(item, ensure_ascii=False)+'\n')
+        # 每条立即落盘，进程崩溃也只丢失正在获取的订单
+        self.file.flush()
+
+    def set_watermark(self, watermark):
+        self.watermark = watermark
+        self.file.write(json.dumps({'watermark': watermark.isoformat()})+'\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from glob import glob
+import profiler
+from profiler import PROFILER
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join('data', 'pipeline_state.json')
+REPORT_PATH = os.path.join('data', 'report.txt')
+# 公司行为表（corporate_actions.ACTIONS_PATH），存在时计税步骤在配对前调整，内容变化后重新计税
+ACTIONS_PATH = os.path.join('data', 'corporate_actions.csv')
+PLATFORMS = ['futu', 'longbridge']
+
+
+def stage(script, args=(), deps=(), inputs=(), outputs=(), code=(), optional=(), always=False):
+    # 一个步骤：运行 script，inputs/outputs 为 data 下的文件或通配符
+    # 输入文件内容、脚本及 code 中模块的源码共同组成指纹，指纹不变且输出齐全时跳过
+    # inputs 缺失时跳过该步骤，optional 中的输入可以不存在
+    # always 为 True 的步骤（下载）没有本地输入，每次都运行
+    return {
+        "command":[os.path.join(ROOT, script), *args],
+        "deps":list(deps),
+        "inputs":list(inputs),
+        "optional":list(optional),
+        "outputs":list(outputs),
+        "code":[script, *code],
+        "always":always,
+    }
+
+
+def build_stages(platforms, download=False, workers=1, fx=None, exact=False):
+    # 各平台的步骤链互不依赖，最后汇总到 report
+    # fx 为汇率表路径时计税步骤折算利润，汇率表也作为计税步骤的输入
+    # exact 为 True 时计税步骤使用定点模式
+    tax_args = (['--workers', str(workers)] if workers > 1 else [])+(['--fx', fx] if fx else [])+(['--exact'] if exact else [])
+    tax_inputs = [fx] if fx else []
+    engine_code = ['engine.py', 'storage.py', 'symbol_registry.py', 'fx.py', 'fixed.py', 'corporate_actions.py', 'loader.py']
+    stages = {}
+    if 'futu' in platforms:
+        if download:
+            stages['futu_download'] = stage('futu/download.py', ['--incremental'], outputs=['data/futu_history_raw.csv'],
+                                            always=True)
+        stages['futu_export'] = stage('futu/export.py', deps=['futu_download'] if download else [],
+                                      inputs=['data/futu_history_raw.csv'], outputs=['data/futu_history.csv'],
+                                      code=['symbol_registry.py', 'loader.py'])
+        stages['futu_tax'] = stage('get_tax.py', ['futu', *tax_args], deps=['futu_export'],
+                                   inputs=['data/futu_history.csv', *tax_inputs], optional=['data/history/futu/manifest.json', ACTIONS_PATH],
+                                   outputs=['data/futu_method*_profit_*.csv'], code=engine_code)
+    if 'longbridge' in platforms:
+        if download:
+            stages['longbridge_download'] = stage('longbridge/download_trade_flow.py',
+                                                  outputs=['data/longbridge_history.csv'], always=True)
+            stages['longbridge_cash_download'] = stage('longbridge/download_cash_flow.py',
+                                                       outputs=['data/longbridge_cash.csv'], always=True)
+        stages['longbridge_tax'] = stage('get_tax.py', ['longbridge', *tax_args],
+                                         deps=['longbridge_download'] if download else [],
+                                         inputs=['data/longbridge_history.csv', *tax_inputs],
+                                         optional=['data/history/longbridge/manifest.json', ACTIONS_PATH],
+                                         outputs=['data/longbridge_method*_profit_*.csv'], code=engine_code)
+        stages['longbridge_cash'] = stage('longbridge/process_cash_flow.py',
+                                          deps=['longbridge_cash_download'] if download else [],
+                                          inputs=['data/longbridge_cash.csv'], outputs=['data/longbridge_cash_summary.csv'],
+                                          code=['longbridge/cash_ledger.py', 'loader.py'])
+    stages['report'] = stage('report.py', deps=[name for name in stages if name.endswith('_tax')],
+                             inputs=['data/*_method*_profit_*.csv'], outputs=[REPORT_PATH], code=['ledger.py', 'loader.py'])
+    return stages
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(item):
+    # 命令、源码和全部输入文件按内容哈希；缺失的输入也记入指纹
+    digest = hashlib.sha256(json.dumps(item["command"][1:]).encode())
+    for path in item["code"]:
+        digest.update(f"{path}:{file_digest(os.path.join(ROOT, path))}".encode())
+    for pattern in item["inputs"]+item["optional"]:
+        paths = sorted(glob(pattern))
+        if not paths:
+            digest.update(f"{pattern}:missing".encode())
+        for path in paths:
+            digest.update(f"{path}:{file_digest(path)}".encode())
+    return digest.hexdigest()
+
+
+def outputs_exist(item):
+    return all(glob(pattern) for pattern in item["outputs"])
+
+
+def inputs_exist(item):
+    return all(glob(pattern) for pattern in item["inputs"])
+
+
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state):
+    with open(STATE_PATH+'.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(STATE_PATH+'.tmp', STATE_PATH)
+
+
+def profile_args(name):
+    # 启用性能记录时各步骤的报告写在流水线报告旁边，这些参数不计入指纹
+    if not PROFILER.enabled:
+        return []
+    path = os.path.join(os.path.dirname(PROFILER.path), f'{name}.json')
+    return ['--profile', path]+(['--cprofile'] if PROFILER.cprofile is not None and name.endswith('_tax') else [])
+
+
+def run_stage(name, item):
+    # 子进程运行脚本，输出整体收集后带步骤名打印，并行的分支不会交错
+    with PROFILER.stage(name):
+        result = subprocess.run([sys.executable, *item["command"], *profile_args(name)], capture_output=True, text=True)
+    output = result.stdout+result.stderr
+    if name == 'report' and result.returncode == 0:
+        with open(REPORT_PATH, 'w', encoding='utf-8') as f:
+            f.write(result.stdout)
+    return result.returncode, output
+
+
+def main(platforms, download=False, force=False, dry_run=False, workers=1, jobs=4, fx=None, exact=False):
+    os.makedirs('data', exist_ok=True)
+    stages = build_stages(platforms, download, workers, fx, exact)
+    state = load_state()
+    # skipped 为缺少输入而未运行的步骤，不阻止下游（如只用一个平台时 report 照常汇总）
+    done, failed, ran, skipped = set(), set(), set(), set()
+    pending = dict(stages)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or futures:
+            for name, item in list(pending.items()):
+                if any(dep in failed for dep in item["deps"]):
+                    print(f"[{name}] 依赖的步骤失败，跳过")
+                    failed.add(name)
+                    del pending[name]
+                    continue
+                if not all(dep in done or dep in skipped for dep in item["deps"]):
+                    continue
+                del pending[name]
+                if not inputs_exist(item):
+                    print(f"[{name}] 缺少输入 {item['inputs']}，跳过")
+                    skipped.add(name)
+                    continue
+                # 依赖都已完成后再计算指纹，此时输入已是上游的最新输出
+                digest = fingerprint(item)
+                fresh = not item["always"] and state.get(name, {}).get("fingerprint") == digest and outputs_exist(item)
+                # 试运行时上游需要运行，下游也视为需要运行
+                fresh = fresh and not (dry_run and any(dep in ran for dep in item["deps"]))
+                if fresh and not force:
+                    print(f"[{name}] 输入未变化，跳过")
+                    done.add(name)
+                    continue
+                if dry_run:
+                    print(f"[{name}] 需要运行")
+                    done.add(name)
+                    ran.add(name)
+                    continue
+                print(f"[{name}] 开始运行")
+                futures[pool.submit(run_stage, name, item)] = (name, digest)
+            if not futures:
+                continue
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, digest = futures.pop(future)
+                code, output = future.result()
+                for line in output.splitlines():
+                    print(f"[{name}] {line}")
+                if code:
+                    print(f"[{name}] 失败，退出码 {code}")
+                    failed.add(name)
+                    continue
+                done.add(name)
+                ran.add(name)
+                state[name] = {"fingerprint":digest, "finished":datetime.now().isoformat(timespec='seconds')}
+                save_state(state)
+    if os.path.exists(REPORT_PATH) and 'report' in done and 'report' not in ran and not dry_run:
+        # report 未重新运行时显示上次的结果
+        with open(REPORT_PATH, encoding='utf-8') as f:
+            print(f.read())
+    print(f"运行 {len(ran)} 个步骤，跳过 {len(done)-len(ran)+len(skipped)} 个，失败 {len(failed)} 个")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='下载、导出、计税、汇总的流水线，只重新运行输入有变化的步骤')
+    parser.add_argument('platforms', nargs='*', help='futu、longbridge，默认两个平台都运行')
+    parser.add_argument('--download', action='store_true', help='先从券商接口下载（富途为增量同步）')
+    parser.add_argument('--force', action='store_true', help='忽略指纹，全部重新运行')
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要运行的步骤')
+    parser.add_argument('--workers', type=int, default=1, help='计税步骤按股票分片并行配对的进程数')
+    parser.add_argument('--jobs', type=int, default=4, help='同时运行的步骤数')
+    parser.add_argument('--fx', help='每日汇率表，计税时把利润折算为人民币')
+    parser.add_argument('--exact', action='store_true', help='计税时使用定点模式，利润精确到分')
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+    for platform in args.platforms:
+        if platform not in PLATFORMS:
+            parser.error(f"不支持的平台: {platform}，可选: {PLATFORMS}")
+    sys.exit(main(args.platforms or PLATFORMS, args.download, args.force, args.dry_run, args.workers, args.jobs, args.fx, args.exact))
@@ -0,0 +1,145 @@
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+import numpy as np
+import pandas as pd
+import engine
+import loader
+import profiler
+from profiler import PROFILER
+
+RECORD_COLUMNS = ["方式", "年份"]+engine.PROFIT_COLUMNS
+SUMMARY_COLUMNS = ["方式", "年份", "结算币种", "计税方式", "利润", "时间"]
+
+
+class RecordSink:
+    # 把一种方式的配对结果收集在内存中
+    def __init__(self):
+        self.rows = []
+        self.records = []
+
+    def add(self, row, record):
+        self.rows.append(row)
+        self.records.append(record)
+
+
+def to_frame(trades):
+    # DataFrame 或 Arrow 表 -> 按 schema 转换类型、按时间稳定排序的交易记录
+    if hasattr(trades, 'to_pandas'):
+        trades = trades.to_pandas()
+    df = loader.conform(trades, loader.HISTORY_SCHEMA)
+    return df.sort_values("交易时间", kind="stable")
+
+
+def compute(trades, methods=None, lot_selection=None, fx=None):
+    # 库接口：不读写任何文件，在内存中计算一个组合
+    # trades 为与历史记录列相同的 DataFrame 或 Arrow 表，fx 为 FxIndex 时追加汇率和折算利润
+    # 返回 (配对明细, 年度汇总)，两者都带方式和年份列，年度汇总与利润文件末尾的汇总行相同
+    methods = methods or sorted(engine.METHODS)
+    trades = engine.TradeColumns(to_frame(trades))
+    if fx:
+        trades.fx_rate = fx.lookup(trades.currency, trades.time_ns)
+    selection = engine.load_lot_selection(lot_selection, trades) if lot_selection else None
+    books = [engine.new_book(method, len(trades.symbols), selection) for method in methods]
+    sinks = [RecordSink() for _ in methods]
+    steps = [engine.METHODS[method] for method in methods]
+    engine.match_rows(trades, steps, books, 0, len(trades), sinks)
+    records = pd.concat([records_frame(trades, method, sink) for method, sink in zip(methods, sinks)],
+                        ignore_index=True)
+    return records, summarize(records)
+
+
+def records_frame(trades, method, sink):
+    rows = np.array(sink.rows, dtype=np.intp)
+    reason, sell_price, cost, qty, earn = zip(*sink.records) if sink.records else ([],)*5
+    df = pd.DataFrame({
+        "方式":method,
+        "年份":trades.year[rows],
+        "配对原因":reason,
+        "股票代码":np.array(trades.symbols, dtype=object)[trades.codes[rows]] if len(rows) else [],
+        "卖出价格":np.array(sell_price, dtype=np.float64),
+        "成本价":np.array(cost, dtype=np.float64),
+        "数量":np.array(qty, dtype=np.float64),
+        "利润":np.array(earn, dtype=np.float64),
+        "时间":trades.time_ns[rows].view('datetime64[ns]'),
+        "结算币种":trades.currency[rows],
+    }, columns=RECORD_COLUMNS)
+    if trades.fx_rate is not None:
+        df["汇率"] = trades.fx_rate[rows]
+        df["折算利润"] = df["利润"]*df["汇率"]
+    return df
+
+
+def summarize(records):
+    # 按方式、年份、币种汇总，与 ProfitWriter 相同：精确求和，缺失的利润不计入，币种缺失的配对不参与汇总
+    converted = "折算利润" in records
+    rows = []
+    records = records[records["结算币种"].notna()]
+    for (method, year, currency), group in records.groupby(["方式", "年份", "结算币种"], sort=True, observed=True):
+        earn = group["利润"].to_numpy()
+        known = earn == earn
+        positive = earn > 0
+        for tax_method, mask in (("按年度计算", known), ("按单次计算", positive)):
+            row = [method, year, currency, tax_method, math.fsum(earn[mask].tolist()), group["时间"].iloc[-1]]
+            if converted:
+                values = group["折算利润"].to_numpy()[mask]
+                row.append(math.fsum(values[values == values].tolist()))
+            rows.append(row)
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS+(["折算利润"] if converted else []))
+
+
+def _compute_item(item):
+    # 工作进程中计算一个组合，trades 为路径时在工作进程中读取；出错时返回错误信息，不影响其他组合
+    name, trades, methods = item
+    try:
+        if isinstance(trades, str):
+            trades = read_portfolio(trades)
+        return name, compute(trades, methods), None
+    except Exception as e:
+        return name, None, f"{type(e).__name__}: {e}"
+
+
+def compute_many(portfolios, methods=None, workers=4):
+    # 批量计算互不相关的组合：portfolios 为 {名称: 交易表或文件路径}
+    # 在进程池中并行计算，逐个产生 (名称, (配对明细, 年度汇总) 或 None, 错误信息或 None)，顺序与输入相同
+    items = [(name, trades, methods) for name, trades in portfolios.items()]
+    if workers <= 1:
+        yield from map(_compute_item, items)
+        return
+    # 小组合很多时按批分发，减少进程间往返
+    chunksize = max(1, len(items)//(workers*4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_compute_item, items, chunksize=chunksize)
+
+
+def read_portfolio(path):
+    # 单个组合的交易文件：csv 或 parquet
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return loader.read_table(path, loader.HISTORY_SCHEMA)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='批量计算目录下的多个组合，每个 csv/parquet 文件为一个组合')
+    parser.add_argument('directory')
+    parser.add_argument('methods', nargs='*', type=int)
+    parser.add_argument('--workers', type=int, default=4, help='并行计算的进程数')
+    parser.add_argument('--out', default='portfolio_summary.csv', help='各组合年度汇总合并后写出的 csv')
+    profiler.add_arguments(parser)
+    args = parser.parse_intermixed_args()
+    profiler.start(args)
+    paths = sorted(glob(os.path.join(args.directory, '*.csv'))+glob(os.path.join(args.directory, '*.parquet')))
+    portfolios = {os.path.splitext(os.path.basename(path))[0]:path for path in paths}
+    summaries = []
+    with PROFILER.stage("portfolios", len(portfolios)):
+        for name, result, error in compute_many(portfolios, args.methods, args.workers):
+            if error:
+                print(f"{name} 计算失败: {error}")
+                continue
+            summaries.append(result[1].assign(组合=name))
+    if summaries:
+        summary = pd.concat(summaries, ignore_index=True)
+        summary[["组合"]+list(summary.columns[:-1])].to_csv(args.out, index=False, encoding='utf-8-sig')
+        print(f"{len(summaries)} 个组合的年度汇总已写入 {args.out}")
@@ -0,0 +1,163 @@
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，不记录内存
+    resource = None
+
+PROFILE_DIR = os.path.join('data', 'profile')
+
+
+def peak_rss_mb(who=None):
+    # 进程（或已结束的子进程）到目前为止的最大常驻内存，Linux 单位为 KB，macOS 为字节
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return round(usage/(1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+class Profiler:
+    # 按名称累计各阶段的耗时、行数和结束时的内存高水位，以及接口调用次数、耗时和限速等待时间
+    # 未启用时 stage/api/profile 只是空的上下文，不影响正常运行
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.cprofile = None
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def enable(self, path, cprofile=False):
+        self.enabled = True
+        self.path = path
+        self.started = time.perf_counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        # 同名阶段（如逐年的配对）多次进入时累加；rows 也可以在块内通过 info["rows"] 设置
+        info = {"rows":rows}
+        if not self.enabled:
+            yield info
+            return
+        started = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter()-started
+            with self.lock:
+                stage = self.stages.setdefault(name, {"calls":0, "seconds":0.0, "rows":None})
+                stage["calls"] += 1
+                stage["seconds"] += seconds
+                if info["rows"] is not None:
+                    stage["rows"] = (stage["rows"] or 0)+int(info["rows"])
+                stage["peak_rss_mb"] = peak_rss_mb()
+
+    @contextmanager
+    def api(self, name, waited=0.0):
+        # 一次接口调用：waited 为调用前在限速器中等待的秒数
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter()-started
+            with self.lock:
+                call = self.calls.setdefault(name, {"calls":0, "seconds":0.0, "wait_seconds":0.0})
+                call["calls"] += 1
+                call["seconds"] += seconds
+                call["wait_seconds"] += waited
+
+    @contextmanager
+    def profile(self):
+        # 启用 cProfile 时只采样块内的代码（配对循环）
+        if self.cprofile is None:
+            yield
+            return
+        self.cprofile.enable()
+        try:
+            yield
+        finally:
+            self.cprofile.disable()
+
+    def profile_path(self, suffix=''):
+        return os.path.splitext(self.path)[0]+'.prof'+suffix
+
+    def dump_part(self, part):
+        # 分片子进程写出自己的 cProfile 结果，由主进程在 save 时合并
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(self.profile_path(f'.part{part}'))
+
+    def report(self):
+        wall = time.perf_counter()-self.started
+        stages = {}
+        for name, stage in self.stages.items():
+            stage = dict(stage, seconds=round(stage["seconds"], 6))
+            if stage["rows"] is not None:
+                stage["rows_per_sec"] = round(stage["rows"]/stage["seconds"], 1) if stage["seconds"] else None
+            stages[name] = stage
+        return {
+            "script":os.path.basename(sys.argv[0]),
+            "argv":sys.argv[1:],
+            "finished":datetime.now().isoformat(timespec='seconds'),
+            "wall_seconds":round(wall, 6),
+            "peak_rss_mb":peak_rss_mb(),
+            "children_peak_rss_mb":peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            "stages":stages,
+            "api_calls":{name:dict(call, seconds=round(call["seconds"], 6), wait_seconds=round(call["wait_seconds"], 6))
+                         for name, call in self.calls.items()},
+        }
+
+    def save(self):
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path+'.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        os.replace(self.path+'.tmp', self.path)
+        print(f"性能报告已写入 {self.path}")
+        if self.cprofile is not None:
+            directory, name = os.path.split(self.profile_path())
+            parts = [os.path.join(directory or '.', x) for x in sorted(os.listdir(directory or '.'))
+                     if x.startswith(name+'.part')]
+            # 分片运行时主进程本身没有采样
+            self.cprofile.create_stats()
+            sources = ([self.cprofile] if self.cprofile.stats else [])+parts
+            if not sources:
+                return
+            pstats.Stats(*sources).dump_stats(self.profile_path())
+            for part in parts:
+                os.remove(part)
+            print(f"配对循环的 cProfile 结果已写入 {self.profile_path()}，可用 python -m pstats 查看")
+
+
+PROFILER = Profiler()
+
+
+def add_arguments(parser):
+    parser.add_argument('--profile', nargs='?', const='', metavar='PATH',
+                        help=f'记录各阶段耗时、行数、内存和接口调用，写出 JSON 报告（默认 {PROFILE_DIR}/<脚本名>.json）')
+    parser.add_argument('--cprofile', action='store_true', help='与 --profile 一起使用，另写出配对循环的 cProfile 结果')
+
+
+def start(args):
+    # 按命令行参数启用，进程退出时写出报告；返回是否启用
+    if args.profile is None:
+        return False
+    name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    PROFILER.enable(args.profile or os.path.join(PROFILE_DIR, f'{name}.json'), args.cprofile)
+    atexit.register(PROFILER.save)
+    return True
@@ -1,41 +1,99 @@
-import os
-import re
+import argparse
 import pandas as pd
-from glob import glob
-
-# 匹配文件名的正则
-pattern = re.compile(r'(\w+)_(method\d+)_profit_(\d{4})\\.csv')
-
-# 汇总结果列表
-results = []
-
-# 遍历data目录下所有csv文件
-for file in glob('data/*_method*_profit_*.csv'):
-    
-    filename = os.path.basename(file)
-    platform, method, _,year = filename.split(".")[0].split("_")
-    df = pd.read_csv(file)
-    # 只保留配对原因为年度汇总的条目
-    df = df[df['配对原因'] == '年度汇总']
-    for _, row in df.iterrows():
-        results.append({
-            '平台': platform,
-            '方式': method,
-            '年份': year,
-            '币种': row['结算币种'],
-            '股票代码': row['股票代码'],
-            '利润': row['利润'],
-        })
-
-# 转为DataFrame
-summary_df = pd.DataFrame(results)
-# 获取所有方式
-methods = summary_df['方式'].unique()
-tax_methods= summary_df['股票代码'].unique()
-
-for method in methods:
-    for tax_method in tax_methods:
-        print(f'\n方式: {method},计税方式：{tax_method}')
-        sub_df = summary_df[(summary_df['方式'] == method) & (summary_df['股票代码'] == tax_method)]
-        grouped = sub_df.groupby(['年份', '币种']).agg({'利润': 'sum'}).reset_index()
-        print(grouped) 
\ No newline at end of file
+import ledger
+import profiler
+from profiler import PROFILER
+
+# 下钻的维度 -> 明细表的列
+DIMENSIONS = {
+    "platform":"平台",
+    "method":"方式",
+    "year":"年份",
+    "month":"月份",
+    "currency":"结算币种",
+    "symbol":"股票代码",
+    "reason":"配对原因",
+}
+
+
+# 折算利润之和，有一条缺少折算利润时为空
+CONVERTED = "CASE WHEN COUNT(折算利润) = COUNT(利润) THEN TOTAL(折算利润) END"
+
+
+def where(filters):
+    # {列: 值} -> (WHERE 子句, 参数)，值为 None 的条件忽略
+    filters = {column:value for column, value in filters.items() if value is not None}
+    if not filters:
+        return "", []
+    return " WHERE "+" AND ".join(f"{column}=?" for column in filters), list(filters.values())
+
+
+def yearly(conn, filters):
+    # 各方式、计税方式下按年份和币种汇总利润文件的年度汇总行
+    clause, params = where(filters)
+    methods = [row[0] for row in conn.execute(f"SELECT DISTINCT 方式 FROM 汇总{clause} ORDER BY 方式", params)]
+    for method in methods:
+        method_clause, method_params = where(dict(filters, 方式=method))
+        tax_methods = [row[0] for row in conn.execute(
+            f"SELECT 计税方式 FROM 汇总{method_clause} GROUP BY 计税方式 ORDER BY MIN(rowid)", method_params)]
+        for tax_method in tax_methods:
+            print(f'\n方式: method{method},计税方式：{tax_method}')
+            sub_clause, sub_params = where(dict(filters, 方式=method, 计税方式=tax_method))
+            converted = conn.execute(f"SELECT COUNT(折算利润) FROM 汇总{sub_clause}", sub_params).fetchone()[0]
+            if converted:
+                # 各币种折算后的利润可以相加，另列出每年的合计
+                # 汇总行的折算利润留空表示该币种当年有利润缺少汇率，这一年不合计，标为折算不完整
+                print(pd.read_sql_query(f"SELECT 年份, 结算币种 AS 币种, TOTAL(利润) AS 利润, {CONVERTED} AS 折算利润 "
+                                        f"FROM 汇总{sub_clause} GROUP BY 年份, 币种 ORDER BY 年份, 币种", conn, params=sub_params))
+                print(pd.read_sql_query(f"SELECT 年份, {CONVERTED} AS 折算利润, "
+                                        f"CASE WHEN COUNT(折算利润) < COUNT(*) THEN '折算不完整' ELSE '' END AS 说明 "
+                                        f"FROM 汇总{sub_clause} GROUP BY 年份 ORDER BY 年份", conn, params=sub_params))
+            else:
+                print(pd.read_sql_query(f"SELECT 年份, 结算币种 AS 币种, TOTAL(利润) AS 利润 FROM 汇总{sub_clause} "
+                                        f"GROUP BY 年份, 币种 ORDER BY 年份, 币种", conn, params=sub_params))
+
+
+def drill(conn, by, filters):
+    # 在配对明细上按 by 的各维度分组：配对数、全部利润之和（按年度计算）、正利润之和（按单次计算），有折算利润时另加其和，有利润缺少汇率时留空
+    # 不同方式是同一批交易的不同算法，利润不能相加，未指定方式时总是按方式分组
+    if filters.get("方式") is None and "method" not in by:
+        by = ["method"]+list(by)
+    columns = [DIMENSIONS[name] for name in by]
+    clause, params = where(filters)
+    group = ", ".join(columns)
+    converted = conn.execute(f"SELECT COUNT(折算利润) FROM 明细{clause}", params).fetchone()[0]
+    return pd.read_sql_query(
+        f"SELECT {group}, COUNT(*) AS 配对数, TOTAL(利润) AS 按年度计算, "
+        f"TOTAL(CASE WHEN 利润 > 0 THEN 利润 END) AS 按单次计算{f', {CONVERTED} AS 折算利润' if converted else ''} "
+        f"FROM 明细{clause} GROUP BY {group} ORDER BY {group}", conn, params=params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='查询本地账本：默认按平台、方式、年份和币种汇总利润文件的年度汇总行，'
+                                                 '加筛选条件或 --by 时在配对明细上下钻')
+    parser.add_argument('--platform', help='只看该平台')
+    parser.add_argument('--method', type=int, help='只看该配对方式')
+    parser.add_argument('--year', type=int, help='只看该年')
+    parser.add_argument('--month', type=int, help='只看该月（明细）')
+    parser.add_argument('--currency', help='只看该币种')
+    parser.add_argument('--symbol', help='只看该股票（明细）')
+    parser.add_argument('--by', nargs='+', choices=list(DIMENSIONS), help='下钻的维度，如 --by symbol 或 --by year month')
+    parser.add_argument('--sql', help='直接在账本上执行的查询，表为 明细、汇总')
+    parser.add_argument('--ledger', default=ledger.LEDGER_PATH, help='账本路径')
+    profiler.add_arguments(parser)
+    args = parser.parse_args()
+    profiler.start(args)
+
+    conn = ledger.connect(args.ledger)
+    # 先载入有变化的利润文件，未经计税脚本写入账本的利润文件也能查询到
+    ledger.sync(conn)
+    filters = {"平台":args.platform, "方式":args.method, "年份":args.year, "结算币种":args.currency}
+    with PROFILER.stage("query"), pd.option_context('display.max_rows', None, 'display.width', None):
+        if args.sql:
+            print(pd.read_sql_query(args.sql, conn))
+        elif args.by or args.symbol or args.month:
+            filters.update({"股票代码":args.symbol, "月份":args.month})
+            print(drill(conn, args.by or ["year", "currency"], filters))
+        else:
+            yearly(conn, filters)
+    conn.close()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import loader
+from profiler import PROFILER
+
+HISTORY_COLUMNS = list(loader.HISTORY_SCHEMA)
+# 列式存储中按类别编码的列
+CATEGORY_COLUMNS = [column for column, kind in loader.HISTORY_SCHEMA.items() if kind == "category"]
+HISTORY_DIR = os.path.join('data', 'history')
+
+
+def row_hashes(df):
+    # 每行交易一个64位哈希，用于判断某年的历史是否被改动过
+    # 先统一为 schema 的类型，类别列再按原值哈希，CSV 与列式存储读出的同一份数据哈希相同
+    df = loader.conform(df, loader.HISTORY_SCHEMA)
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].astype(object)
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def year_manifest(df):
+    # 已按时间排序的交易 -> [(年份, 行数, 该年所有行的哈希摘要)]
+    with PROFILER.stage("hash", len(df)):
+        hashes = row_hashes(df)
+    years = df['交易时间'].dt.year.to_numpy()
+    bounds = np.flatnonzero(years[1:] != years[:-1])+1
+    starts = [0]+bounds.tolist()
+    ends = bounds.tolist()+[len(years)]
+    return [(int(years[start]), end-start, hashlib.sha256(hashes[start:end].tobytes()).hexdigest())
+            for start, end in zip(starts, ends) if end > start]
+
+
+def load_history(platform):
+    return loader.load_history(f'data/{platform}_history.csv')
+
+
+class CsvHistory:
+    # data/{platform}_history.csv，只能整体读取
+    def __init__(self, platform):
+        self.df = load_history(platform)
+        self.manifest = year_manifest(self.df)
+
+    def years(self):
+        return self.manifest
+
+    def load(self, years):
+        if len(years) == len(self.manifest):
+            return self.df
+        return self.df[self.df['交易时间'].dt.year.isin(years)]
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("列式存储需要安装 pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def dataset_dir(platform):
+    return os.path.join(HISTORY_DIR, platform)
+
+
+def manifest_path(platform):
+    return os.path.join(dataset_dir(platform), 'manifest.json')
+
+
+def write_history(df, platform):
+    # 把标准格式的交易记录按年份写成 Parquet 分区 data/history/{platform}/{year}.parquet
+    # manifest.json 记录每个分区的行数和哈希，最后写入，读取方据此判断数据是否完整
+    require_pyarrow()
+    df = loader.conform(df, loader.HISTORY_SCHEMA)
+    loader.check_times(df, '交易时间', platform)
+    df = df.sort_values('交易时间', kind='stable', ignore_index=True)
+    directory = dataset_dir(platform)
+    os.makedirs(directory, exist_ok=True)
+    manifest = year_manifest(df)
+    years = df['交易时间'].dt.year.to_numpy()
+    for year, _, _ in manifest:
+        path = os.path.join(directory, f'{year}.parquet')
+        part = df[years == year].reset_index(drop=True)
+        for column in CATEGORY_COLUMNS:
+            part[column] = part[column].cat.remove_unused_categories()
+        part.to_parquet(path+'.tmp', index=False)
+        os.replace(path+'.tmp', path)
+    # 删除已经不存在的年份
+    for name in os.listdir(directory):
+        if name.endswith('.parquet') and int(name.split('.')[0]) not in {year for year, _, _ in manifest}:
+            os.remove(os.path.join(directory, name))
+    with open(manifest_path(platform)+'.tmp', 'w', encoding='utf-8') as f:
+        json.dump([{"year":year, "rows":rows, "digest":digest} for year, rows, digest in manifest], f, indent=2)
+    os.replace(manifest_path(platform)+'.tmp', manifest_path(platform))
+
+
+class ParquetHistory:
+    # 按年份分区的列式存储，只读取需要的年份
+    def __init__(self, platform):
+        require_pyarrow()
+        self.platform = platform
+        with open(manifest_path(platform), encoding='utf-8') as f:
+            self.manifest = [(item['year'], item['rows'], item['digest']) for item in json.load(f)]
+
+    def years(self):
+        return self.manifest
+
+    def load(self, years):
+        with PROFILER.stage("read_parquet") as info:
+            parts = [pd.read_parquet(os.path.join(dataset_dir(self.platform), f'{year}.parquet')) for year in years]
+            info["rows"] = sum(len(part) for part in parts)
+        if not parts:
+            return loader.conform(pd.DataFrame(columns=HISTORY_COLUMNS), loader.HISTORY_SCHEMA)
+        # 各分区类别不同，合并后重新编码为类别；旧分区的数量可能是整数，一并转换为 schema 的类型
+        return loader.conform(pd.concat(parts, ignore_index=True), loader.HISTORY_SCHEMA)
+
+
+def open_history(platform):
+    # 列式存储存在且不比 CSV 旧时优先使用，否则读取 CSV
+    csv_path = f'data/{platform}_history.csv'
+    if os.path.exists(manifest_path(platform)):
+        if not os.path.exists(csv_path) or os.path.getmtime(manifest_path(platform)) >= os.path.getmtime(csv_path):
+            return ParquetHistory(platform)
+        print(f"{csv_path} 比列式存储新，改为读取 CSV")
+    return CsvHistory(platform)
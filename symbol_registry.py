@@ -0,0 +1,126 @@
+import re
+from datetime import date
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# 期权代码：标的 + 到期日YYMMDD + C/P + 行权价×1000，如 AAPL250117C150000
+OPTION_PATTERN = re.compile(r'([A-Z]+)(\d{6})([CP])(\d+)$')
+MARKETS = {"US", "HK", "SH", "SZ", "SG"}
+# 每张期权对应的股数；港股期权每张股数因标的而异，未列出的市场按1处理
+OPTION_MULTIPLIERS = {"US": 100}
+STOCK = "stock"
+OPTION = "option"
+# 解析规则变化时修改，使依赖解析结果的年末快照失效
+RULES_VERSION = b"symbols-2"
+
+
+@lru_cache(maxsize=None)
+def parse(symbol):
+    # 解析单个代码，每个不同的代码只解析一次
+    # 长桥为 AAPL.US，富途为 US.AAPL，两种写法得到相同的标的和市场
+    # 按位置判断写法：只有一侧是市场代码时以该侧为市场
+    # 两侧都是时（如 US.SG、SG.US）：港股和A股代码为数字，以 US 一侧为市场；都不是 US 时按长桥写法
+    symbol = str(symbol)
+    prefix, _, rest = symbol.partition('.')
+    head, _, suffix = symbol.rpartition('.')
+    futu = prefix in MARKETS and rest not in MARKETS
+    longbridge = suffix in MARKETS and head not in MARKETS
+    if not futu and not longbridge and prefix in MARKETS and suffix in MARKETS:
+        futu = prefix == "US" and suffix != "US"
+        longbridge = not futu
+    if futu:
+        market, code = prefix, rest
+    elif longbridge:
+        market, code = suffix, head
+    else:
+        market, code = "", symbol
+    info = {
+        "asset_class":STOCK,
+        "underlying":code,
+        "expiry":None,
+        "right":None,
+        "strike":np.nan,
+        "multiplier":1,
+        "market":market,
+    }
+    match = OPTION_PATTERN.match(code)
+    if match:
+        underlying, expiry, right, strike = match.groups()
+        try:
+            expiry = date(2000+int(expiry[:2]), int(expiry[2:4]), int(expiry[4:]))
+        except ValueError:
+            # 不是合法的到期日，按股票处理
+            return info
+        info.update({
+            "asset_class":OPTION,
+            "underlying":underlying,
+            "expiry":expiry,
+            "right":right,
+            "strike":int(strike)/1000,
+            "multiplier":OPTION_MULTIPLIERS.get(market, 1),
+        })
+    return info
+
+
+class SymbolRegistry:
+    # 代码 -> 整数编号，按编号保存解析结果的各列，引擎按编号向量化查表
+    # 编号只增不减，已有编号表（如快照中的）在前，新出现的代码依次追加
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.index = {}
+        self.columns = {"asset_class":[], "underlying":[], "expiry":[], "right":[],
+                        "strike":[], "multiplier":[], "market":[]}
+        for symbol in symbols:
+            self.add(symbol)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def add(self, symbol):
+        symbol = str(symbol)
+        k = self.index.get(symbol)
+        if k is None:
+            k = self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            for key, value in parse(symbol).items():
+                self.columns[key].append(value)
+        return k
+
+    def encode(self, values):
+        # 一列代码 -> 编号数组，只对不同的代码查表
+        codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+        ids = np.array([self.add(s) for s in uniques], dtype=np.intp)
+        return ids[codes]
+
+    def lookup(self, symbols):
+        # 另一张代码表 -> 本表编号
+        return np.array([self.index[str(s)] for s in symbols], dtype=np.intp)
+
+    @property
+    def is_option(self):
+        return np.array([c == OPTION for c in self.columns["asset_class"]], dtype=bool)
+
+    @property
+    def multiplier(self):
+        return np.array(self.columns["multiplier"], dtype=np.float64)
+
+    def table(self):
+        # 以编号为索引的查找表，可直接与按编号的交易列 join
+        df = pd.DataFrame(self.columns)
+        df.insert(0, "symbol", self.symbols)
+        df.index.name = "symbol_id"
+        for column in ("asset_class", "market", "right"):
+            df[column] = df[column].astype("category")
+        return df
+
+
+def describe(values):
+    # 按市场和资产类别统计代码和成交条数，下载和导出后打印，便于发现无法识别的代码
+    registry = SymbolRegistry()
+    ids = registry.encode(values)
+    table = registry.table()
+    counts = pd.DataFrame({"market":table["market"].to_numpy()[ids], "asset_class":table["asset_class"].to_numpy()[ids]})
+    summary = counts.value_counts().rename("成交条数").to_frame()
+    summary["代码数"] = table.groupby(["market", "asset_class"], observed=True).size()
+    return summary.sort_index()
@@ -0,0 +1,86 @@
+import os
+import sys
+from glob import glob
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'longbridge'))
+
+# 少量股票、密集成交，持仓会反复穿过零点；含港股和一个美股期权（缺失成交价的也有）
+SYMBOLS = [("AAA.US", "USD"), ("BBB.US", "USD"), ("CCC.US", "USD"), ("00700.HK", "HKD"), ("09988.HK", "HKD"),
+           ("AAA250117C150000.US", "USD")]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # 各脚本读写当前目录下的 data/，每个测试在独立的临时目录中运行
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    return tmp_path
+
+
+def make_history(rows=1500, seed=0, start="2022-01-01", days=3*365, symbols=SYMBOLS):
+    # 标准格式的交易记录，按时间排列，每笔成交的时间各不相同
+    rng = np.random.default_rng(seed)
+    code = rng.integers(0, len(symbols), rows)
+    buy = rng.random(rows) < rng.uniform(0.4, 0.6, len(symbols))[code]
+    price = np.round(rng.lognormal(3.5, 0.5, rows), 2)
+    option = np.array([name.endswith("C150000.US") for name, _ in symbols])[code]
+    price[option & (rng.random(rows) < 0.1)] = np.nan
+    seconds = np.sort(rng.choice(days*86400, rows, replace=False))
+    return pd.DataFrame({
+        "股票代码":[symbols[k][0] for k in code],
+        "数量":rng.integers(1, 40, rows)*0.5,
+        "成交价格":price,
+        "买卖方向":np.where(buy, "OrderSide.Buy", "OrderSide.Sell"),
+        "结算币种":[symbols[k][1] for k in code],
+        "合计手续费":np.round(rng.uniform(0, 5, rows), 2),
+        "交易时间":(pd.Timestamp(start)+pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def write_history(df, platform="longbridge"):
+    path = os.path.join('data', f'{platform}_history.csv')
+    df.to_csv(path, index=False)
+    return path
+
+
+def outputs(platform="longbridge"):
+    # 利润文件名 -> 内容
+    result = {}
+    for path in sorted(glob(os.path.join('data', f'{platform}_method*_profit_*.csv'))):
+        with open(path, 'rb') as f:
+            result[os.path.basename(path)] = f.read()
+    return result
+
+
+def checkpoints(platform="longbridge"):
+    # 快照文件名 -> {数组名: 数组}
+    result = {}
+    for path in sorted(glob(os.path.join('data', 'checkpoints', f'{platform}_method*.npz'))):
+        with np.load(path) as data:
+            result[os.path.basename(path)] = {key:data[key] for key in data.files}
+    return result
+
+
+def clear_outputs():
+    for path in glob(os.path.join('data', '*_profit_*.csv'))+glob(os.path.join('data', 'checkpoints', '*')):
+        os.remove(path)
+
+
+def write_rates(path=os.path.join('data', 'fx_rates.csv'), gap=None):
+    # 2022-2024 每日的 USD、HKD 汇率；gap 为 (开始, 结束) 时该区间内没有 HKD 汇率
+    days = pd.date_range("2021-12-01", "2024-12-31")
+    rng = np.random.default_rng(1)
+    frames = []
+    for currency, base in (("USD", 7.0), ("HKD", 0.9)):
+        df = pd.DataFrame({"日期":days.strftime("%Y-%m-%d"), "币种":currency,
+                           "汇率":np.round(base+rng.normal(0, 0.01, len(days)).cumsum()*0.1, 4)})
+        if gap and currency == "HKD":
+            df = df[(df["日期"] < gap[0]) | (df["日期"] > gap[1])]
+        frames.append(df)
+    pd.concat(frames).to_csv(path, index=False)
+    return path
@@ -0,0 +1,111 @@
+import os
+import pandas as pd
+import pytest
+import corporate_actions
+import engine
+import loader
+from conftest import clear_outputs, make_history, outputs, write_history
+
+
+def write_actions(rows, path=corporate_actions.ACTIONS_PATH):
+    # rows: (股票代码, 生效日期, 比例, 新代码)
+    pd.DataFrame(rows, columns=["股票代码", "生效日期", "比例", "新代码"]).to_csv(path, index=False)
+    return path
+
+
+def adjust(actions, trades):
+    # 按公司行为表调整 (代码, 日期, 数量, 价格) 的成交，返回调整后的 (代码, 数量, 价格)
+    df = pd.DataFrame(trades, columns=["股票代码", "交易时间", "数量", "成交价格"])
+    df["交易时间"] = pd.to_datetime(df["交易时间"])
+    df = corporate_actions.CorporateActions(write_actions(actions)).adjust(df)
+    return [(s, q, p) for s, q, p in zip(df["股票代码"].astype(str), df["数量"], df["成交价格"])]
+
+
+def test_split_and_reverse_split(workdir):
+    got = adjust([("AAA.US", "2023-06-01", 2.0, None), ("BBB.US", "2023-06-01", 0.1, None)],
+                 [("AAA.US", "2023-05-31", 10, 100.0), ("AAA.US", "2023-06-01", 10, 50.0),
+                  ("BBB.US", "2023-01-01", 100, 1.0), ("BBB.US", "2023-07-01", 10, 10.0),
+                  ("CCC.US", "2023-01-01", 5, 7.0)])
+    # 生效日当天及之后的成交已是调整后的数量和价格
+    assert got == [("AAA.US", 20, 50.0), ("AAA.US", 10, 50.0), ("BBB.US", 10, 10.0), ("BBB.US", 10, 10.0),
+                   ("CCC.US", 5, 7.0)]
+
+
+def test_rename(workdir):
+    got = adjust([("AAA.US", "2023-06-01", None, "ZZZ.US")],
+                 [("AAA.US", "2023-05-31", 10, 100.0), ("ZZZ.US", "2023-06-01", 10, 100.0)])
+    assert got == [("ZZZ.US", 10, 100.0), ("ZZZ.US", 10, 100.0)]
+
+
+def test_chained_splits_and_renames(workdir):
+    got = adjust([("AAA.US", "2023-03-01", 2.0, None), ("AAA.US", "2023-06-01", None, "BBB.US"),
+                  ("BBB.US", "2023-09-01", 3.0, None), ("BBB.US", "2023-10-01", None, "CCC.US")],
+                 [("AAA.US", "2023-01-01", 1, 60.0), ("AAA.US", "2023-04-01", 1, 60.0),
+                  ("BBB.US", "2023-07-01", 1, 60.0), ("BBB.US", "2023-09-15", 1, 60.0),
+                  ("CCC.US", "2023-11-01", 1, 60.0)])
+    assert got == [("CCC.US", 6, 10.0), ("CCC.US", 3, 20.0), ("CCC.US", 3, 20.0), ("CCC.US", 1, 60.0),
+                   ("CCC.US", 1, 60.0)]
+
+
+def test_split_on_the_rename_day_applies_to_the_old_code(workdir):
+    # 改代码和拆股同一天生效，拆股在新代码下登记
+    got = adjust([("AAA.US", "2023-06-01", None, "ZZZ.US"), ("ZZZ.US", "2023-06-01", 4.0, None)],
+                 [("AAA.US", "2023-05-31", 1, 100.0), ("ZZZ.US", "2023-06-01", 4, 25.0)])
+    assert got == [("ZZZ.US", 4, 25.0), ("ZZZ.US", 4, 25.0)]
+
+
+def test_reused_code_after_a_rename(workdir):
+    # AAA 改名为 ZZZ 后，另一只股票使用 AAA 代码并拆股；拆股只作用于新的 AAA
+    got = adjust([("AAA.US", "2023-06-01", None, "ZZZ.US"), ("AAA.US", "2023-09-01", 2.0, None)],
+                 [("AAA.US", "2023-05-31", 10, 100.0), ("AAA.US", "2023-08-01", 10, 100.0),
+                  ("AAA.US", "2023-09-02", 10, 50.0)])
+    assert got == [("ZZZ.US", 10, 100.0), ("AAA.US", 20, 50.0), ("AAA.US", 10, 50.0)]
+
+
+def test_code_used_by_another_stock_before_the_rename(workdir):
+    # ZZZ 在 AAA 改入之前属于另一只股票，改入之后的拆股不作用于之前的 ZZZ
+    got = adjust([("AAA.US", "2023-06-01", None, "ZZZ.US"), ("ZZZ.US", "2023-09-01", 2.0, None)],
+                 [("ZZZ.US", "2022-01-01", 10, 100.0), ("AAA.US", "2023-05-31", 10, 100.0),
+                  ("ZZZ.US", "2023-07-01", 10, 100.0)])
+    assert got == [("ZZZ.US", 10, 100.0), ("ZZZ.US", 20, 50.0), ("ZZZ.US", 20, 50.0)]
+
+
+def test_same_day_swap(workdir):
+    got = adjust([("AAA.US", "2023-06-01", None, "BBB.US"), ("BBB.US", "2023-06-01", None, "AAA.US"),
+                  ("AAA.US", "2023-09-01", 2.0, None)],
+                 [("AAA.US", "2023-05-31", 10, 100.0), ("BBB.US", "2023-05-31", 10, 100.0),
+                  ("AAA.US", "2023-07-01", 10, 100.0)])
+    assert got == [("BBB.US", 10, 100.0), ("AAA.US", 20, 50.0), ("AAA.US", 20, 50.0)]
+
+
+def test_ratio_must_be_positive(workdir):
+    with pytest.raises(loader.SchemaError):
+        corporate_actions.CorporateActions(write_actions([("AAA.US", "2023-06-01", 0.0, None)]))
+
+
+def test_engine_matches_an_adjusted_history(workdir, capsys):
+    df = make_history()
+    write_history(df)
+    engine.run('longbridge', [1, 2, 3])
+    # 公司行为表出现后快照失效，从头计算；比例取2的幂，调整后的价格写成文本再读回时没有舍入误差
+    write_actions([("AAA.US", "2023-03-01", 2.0, None), ("AAA.US", "2023-06-01", None, "DDD.US"),
+                   ("DDD.US", "2023-09-01", 4.0, None), ("00700.HK", "2024-02-01", 0.5, None)])
+    engine.run('longbridge', [1, 2, 3])
+    assert "年末快照继续计算" not in capsys.readouterr().out
+    adjusted = outputs()
+
+    # 手工调整后的历史，不使用公司行为表，结果逐字节相同；每笔成交乘一次累计比例，与 adjust 相同
+    expected = df.copy()
+    day = expected["交易时间"].str[:10]
+    for symbol, start, end, ratio, target in (("AAA.US", "", "2023-03-01", 8.0, "DDD.US"),
+                                              ("AAA.US", "2023-03-01", "2023-06-01", 4.0, "DDD.US"),
+                                              ("00700.HK", "", "2024-02-01", 0.5, "00700.HK")):
+        rows = (df["股票代码"] == symbol) & (day >= start) & (day < end)
+        expected.loc[rows, "数量"] *= ratio
+        expected.loc[rows, "成交价格"] /= ratio
+        expected.loc[rows, "股票代码"] = target
+    clear_outputs()
+    os.remove(corporate_actions.ACTIONS_PATH)
+    write_history(expected)
+    engine.run('longbridge', [1, 2, 3])
+    assert outputs() == adjusted
@@ -0,0 +1,104 @@
+import threading
+from types import SimpleNamespace
+import pytest
+import fetcher
+
+
+class RateLimitError(Exception):
+    code = 429002
+
+
+class FakeTradeContext:
+    # 长桥 TradeContext 的替身：order_detail 按预设依次抛出异常，之后返回详情
+    def __init__(self, failures=None):
+        self.failures = {order_id:list(errors) for order_id, errors in (failures or {}).items()}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def order_detail(self, order_id):
+        with self.lock:
+            self.calls[order_id] = self.calls.get(order_id, 0)+1
+            errors = self.failures.get(order_id)
+            if errors:
+                raise errors.pop(0)
+        return SimpleNamespace(order_id=order_id, symbol=f"S{order_id}.US")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # 不真正睡眠，记下每次的时长；抖动取上限，退避时长可以精确比较
+    recorded = []
+    monkeypatch.setattr(fetcher.time, "sleep", recorded.append)
+    monkeypatch.setattr(fetcher.random, "uniform", lambda low, high: high)
+    return recorded
+
+
+def orders(n):
+    return [SimpleNamespace(order_id=str(k)) for k in range(n)]
+
+
+def fast_limiter(rate=400.0):
+    # 睡眠被替换后限速器只能空转等待，速率下限设高，避免测试变慢
+    return fetcher.AdaptiveTokenBucket(rate=rate, capacity=1000, min_rate=50.0, max_rate=1000.0)
+
+
+def test_retries_with_exponential_backoff(sleeps):
+    ctx = FakeTradeContext({"0":[RuntimeError("timeout")]*3})
+    got = {}
+    failed = fetcher.fetch_details(ctx, orders(1), lambda order, detail: got.update({order.order_id:detail}),
+                                   limiter=fast_limiter(), workers=1, retries=5, backoff=0.5)
+    assert failed == []
+    assert ctx.calls == {"0":4}
+    assert got["0"].symbol == "S0.US"
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_gives_up_after_the_last_retry(sleeps):
+    ctx = FakeTradeContext({"0":[RuntimeError("down")]*10})
+    got = []
+    failed = fetcher.fetch_details(ctx, orders(2), lambda order, detail: got.append(order.order_id),
+                                   limiter=fast_limiter(), workers=1, retries=3, backoff=0.25)
+    assert [order.order_id for order in failed] == ["0"]
+    assert got == ["1"]
+    assert ctx.calls["0"] == 4
+    assert sleeps == [0.25, 0.5, 1.0]
+
+
+def test_rate_limits_halve_the_shared_rate(sleeps):
+    limiter = fast_limiter(rate=400.0)
+    ctx = FakeTradeContext({"0":[RateLimitError("too many requests"), RateLimitError("too many requests")]})
+    failed = fetcher.fetch_details(ctx, orders(1), lambda order, detail: None, limiter=limiter, workers=1)
+    assert failed == []
+    # 两次限流各减半，成功一次后加一个步长
+    assert limiter.rate == pytest.approx(100.0+limiter.step)
+
+
+def test_other_errors_keep_the_rate(sleeps):
+    limiter = fast_limiter(rate=400.0)
+    ctx = FakeTradeContext({"0":[RuntimeError("timeout")]})
+    fetcher.fetch_details(ctx, orders(1), lambda order, detail: None, limiter=limiter, workers=1)
+    assert limiter.rate == pytest.approx(400.0+limiter.step)
+
+
+def test_concurrent_fetch_gets_every_order_once(sleeps):
+    failures = {str(k):[RateLimitError("limit")]*(k % 3) for k in range(60)}
+    ctx = FakeTradeContext(failures)
+    got = {}
+    lock = threading.Lock()
+
+    def on_detail(order, detail):
+        with lock:
+            assert order.order_id not in got
+            got[order.order_id] = detail
+
+    failed = fetcher.fetch_details(ctx, orders(60), on_detail, limiter=fast_limiter(), workers=8)
+    assert failed == []
+    assert sorted(got) == sorted(str(k) for k in range(60))
+    assert all(ctx.calls[str(k)] == k % 3+1 for k in range(60))
+
+
+def test_is_rate_limited():
+    assert fetcher.is_rate_limited(RateLimitError("x"))
+    assert fetcher.is_rate_limited(RuntimeError("request limit exceeded"))
+    assert fetcher.is_rate_limited(RuntimeError("HTTP 429"))
+    assert not fetcher.is_rate_limited(RuntimeError("connection reset"))
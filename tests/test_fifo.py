@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+import portfolio
+from conftest import make_history
+
+STOCKS = [("AAA.US", "USD"), ("BBB.US", "USD"), ("00700.HK", "HKD")]
+
+
+def naive_fifo(df, selection=None):
+    # 朴素的先进先出参考实现：每个股票一个批次列表 [带方向的数量, 价格, 剩余手续费, 开仓行号]
+    # 平仓时先取指定批次，再按开仓先后；手续费按数量比例分摊。返回 [(行号, 平仓数量, 利润)]
+    selection = selection or {}
+    lots = {}
+    records = []
+    for row, (symbol, qty, price, side, fee) in enumerate(zip(df["股票代码"], df["数量"], df["成交价格"],
+                                                            df["买卖方向"], df["合计手续费"])):
+        qty = qty if side == "OrderSide.Buy" else -qty
+        queue = lots.setdefault(symbol, [])
+        remaining = abs(qty)
+        if queue and (queue[0][0] > 0) != (qty > 0):
+            taken = []
+
+            def take(k, want):
+                lot = queue[k]
+                m = min(want, abs(lot[0]))
+                if m == abs(lot[0]):
+                    del queue[k]
+                    taken.append((m, lot[1], lot[2]))
+                else:
+                    fee_part = lot[2]*m/abs(lot[0])
+                    lot[0] -= np.sign(lot[0])*m
+                    lot[2] -= fee_part
+                    taken.append((m, lot[1], fee_part))
+                return m
+
+            for open_row, want in selection.get(row, ()):
+                for k, lot in enumerate(queue):
+                    if lot[3] == open_row:
+                        remaining -= take(k, min(remaining, want))
+                        break
+            while remaining > 0 and queue:
+                remaining -= take(0, remaining)
+            closed = sum(m for m, _, _ in taken)
+            lot_value = sum(m*p for m, p, _ in taken)
+            cost = sum(f for _, _, f in taken)+fee*closed/abs(qty)
+            earn = lot_value-cost-closed*price if qty > 0 else closed*price-cost-lot_value
+            records.append((row, closed, earn))
+        if remaining > 0:
+            queue.append([np.sign(qty)*remaining, price, fee*remaining/abs(qty), row])
+    return records
+
+
+def random_selection(df, seed, count=80):
+    # 随机挑选平仓交易，为其指定同一股票更早的一笔成交作为开仓批次（可能已平掉，此时按先进先出）
+    rng = np.random.default_rng(seed)
+    rows = []
+    for close_row in rng.choice(np.arange(50, len(df)), count, replace=False):
+        symbol = df["股票代码"].iloc[close_row]
+        earlier = np.flatnonzero((df["股票代码"].iloc[:close_row] == symbol).to_numpy())
+        open_row = int(rng.choice(earlier))
+        rows.append({"股票代码":symbol, "交易时间":df["交易时间"].iloc[close_row],
+                     "开仓时间":df["交易时间"].iloc[open_row], "数量":float(rng.integers(1, 30))*0.5,
+                     "close_row":int(close_row), "open_row":open_row})
+    table = pd.DataFrame(rows)
+    selection = {}
+    for close_row, open_row, qty in zip(table["close_row"], table["open_row"], table["数量"]):
+        selection.setdefault(close_row, []).append((open_row, qty))
+    return table.drop(columns=["close_row", "open_row"]), selection
+
+
+def compare(records, expected):
+    assert len(records) == len(expected)
+    assert np.allclose(records["数量"], [qty for _, qty, _ in expected], rtol=1e-12, atol=1e-9)
+    assert np.allclose(records["利润"], [earn for _, _, earn in expected], rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fifo_matches_naive_reference(seed):
+    df = make_history(rows=1200, seed=seed, symbols=STOCKS)
+    records, _ = portfolio.compute(df, [3])
+    compare(records, naive_fifo(df))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_lot_selection_matches_naive_reference(tmp_path, seed):
+    df = make_history(rows=1200, seed=seed, symbols=STOCKS)
+    table, selection = random_selection(df, seed)
+    path = tmp_path/"lots.csv"
+    table.to_csv(path, index=False)
+    records, _ = portfolio.compute(df, [3], lot_selection=str(path))
+    expected = naive_fifo(df, selection)
+    compare(records, expected)
+    # 指定批次确实改变了结果
+    assert not np.allclose(records["利润"], [earn for _, _, earn in naive_fifo(df)])
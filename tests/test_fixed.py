@@ -0,0 +1,87 @@
+import csv
+import pandas as pd
+import pytest
+import engine
+import fixed
+from conftest import clear_outputs, make_history, write_history
+
+METHODS = [1, 2, 3]
+
+
+def read_profits(method, year, platform='longbridge'):
+    # 利润文件 -> (明细行, 年度汇总行)
+    with open(engine.profit_path(platform, method, year), encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    return [row for row in rows if row[0] != "年度汇总"], [row for row in rows if row[0] == "年度汇总"]
+
+
+def cents(text):
+    # 定点模式输出的金额是最接近某个整数分的浮点数
+    value = round(float(text)*100)
+    assert float(text) == value/100
+    return value
+
+
+def trades(rows, start="2023-01-03 10:00:00"):
+    return pd.DataFrame({
+        "股票代码":"X.US",
+        "数量":[qty for qty, _, _ in rows],
+        "成交价格":[price for _, price, _ in rows],
+        "买卖方向":[side for _, _, side in rows],
+        "结算币种":"USD",
+        "合计手续费":0.0,
+        "交易时间":(pd.Timestamp(start)+pd.to_timedelta(range(len(rows)), unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def test_exact_profits_are_whole_cents_and_summaries_are_exact_sums(workdir):
+    write_history(make_history())
+    engine.run('longbridge', METHODS, fixed=fixed.FixedPoint())
+    for method in METHODS:
+        for year in (2022, 2023, 2024):
+            records, summary = read_profits(method, year)
+            assert records
+            for currency in {row[7] for row in records}:
+                earns = [cents(row[5]) for row in records if row[7] == currency]
+                totals = {row[1]:cents(row[5]) for row in summary if row[7] == currency}
+                assert totals == {"按年度计算":sum(earns), "按单次计算":sum(x for x in earns if x > 0)}
+
+
+def test_exact_mode_follows_float_mode(workdir):
+    write_history(make_history())
+    engine.run('longbridge', METHODS)
+    floating = {(method, year):read_profits(method, year)[0] for method in METHODS for year in (2022, 2023, 2024)}
+    clear_outputs()
+    engine.run('longbridge', METHODS, fixed=fixed.FixedPoint())
+    for (method, year), expected in floating.items():
+        records = read_profits(method, year)[0]
+        # 配对的顺序、股票、数量相同
+        assert [(row[0], row[1], float(row[4]), row[6]) for row in records] == \
+               [(row[0], row[1], float(row[4]), row[6]) for row in expected]
+        if method == 3:
+            # 先进先出法只在分摊手续费和折成金额时舍入到分，每笔利润相差不超过几分
+            for row, reference in zip(records, expected):
+                assert float(row[5]) == pytest.approx(float(reference[5]), abs=0.03)
+
+
+def test_exact_mode_has_no_binary_rounding_error(workdir):
+    # 十次 0.1 买入后均价为 0.1，两次卖出的利润为 0.1、0.2，合计正好 0.3
+    write_history(trades([(1, 0.1, "OrderSide.Buy")]*10+[(5, 0.12, "OrderSide.Sell"), (5, 0.14, "OrderSide.Sell")]))
+    engine.run('longbridge', [1, 3], fixed=fixed.FixedPoint())
+    for method in (1, 3):
+        records, summary = read_profits(method, 2023)
+        assert [(row[3], row[5]) for row in records] == [("0.1", "0.1"), ("0.1", "0.2")]
+        assert [row[5] for row in summary] == ["0.3", "0.3"]
+
+
+def test_switching_modes_does_not_resume_from_the_other_mode(workdir, capsys):
+    df = make_history()
+    write_history(df[df["交易时间"] < "2024"])
+    engine.run('longbridge', METHODS)
+    write_history(df)
+    engine.run('longbridge', METHODS, fixed=fixed.FixedPoint())
+    assert "年末快照继续计算" not in capsys.readouterr().out
+    profits = {(method, year):read_profits(method, year) for method in METHODS for year in (2022, 2023, 2024)}
+    clear_outputs()
+    engine.run('longbridge', METHODS, resume=False, fixed=fixed.FixedPoint())
+    assert profits == {(method, year):read_profits(method, year) for method in METHODS for year in (2022, 2023, 2024)}
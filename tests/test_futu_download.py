@@ -0,0 +1,172 @@
+import importlib.util
+import json
+import os
+import sys
+import threading
+import types
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+from conftest import ROOT
+
+
+def futu_sdk():
+    # 已安装富途 SDK 时直接使用；否则放入只含下载脚本用到的常量和类名的替身模块
+    # 仓库中的 futu/ 目录会被当作命名空间包导入，不能据此判断 SDK 是否存在
+    try:
+        import futu
+        if hasattr(futu, 'OpenSecTradeContext'):
+            return futu
+    except ImportError:
+        pass
+    futu = types.ModuleType('futu')
+    futu.RET_OK, futu.RET_ERROR = 0, -1
+    futu.OrderStatus = types.SimpleNamespace(FILLED_ALL='FILLED_ALL')
+    futu.TrdEnv = types.SimpleNamespace(REAL='REAL', SIMULATE='SIMULATE')
+    futu.TrdMarket = types.SimpleNamespace(NONE='N/A', US='US', HK='HK')
+    futu.OpenQuoteContext = futu.OpenSecTradeContext = None
+    sys.modules['futu'] = futu
+    return futu
+
+
+futu = futu_sdk()
+spec = importlib.util.spec_from_file_location('futu_download', os.path.join(ROOT, 'futu', 'download.py'))
+download = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(download)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class StubTradeContext:
+    # OpenSecTradeContext 的替身：按账户和时间窗口返回预设的订单，记录每次查询
+    # 时间窗口两端都包含，边界上的订单会在相邻两个窗口中重复返回，与 OpenD 相同
+    def __init__(self, orders, fail=()):
+        self.orders = orders
+        self.fail = set(fail)
+        self.windows = []
+        self.fee_batches = []
+        self.lock = threading.Lock()
+
+    def get_acc_list(self):
+        return futu.RET_OK, pd.DataFrame({"acc_id":[1, 2, 3], "trd_env":[futu.TrdEnv.REAL, futu.TrdEnv.REAL,
+                                                                          futu.TrdEnv.SIMULATE],
+                                          "uni_card_num":["a", "b", "c"]})
+
+    def history_order_list_query(self, acc_id, order_market, start, end, status_filter_list):
+        with self.lock:
+            self.windows.append((acc_id, start, end))
+        if acc_id in self.fail:
+            return futu.RET_ERROR, "disconnected"
+        df = self.orders
+        return futu.RET_OK, df[(df["acc_id"] == acc_id) & (df["create_time"].str[:19] >= start)
+                               & (df["create_time"].str[:19] <= end)].drop(columns="acc_id").reset_index(drop=True)
+
+    def order_fee_query(self, order_id_list, acc_id, trd_env):
+        with self.lock:
+            self.fee_batches.append((acc_id, list(order_id_list)))
+        return futu.RET_OK, pd.DataFrame({"order_id":order_id_list,
+                                          "fee_amount":[float(order_id.split("-")[1])/100 for order_id in order_id_list]})
+
+
+class NoWait:
+    def wait_if_needed(self):
+        return 0
+
+
+def make_orders(times, acc_id, start=0):
+    return pd.DataFrame({
+        "order_id":[f"{acc_id}-{start+k}" for k in range(len(times))],
+        "code":"US.AAPL",
+        "dealt_qty":1.0,
+        "dealt_avg_price":100.0,
+        "trd_side":"BUY",
+        "currency":"USD",
+        "create_time":[t.strftime(TIME_FORMAT)+".000" for t in times],
+        "acc_id":acc_id,
+    })
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(download, "RateLimiter", lambda *args, **kwargs: NoWait())
+
+
+def test_windows_page_through_the_range_and_fees_are_queried_once():
+    start, end = datetime(2022, 1, 1), datetime(2023, 1, 1)
+    # 每个窗口的起点都放一笔订单，边界上的订单会被相邻两个窗口返回
+    bounds = [s for s, _ in download.date_windows(start, end)]
+    times = sorted(bounds+[start+timedelta(days=k, hours=5) for k in range(0, 365, 3)])
+    ctx = StubTradeContext(make_orders(times, 1))
+    orders, fees, failed = download.download_orders(ctx, [1], [futu.TrdMarket.NONE], start, end, workers=3,
+                                                    batch_size=25)
+    windows = [(s, e) for _, s, e in sorted(ctx.windows)]
+    assert windows[0][0] == start.strftime(TIME_FORMAT) and windows[-1][1] == end.strftime(TIME_FORMAT)
+    assert all(a[1] == b[0] for a, b in zip(windows, windows[1:]))
+    assert len(windows) == 5
+    # 订单按窗口的提交顺序排列，合起来覆盖全部订单；边界上的订单只查询一次费用
+    returned = pd.concat(orders)["order_id"].tolist()
+    assert set(returned) == set(ctx.orders["order_id"])
+    assert len(returned) == len(ctx.orders)+len(bounds)-1
+    fee_ids = [order_id for _, batch in ctx.fee_batches for order_id in batch]
+    assert sorted(fee_ids) == sorted(ctx.orders["order_id"])
+    assert all(len(batch) <= 25 for _, batch in ctx.fee_batches)
+    assert len(pd.concat(fees)) == len(ctx.orders)
+    assert failed == set()
+
+
+def test_incremental_sync_starts_from_the_watermark(workdir, monkeypatch):
+    first = pd.concat([make_orders([datetime(2022, 3, 1)+timedelta(days=7*k) for k in range(30)], 1),
+                       make_orders([datetime(2022, 5, 1)+timedelta(days=11*k) for k in range(20)], 2)])
+    ctx = StubTradeContext(first)
+    download.get_history_orders(ctx, incremental=True)
+    with open(download.STATE_PATH, encoding='utf-8') as f:
+        state = json.load(f)
+    assert state == {"1":first[first["acc_id"] == 1]["create_time"].max(),
+                     "2":first[first["acc_id"] == 2]["create_time"].max()}
+    # 模拟账户 3 不查询
+    assert {acc_id for acc_id, _, _ in ctx.windows} == {1, 2}
+
+    later = make_orders([datetime(2023, 6, 1)+timedelta(days=k) for k in range(10)], 1, start=100)
+    ctx = StubTradeContext(pd.concat([first, later]))
+    download.get_history_orders(ctx, incremental=True)
+    # 每个账户从各自高水位的前一天开始查询，只为新订单查询费用
+    starts = {}
+    for acc_id, start, _ in ctx.windows:
+        starts[acc_id] = min(starts.get(acc_id, start), start)
+    for acc_id in (1, 2):
+        watermark = datetime.strptime(state[str(acc_id)][:19], TIME_FORMAT)
+        assert starts[acc_id] == (watermark-timedelta(days=1)).strftime(TIME_FORMAT)
+    assert sorted(order_id for _, batch in ctx.fee_batches for order_id in batch) == sorted(later["order_id"])
+    raw = download.load_store()
+    assert sorted(raw["order_id"]) == sorted(pd.concat([first, later])["order_id"])
+    assert raw["合计手续费"].notna().all()
+    with open(download.STATE_PATH, encoding='utf-8') as f:
+        assert json.load(f)["1"] == later["create_time"].max()
+
+
+def test_failed_account_keeps_its_watermark(workdir):
+    first = pd.concat([make_orders([datetime(2022, 3, 1)+timedelta(days=7*k) for k in range(5)], 1),
+                       make_orders([datetime(2022, 5, 1)+timedelta(days=7*k) for k in range(5)], 2)])
+    download.get_history_orders(StubTradeContext(first), incremental=True)
+    with open(download.STATE_PATH, encoding='utf-8') as f:
+        state = json.load(f)
+    later = pd.concat([make_orders([datetime(2023, 1, 1)], 1, start=50), make_orders([datetime(2023, 1, 2)], 2, start=50)])
+    download.get_history_orders(StubTradeContext(pd.concat([first, later]), fail={2}), incremental=True)
+    with open(download.STATE_PATH, encoding='utf-8') as f:
+        after = json.load(f)
+    # 账户 2 查询失败，高水位不动，下次重新查询
+    assert after["1"] == later["create_time"].iloc[0]
+    assert after["2"] == state["2"]
+
+
+def test_orders_missing_a_fee_are_queried_again(workdir):
+    orders = make_orders([datetime(2022, 3, 1)+timedelta(days=7*k) for k in range(5)], 1)
+    download.get_history_orders(StubTradeContext(orders), incremental=True)
+    raw = pd.read_csv(download.RAW_PATH, encoding='utf-8-sig')
+    raw.loc[raw["order_id"] == "1-2", "合计手续费"] = None
+    raw.to_csv(download.RAW_PATH, index=False, encoding='utf-8-sig')
+    ctx = StubTradeContext(orders)
+    download.get_history_orders(ctx, incremental=True)
+    assert [order_id for _, batch in ctx.fee_batches for order_id in batch] == ["1-2"]
+    raw = download.load_store()
+    assert raw.loc[raw["order_id"] == "1-2", "合计手续费"].item() == pytest.approx(0.02)
@@ -0,0 +1,91 @@
+import csv
+import pandas as pd
+import engine
+import live
+from conftest import make_history, write_history
+
+METHODS = [1, 2, 3]
+
+
+def batch_summary(year, platform='longbridge'):
+    # 利润文件末尾的年度汇总行 -> {方式: {币种: {计税方式: 利润}}}
+    result = {}
+    for method in METHODS:
+        with open(engine.profit_path(platform, method, year), encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f):
+                if row[0] == "年度汇总":
+                    result.setdefault(method, {}).setdefault(row[7], {})[row[1]] = float(row[5])
+    return result
+
+
+def test_fresh_replay_matches_batch_profit_files(workdir):
+    df = make_history()
+    path = write_history(df)
+    engine.run('longbridge', METHODS)
+    state = live.Live.load('longbridge', METHODS, fresh=True)
+    live.replay(state, path)
+    assert state.fills == len(df)
+    for year in (2022, 2023, 2024):
+        assert state.pnl(year)["pnl"] == batch_summary(year)
+
+
+def test_replay_after_checkpoint_matches_full_batch_run(workdir):
+    df = make_history()
+    earlier, later = df[df["交易时间"] < "2024"], df[df["交易时间"] >= "2024"]
+    write_history(earlier)
+    engine.run('longbridge', METHODS)
+    # 从 2023 年末的持仓开始，推送 2024 年的成交
+    state = live.Live.load('longbridge', METHODS)
+    later.to_csv('data/later.csv', index=False)
+    live.replay(state, 'data/later.csv')
+
+    write_history(df)
+    symbols, books = engine.run('longbridge', METHODS, resume=False)
+    assert state.pnl(2024)["pnl"] == batch_summary(2024)
+    # 已实现利润的起点来自账本中 2023 年的年度汇总
+    assert state.pnl(2023)["pnl"] == batch_summary(2023)
+    # 推送后的持仓与完整重算的年末持仓相同
+    for method, book in books.items():
+        held = {symbol:(float(book.quantity[i]), float(book.avg_cost[i]))
+                for i, symbol in enumerate(symbols) if book.quantity[i]}
+        assert {symbol:(p["数量"], p["均价"]) for symbol, p in state.positions()[method].items()} == held
+
+
+def test_partial_fills_and_repeated_pushes(workdir):
+    when = pd.Timestamp("2024-03-01 10:00:00")
+    # 推送给出累计值：先成交 4 股均价 95，再累计 10 股均价 98，相当于新增 6 股、价格 100
+    pushed = live.Live.load('longbridge', [1, 3], fresh=True)
+    pushed.on_order("a", "AAA.US", "OrderSide.Buy", 4, 95.0, 0.5, "USD", when)
+    pushed.on_order("a", "AAA.US", "OrderSide.Buy", 10, 98.0, 1.0, "USD", when)
+    pushed.on_order("a", "AAA.US", "OrderSide.Buy", 10, 98.0, 1.0, "USD", when)
+    pushed.on_order("b", "AAA.US", "OrderSide.Sell", 10, 120.0, 1.0, "USD", when)
+    pushed.on_order("b", "AAA.US", "OrderSide.Sell", 10, 120.0, 1.0, "USD", when)
+    # 重复推送没有新增成交
+    assert pushed.fills == 3
+
+    direct = live.Live.load('longbridge', [1, 3], fresh=True)
+    direct.apply("AAA.US", 4, 95.0, 0.5, "USD", when)
+    direct.apply("AAA.US", 6, 100.0, 0.5, "USD", when)
+    direct.apply("AAA.US", -10, 120.0, 1.0, "USD", when)
+    assert pushed.pnl()["pnl"] == direct.pnl()["pnl"]
+    assert pushed.positions() == direct.positions() == {1:{}, 3:{}}
+
+
+def test_saved_state_is_restored_until_the_history_changes(workdir, capsys):
+    df = make_history()
+    write_history(df[df["交易时间"] < "2024"])
+    engine.run('longbridge', METHODS)
+    state = live.Live.load('longbridge', METHODS, path='data/live.npz')
+    state.on_order("x", "AAA.US", "OrderSide.Buy", 5, 10.0, 0.0, "USD", df["交易时间"].astype("datetime64[ns]").iloc[-1])
+    state.save()
+    restored = live.Live.load('longbridge', METHODS, path='data/live.npz')
+    assert "恢复" in capsys.readouterr().out
+    assert restored.fills == state.fills and restored.positions() == state.positions()
+    assert restored.pnl() == state.pnl()
+
+    # 公司行为表变化后旧状态不再恢复
+    with open('data/corporate_actions.csv', 'w', encoding='utf-8') as f:
+        f.write("股票代码,生效日期,比例,新代码\nAAA.US,2023-06-01,2,\n")
+    reloaded = live.Live.load('longbridge', METHODS, path='data/live.npz')
+    assert "恢复" not in capsys.readouterr().out
+    assert reloaded.fills == 0
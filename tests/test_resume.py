@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import engine
+import storage
+from conftest import checkpoints, clear_outputs, make_history, outputs, write_history
+
+METHODS = [1, 2, 3]
+
+
+def assert_matches_full_run(methods=METHODS, **kwargs):
+    # 当前的利润文件和快照与删除后从头计算的结果逐字节、逐元素相同
+    files, states = outputs(), checkpoints()
+    clear_outputs()
+    engine.run('longbridge', methods, resume=False, **kwargs)
+    assert outputs() == files
+    expected = checkpoints()
+    assert states.keys() == expected.keys()
+    for name, arrays in expected.items():
+        assert states[name].keys() == arrays.keys()
+        for key, value in arrays.items():
+            np.testing.assert_array_equal(states[name][key], value)
+
+
+def test_resume_after_appending_a_year(workdir, capsys):
+    df = make_history()
+    write_history(df[df["交易时间"] < "2024"])
+    engine.run('longbridge', METHODS)
+    write_history(df)
+    engine.run('longbridge', METHODS)
+    assert "从 2023 年末快照继续计算" in capsys.readouterr().out
+    assert len(outputs()) == 9
+    assert_matches_full_run()
+
+
+def test_resume_after_appending_within_the_last_year(workdir, capsys):
+    df = make_history()
+    write_history(df.iloc[:len(df)-100])
+    engine.run('longbridge', METHODS)
+    write_history(df)
+    engine.run('longbridge', METHODS)
+    # 最后一年有新增，从前一年的快照继续
+    assert "从 2023 年末快照继续计算" in capsys.readouterr().out
+    assert_matches_full_run()
+
+
+def test_editing_an_earlier_year_invalidates_later_snapshots(workdir, capsys):
+    df = make_history()
+    write_history(df)
+    engine.run('longbridge', METHODS)
+    capsys.readouterr()
+    df.loc[10, "成交价格"] += 1
+    write_history(df)
+    engine.run('longbridge', METHODS)
+    # 2022 年被改动，之后各年的快照全部失效，从头计算
+    assert "年末快照继续计算" not in capsys.readouterr().out
+    assert_matches_full_run()
+
+
+def test_changing_the_lot_selection_invalidates_fifo_snapshots(workdir, capsys):
+    df = make_history()
+    write_history(df)
+    engine.run('longbridge', [3])
+    capsys.readouterr()
+    aaa = df.index[df["股票代码"] == "AAA.US"]
+    close = aaa[df["交易时间"][aaa] > "2024"][5]
+    with open('data/lots.csv', 'w', encoding='utf-8') as f:
+        f.write("股票代码,交易时间,开仓时间,数量\n")
+        f.write(f"AAA.US,{df['交易时间'][close]},{df['交易时间'][aaa[0]]},1\n")
+    engine.run('longbridge', [3], lot_selection='data/lots.csv')
+    assert "年末快照继续计算" not in capsys.readouterr().out
+    assert_matches_full_run([3], lot_selection='data/lots.csv')
+
+
+def test_resume_from_columnar_history(workdir, capsys):
+    pytest.importorskip("pyarrow")
+    df = make_history()
+    storage.write_history(df[df["交易时间"] < "2024"], 'longbridge')
+    engine.run('longbridge', METHODS)
+    storage.write_history(df, 'longbridge')
+    engine.run('longbridge', METHODS)
+    assert "从 2023 年末快照继续计算" in capsys.readouterr().out
+    assert_matches_full_run()
@@ -0,0 +1,46 @@
+import pytest
+import engine
+import fixed
+import fx
+from conftest import checkpoints, clear_outputs, make_history, outputs, write_history, write_rates
+from test_resume import assert_matches_full_run
+
+METHODS = [1, 2, 3]
+
+
+def sharded_matches_serial(workers, **kwargs):
+    # 分片并行的利润文件和快照与单进程运行逐字节、逐元素相同
+    engine.run('longbridge', METHODS, resume=False, workers=workers, **kwargs)
+    assert outputs()
+    assert_matches_full_run(**kwargs)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_sharded_matches_serial(workdir, workers):
+    write_history(make_history(rows=3000))
+    sharded_matches_serial(workers)
+
+
+def test_sharded_matches_serial_with_fx_and_missing_rates(workdir):
+    write_history(make_history(rows=3000))
+    rates = fx.FxIndex(write_rates(gap=("2023-03-01", "2023-04-30")))
+    sharded_matches_serial(3, fx=rates)
+    # 缺少汇率的币种当年的折算总和留空，与单进程相同
+    with open('data/longbridge_method1_profit_2023.csv', encoding='utf-8-sig') as f:
+        summary = [line.strip().split(',') for line in f if line.startswith("年度汇总")]
+    converted = {row[7]:row[9] for row in summary}
+    assert converted["HKD"] == "" and converted["USD"] != ""
+
+
+def test_sharded_matches_serial_in_exact_mode(workdir):
+    write_history(make_history(rows=3000))
+    sharded_matches_serial(3, fixed=fixed.FixedPoint())
+
+
+def test_sharded_resume_matches_serial(workdir):
+    df = make_history(rows=3000)
+    write_history(df[df["交易时间"] < "2024"])
+    engine.run('longbridge', METHODS, workers=3)
+    write_history(df)
+    engine.run('longbridge', METHODS, workers=3)
+    assert_matches_full_run()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import symbol_registry
+
+
+def market(symbol):
+    info = symbol_registry.parse(symbol)
+    return info["underlying"], info["market"]
+
+
+def test_both_spellings_agree():
+    assert market('US.AAPL') == market('AAPL.US') == ('AAPL', 'US')
+    assert market('HK.00700') == ('00700', 'HK')
+
+
+def test_ticker_that_is_a_market_code():
+    # 代码本身是市场代码时按位置判断，富途和长桥的写法结果相同
+    assert market('US.SG') == market('SG.US') == ('SG', 'US')
+    assert market('US.HK') == market('HK.US') == ('HK', 'US')
@@ -0,0 +1,118 @@
+import argparse
+import numpy as np
+import pandas as pd
+from functools import partial
+import engine
+import loader
+import profiler
+from profiler import PROFILER
+
+# 假设交易表中可以省略的列及其默认值
+DEFAULTS = {"合计手续费":0.0}
+RESULT_COLUMNS = ["情景", "行号", "股票代码", "方式", "配对原因", "卖出价格", "成本价", "数量", "利润"]
+
+
+class WhatIf:
+    # 在当前持仓上评估假设的交易，持仓本身不会被修改
+    # 每个情景只在第一次碰到某只股票时复制该股票的持仓（写时复制），情景结束后恢复
+    # 配对直接调用引擎的逐笔配对函数，结果与把这些交易追加到历史末尾后重新计算相同
+    def __init__(self, symbols, books):
+        self.symbols = list(symbols)
+        self.books = dict(books)
+
+    @classmethod
+    def load(cls, platform, methods=None, lot_selection=None):
+        # 从年末快照补算到最新的持仓，只需加载一次
+        symbols, books = engine.run(platform, methods or sorted(engine.METHODS), lot_selection)
+        return cls(symbols, books)
+
+    def _grow(self, size):
+        # 假设交易中新出现的股票追加空仓
+        for method, book in self.books.items():
+            if len(book.quantity) < size:
+                self.books[method] = engine.grow_book(method, book, size)
+
+    @staticmethod
+    def _snapshot(book, i):
+        lots = [lot[:] for lot in book.lots[i]] if isinstance(book, engine.LotBook) else None
+        return book.quantity[i], book.avg_cost[i], book.total_fee[i], lots
+
+    @staticmethod
+    def _restore(book, i, snapshot):
+        book.quantity[i], book.avg_cost[i], book.total_fee[i], lots = snapshot
+        if lots is not None:
+            book.lots[i].clear()
+            book.lots[i].extend(lots)
+
+    def evaluate(self, df):
+        # df 为假设的交易：股票代码、数量、成交价格、买卖方向（与历史记录相同），可选合计手续费（默认0）和情景
+        # 同一情景的交易按表中顺序依次作用在同一份持仓上；没有情景列时每笔交易各自是一个情景
+        # 返回每笔配对一行，行号为该交易在 df 中的位置
+        df = df.reset_index(drop=True).assign(**{k:v for k, v in DEFAULTS.items() if k not in df})
+        scenarios = df['情景'] if '情景' in df else pd.Series(np.arange(len(df)))
+        order = np.argsort(pd.factorize(scenarios)[0], kind='stable')
+        # 配对与币种、时间无关
+        trades = engine.TradeColumns(df.assign(结算币种=None, 交易时间=pd.NaT), self.symbols)
+        self.symbols = trades.symbols
+        self._grow(len(self.symbols))
+
+        books = list(self.books.values())
+        lanes = [(method, partial(engine.METHODS[method], *book.views())) for method, book in self.books.items()]
+        results = []
+        touched = {}
+        current = None
+        try:
+            for k, scenario, i, qty, price, fee in zip(order.tolist(), scenarios.iloc[order].tolist(),
+                                                       trades.codes[order].tolist(), trades.qty[order].tolist(),
+                                                       trades.price[order].tolist(), trades.fee[order].tolist()):
+                if scenario != current:
+                    self._restore_all(touched)
+                    current = scenario
+                if i not in touched:
+                    touched[i] = [self._snapshot(book, i) for book in books]
+                # 假设交易的行号为负数，不会与指定批次表或已有批次的开仓行号冲突
+                for method, step in lanes:
+                    record = step(-1-k, i, qty, price, fee)
+                    if record is not None:
+                        results.append((scenario, k, self.symbols[i], method, *record))
+        finally:
+            self._restore_all(touched)
+        return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+    def _restore_all(self, touched):
+        for i, snapshots in touched.items():
+            for book, snapshot in zip(self.books.values(), snapshots):
+                self._restore(book, i, snapshot)
+        touched.clear()
+
+    def sell(self, symbol, qty, price, fee=0.0):
+        # 单笔卖出在各方式下的已实现利润 {方式: 利润}
+        df = pd.DataFrame({"股票代码":[symbol], "数量":[qty], "成交价格":[price],
+                           "买卖方向":["OrderSide.Sell"], "合计手续费":[fee]})
+        result = self.evaluate(df)
+        return {method:float(result.loc[result['方式'] == method, '利润'].sum()) for method in self.books}
+
+
+def summarize(result):
+    # 每个情景在各方式下新增的已实现利润
+    return result.pivot_table(index='情景', columns='方式', values='利润', aggfunc='sum', sort=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在当前持仓上评估假设的交易，不修改历史和持仓')
+    parser.add_argument('platform')
+    parser.add_argument('scenarios', help='假设交易表：股票代码,数量,成交价格,买卖方向，可选 合计手续费、情景')
+    parser.add_argument('methods', nargs='*', type=int)
+    parser.add_argument('--lots', help='先进先出法的指定批次表')
+    parser.add_argument('--out', help='写出逐笔配对明细的 csv')
+    profiler.add_arguments(parser)
+    args = parser.parse_intermixed_args()
+    profiler.start(args)
+    whatif = WhatIf.load(args.platform, args.methods, args.lots)
+    schema = {k:v for k, v in loader.HISTORY_SCHEMA.items() if k not in ("合计手续费", "结算币种", "交易时间")}
+    scenarios = loader.read_table(args.scenarios, schema, keep_other=True)
+    with PROFILER.stage("whatif", len(scenarios)):
+        result = whatif.evaluate(scenarios)
+    print(summarize(result))
+    if args.out:
+        result.to_csv(args.out, index=False, encoding='utf-8-sig')